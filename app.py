@@ -1,20 +1,25 @@
 import logging
+import os
+import uuid
 
 import streamlit as st
 from dotenv import load_dotenv
 
 from engine import (
-    retrieve_relevant_examples,
-    refine_prompt,
-    evaluate_outputs,
-    get_llm_response,
+    AUTO_STRATEGY,
+    auto_strategy_available,
+    forge,
+    start_warmup,
     SYSTEM_PROMPTS,
+    tournament,
 )
+from history_store import get_history_store
+from metrics import start_metrics_server
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging for app.py
+# Configure logging for the app and the engine
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -22,10 +27,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Load the embedding model and FAISS index while the page renders.
+start_warmup()
+# Serve /metrics if PROMPTFORGE_METRICS_PORT is set.
+start_metrics_server()
 
-# Initialize session state
-if "history" not in st.session_state:
-    st.session_state.history = []
+
+# Forge results are kept in the history store, not in the session state; the
+# session only remembers its id and the sidebar page.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
+history = get_history_store()
+# Without an explicit user, all visitors of a deployment would share one history,
+# so each browser session gets a history of its own.
+SHARED_HISTORY = bool(os.getenv("PROMPTFORGE_HISTORY_USER"))
+HISTORY_USER = os.getenv("PROMPTFORGE_HISTORY_USER") or (
+    f"session-{st.session_state.session_id}"
+)
+HISTORY_PAGE_SIZE = int(os.getenv("PROMPTFORGE_HISTORY_PAGE_SIZE", 10))
 
 # --- UI Layout ---
 
@@ -44,25 +65,63 @@ st.markdown(
     """
 )
 
-# Sidebar for History
+# Sidebar for History. Only one page of entry summaries is read per rerun; the
+# outputs of an entry are loaded when it is opened.
 with st.sidebar:
-    st.header("Session History")
-    if st.session_state.history:
-        for i, entry in enumerate(reversed(st.session_state.history)):
+    st.header("History")
+    scope = (
+        st.radio("Show", ["This session", "All sessions"], horizontal=True)
+        if SHARED_HISTORY
+        else "This session"
+    )
+    session_filter = st.session_state.session_id if scope == "This session" else None
+    total = history.count(user_id=HISTORY_USER, session_id=session_filter)
+    pages = max((total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE, 1)
+    page = min(st.session_state.history_page, pages - 1)
+    entries = history.recent(
+        user_id=HISTORY_USER,
+        session_id=session_filter,
+        limit=HISTORY_PAGE_SIZE,
+        offset=page * HISTORY_PAGE_SIZE,
+    )
+    if entries:
+        for i, entry in enumerate(entries):
             with st.expander(
-                f"Prompt {len(st.session_state.history) - i}: {entry['user_prompt'][:30]}..."
+                f"Prompt {total - page * HISTORY_PAGE_SIZE - i}: {entry['user_prompt'][:30]}..."
             ):
                 st.write(f"**Strategy:** {entry['strategy']}")
                 st.write(f"**Original Prompt:** `{entry['user_prompt']}`")
                 st.write(f"**Refined Prompt:** `{entry['refined_prompt']}`")
-                st.write(f"**Original Output Score:** {entry['original_score']}")
-                st.write(f"**Refined Output Score:** {entry['refined_score']}")
+                st.write(f"**Original Output Score:** {entry['original_score']:g}")
+                st.write(f"**Refined Output Score:** {entry['refined_score']:g}")
                 st.metric(
                     "Quality Uplift",
-                    value=f"{entry['refined_score']}",
-                    delta=f"{entry['refined_score'] - entry['original_score']}",
+                    value=f"{entry['refined_score']:g}",
+                    delta=f"{entry['uplift']:g}",
                     delta_color="normal",
                 )
+                if st.toggle("Show outputs", key=f"history_outputs_{entry['id']}"):
+                    full = history.get(entry["id"])
+                    st.markdown("**Original Output:**")
+                    st.info(full["original_output"])
+                    st.markdown("**Refined Output:**")
+                    st.success(full["refined_output"])
+
+        newer, position, older = st.columns([1, 2, 1])
+        if newer.button("Newer", disabled=page == 0):
+            st.session_state.history_page = page - 1
+            st.rerun()
+        position.caption(f"Page {page + 1} of {pages}")
+        if older.button("Older", disabled=page >= pages - 1):
+            st.session_state.history_page = page + 1
+            st.rerun()
+
+        with st.expander("Mean uplift per strategy"):
+            st.dataframe(
+                history.strategy_stats(user_id=HISTORY_USER),
+                hide_index=True,
+                column_config={"improved_rate": st.column_config.NumberColumn(format="%.2f")},
+            )
     else:
         st.info("No history yet. Forge some prompts!")
 
@@ -74,13 +133,26 @@ user_prompt = st.text_area(
 )
 
 strategies = list(SYSTEM_PROMPTS.keys())
+if auto_strategy_available():
+    # Picked locally from the prompt's embedding, without another LLM call.
+    strategies.insert(0, AUTO_STRATEGY)
 selected_strategy = st.selectbox(
     "Select a refinement strategy:",
     options=strategies,
     index=0,  # Default to the first strategy
 )
 
-forge_button = st.button("Forge Prompt & Evaluate")
+tournament_strategies = st.multiselect(
+    "Strategies to compare in a tournament:",
+    options=list(SYSTEM_PROMPTS.keys()),
+    default=list(SYSTEM_PROMPTS.keys()),
+)
+
+forge_column, tournament_column = st.columns(2)
+with forge_column:
+    forge_button = st.button("Forge Prompt & Evaluate")
+with tournament_column:
+    tournament_button = st.button("Run Strategy Tournament")
 
 if forge_button and user_prompt:
     st.info(
@@ -88,90 +160,101 @@ if forge_button and user_prompt:
     )
     logger.info(f"User initiated forging for prompt: {user_prompt[:50]}...")
 
-    with st.spinner("Step 1/5: Retrieving relevant examples (RAG)..."):
-        # 1. Retrieve relevant examples using RAG
-        retrieved_examples_list = retrieve_relevant_examples(user_prompt, k=3)
-        retrieved_examples_str = (
-            "\n\n".join(retrieved_examples_list)
-            if retrieved_examples_list
-            else "No relevant examples found in knowledge base."
-        )
-        logger.info(f"Retrieved {len(retrieved_examples_list)} examples.")
-
-    with st.spinner("Step 2/5: Refining the prompt..."):
-        # 2. Refine the prompt
-        system_instruction_for_refiner = SYSTEM_PROMPTS.get(selected_strategy)
-        if not system_instruction_for_refiner:
-            st.error(
-                "Invalid strategy selected. Please choose from the available options."
-            )
-            logger.error(f"Invalid strategy selected: {selected_strategy}")
-            st.stop()
-
-        refined_prompt = refine_prompt(
-            user_prompt=user_prompt,
-            system_prompt=system_instruction_for_refiner,
-            retrieved_examples=retrieved_examples_str,
-        )
-        if not refined_prompt:
-            st.warning("Prompt refinement failed. Please check backend logs.")
-            logger.warning("Refined prompt is empty.")
-            refined_prompt = user_prompt  # Fallback to original prompt
-        logger.info("Prompt refined successfully.")
-
-    with st.spinner("Step 3/5: Generating response with original prompt..."):
-        # 3. Generate response with original prompt
-        original_output = get_llm_response(user_prompt)
-        if not original_output:
-            st.warning("Failed to generate output with original prompt.")
-            logger.warning("Original output is empty.")
-        logger.info("Original output generated.")
-
-    with st.spinner("Step 4/5: Generating response with refined prompt..."):
-        # 4. Generate response with refined prompt
-        refined_output = get_llm_response(refined_prompt)
-        if not refined_output:
-            st.warning("Failed to generate output with refined prompt.")
-            logger.warning("Refined output is empty.")
-        logger.info("Refined output generated.")
-
-    with st.spinner("Step 5/5: Evaluating outputs..."):
-        # 5. Automated Evaluation
-        scores = evaluate_outputs(original_output, refined_output, user_prompt)
-        original_score = scores.get("score_A", 0)
-        refined_score = scores.get("score_B", 0)
-        logger.info(
-            f"Evaluation complete: Original Score={original_score}, Refined Score={refined_score}"
-        )
-
-    st.success("Process complete! See results below.")
+    if selected_strategy not in SYSTEM_PROMPTS and selected_strategy != AUTO_STRATEGY:
+        st.error("Invalid strategy selected. Please choose from the available options.")
+        logger.error(f"Invalid strategy selected: {selected_strategy}")
+        st.stop()
 
-    # Display Results
+    # Both outputs are streamed into their columns as they are generated.
     st.subheader("Comparison & Evaluation")
 
     col1, col2 = st.columns(2)
 
     with col1:
         st.markdown("### Original Prompt Output")
-        st.info(original_output)
-        st.metric("Original Score", value=original_score)
+        original_placeholder = st.empty()
+        original_metric = st.empty()
 
     with col2:
         st.markdown("### Refined Prompt Output")
-        st.success(refined_output)
-        st.metric(
-            "Refined Score",
-            value=refined_score,
-            delta=refined_score - original_score,
-            delta_color="normal",
+        refined_placeholder = st.empty()
+        refined_metric = st.empty()
+
+    def show_chunk(stage, text):
+        if stage == "original_output":
+            original_placeholder.info(text)
+        elif stage == "refined_output":
+            refined_placeholder.success(text)
+
+    with st.spinner(
+        "Retrieving examples, refining the prompt and generating both responses concurrently..."
+    ):
+        # Retrieval -> refinement -> refined generation runs alongside the original
+        # generation; the judge starts once both outputs are ready. Examples are
+        # retrieved from the selected strategy's partition of the knowledge base.
+        try:
+            result = forge(user_prompt, selected_strategy, k=3, on_chunk=show_chunk)
+        except ValueError as e:
+            # Auto-selection can still fail when the embedding model is missing.
+            st.error(str(e))
+            logger.error(f"Forge failed: {e}")
+            st.stop()
+
+    if result.get("semantic_cache_hit"):
+        st.info(
+            f"Served from the semantic cache: a previous forge of "
+            f"\"{result['cached_prompt'][:80]}\" matched with similarity {result['similarity']:.2f}."
+        )
+
+    selected_strategy = result["strategy"]
+    if result.get("strategy_ranking"):
+        st.info(
+            f"Auto-selected **{selected_strategy}** "
+            f"({result['strategy_ranking'][0]['confidence']:.0%} confidence)."
         )
 
+    retrieved_examples_list = result["retrieved_examples"]
+    refined_prompt = result["refined_prompt"]
+    original_output = result["original_output"]
+    refined_output = result["refined_output"]
+    original_score = result["original_score"]
+    refined_score = result["refined_score"]
+    logger.info(f"Retrieved {len(retrieved_examples_list)} examples.")
+
+    if refined_prompt == user_prompt:
+        st.warning("Prompt refinement failed. Please check backend logs.")
+    if not original_output:
+        st.warning("Failed to generate output with original prompt.")
+        logger.warning("Original output is empty.")
+    if not refined_output:
+        st.warning("Failed to generate output with refined prompt.")
+        logger.warning("Refined output is empty.")
+    logger.info(
+        f"Evaluation complete: Original Score={original_score}, Refined Score={refined_score}"
+    )
+
+    st.success("Process complete! See results below.")
+
+    # Replace the streamed text with the final, stripped outputs and add the scores.
+    original_placeholder.info(original_output)
+    original_metric.metric("Original Score", value=original_score)
+    refined_placeholder.success(refined_output)
+    refined_metric.metric(
+        "Refined Score",
+        value=refined_score,
+        delta=refined_score - original_score,
+        delta_color="normal",
+    )
+
     # Use expander for detailed info
     with st.expander("Show Refined Prompt and RAG Details"):
         st.markdown(f"**Refinement Strategy:** `{selected_strategy}`")
+        if result.get("strategy_ranking"):
+            st.markdown("**Strategy Confidences:**")
+            st.dataframe(result["strategy_ranking"], hide_index=True)
         st.markdown(f"**Refined Prompt:**")
         st.code(refined_prompt, language="markdown")
-        st.markdown(f"**Retrieved Examples (for RAG):**")
+        st.markdown(f"**Retrieved Examples (for RAG, filtered to `{selected_strategy}`):**")
         if retrieved_examples_list:
             for i, example in enumerate(retrieved_examples_list):
                 st.text_area(f"Example {i+1}", example, height=200, key=f"example_{i}")
@@ -180,8 +263,8 @@ if forge_button and user_prompt:
                 "No specific examples were used from the knowledge base for refinement."
             )
 
-    # Update session history
-    st.session_state.history.append(
+    # Record the forge; the sidebar shows it from the next rerun on.
+    entry_id = history.append(
         {
             "user_prompt": user_prompt,
             "strategy": selected_strategy,
@@ -190,9 +273,75 @@ if forge_button and user_prompt:
             "refined_output": refined_output,
             "original_score": original_score,
             "refined_score": refined_score,
-        }
+        },
+        user_id=HISTORY_USER,
+        session_id=st.session_state.session_id,
     )
-    logger.info("Session history updated.")
+    st.session_state.history_page = 0
+    logger.info(f"Forge history updated (entry {entry_id}).")
+
+elif tournament_button and user_prompt and tournament_strategies:
+    logger.info(f"User initiated a tournament for prompt: {user_prompt[:50]}...")
+
+    with st.spinner(
+        f"Refining and generating under {len(tournament_strategies)} strategies "
+        "concurrently, then judging all responses in one call..."
+    ):
+        # One embedding, one baseline generation and one judge call are shared by
+        # all strategies.
+        result = tournament(user_prompt, tournament_strategies, k=3)
+
+    st.subheader("Strategy Tournament")
+    calls = result["llm_calls"]
+    cached = calls["planned"] - calls["made"]
+    st.info(
+        f"{calls['planned']} LLM calls instead of {calls['separate_forges']} for separate "
+        f"forges ({calls['saved']} saved)"
+        + (f"; {cached} answered from the cache or a concurrent call." if cached else ".")
+    )
+    st.metric("Original Score", value=result["baseline_score"])
+    st.dataframe(
+        [
+            {
+                "rank": rank,
+                "strategy": candidate["strategy"],
+                "score": candidate["score"],
+                "uplift": candidate["uplift"],
+            }
+            for rank, candidate in enumerate(result["candidates"], 1)
+        ],
+        hide_index=True,
+    )
+
+    with st.expander("Original Prompt Output"):
+        st.info(result["original_output"])
+    for rank, candidate in enumerate(result["candidates"], 1):
+        with st.expander(f"#{rank} {candidate['strategy']} (score {candidate['score']:g})"):
+            st.markdown(f"**Refined Prompt:**")
+            st.code(candidate["refined_prompt"], language="markdown")
+            st.markdown("**Refined Output:**")
+            st.success(candidate["refined_output"])
+
+    # Every candidate is recorded like a forge of its strategy.
+    for candidate in result["candidates"]:
+        history.append(
+            {
+                "user_prompt": user_prompt,
+                "strategy": candidate["strategy"],
+                "refined_prompt": candidate["refined_prompt"],
+                "original_output": result["original_output"],
+                "refined_output": candidate["refined_output"],
+                "original_score": result["baseline_score"],
+                "refined_score": candidate["score"],
+            },
+            user_id=HISTORY_USER,
+            session_id=st.session_state.session_id,
+        )
+    st.session_state.history_page = 0
+    logger.info(f"Forge history updated with {len(result['candidates'])} tournament entries.")
+
+elif tournament_button and user_prompt:
+    st.warning("Please select at least one strategy for the tournament.")
 
-elif forge_button and not user_prompt:
+elif (forge_button or tournament_button) and not user_prompt:
     st.warning("Please enter a prompt to begin.")
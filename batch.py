@@ -0,0 +1,303 @@
+"""
+Batch forging: runs many prompts through refine -> generate -> judge with bounded concurrency.
+
+Input is JSONL with one `{"id": ..., "prompt": ...}` object per line. Every prompt is
+forged under each selected strategy and results are appended to the output JSONL as
+soon as they finish, so an interrupted run can be resumed with the same command.
+
+Usage:
+    python batch.py --input prompts.jsonl --output results.jsonl --concurrency 8 --rpm 60
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from engine import (
+    SYSTEM_PROMPTS,
+    embed_queries,
+    forge_async,
+    get_embedding_cache,
+    retrieve_relevant_examples_batch,
+)
+from metrics import new_correlation_id, start_metrics_server
+from profiling import profile
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Spaces out acquisitions so that at most `per_minute` happen in any minute.
+
+    Args:
+        per_minute (float): The allowed rate. `None` or 0 disables limiting.
+    """
+
+    def __init__(self, per_minute: float = None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def job_id(record_id, strategy: str) -> str:
+    """The resume key of one (prompt, strategy) forge."""
+    return f"{record_id}::{strategy}"
+
+
+def read_prompts(path: str):
+    """
+    Lazily reads prompt records from a JSONL file.
+
+    Records without an "id" get their 1-based line number as id.
+
+    Yields:
+        dict: A record with at least "id" and "prompt".
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "prompt" not in record:
+                raise ValueError(f"{path}:{line_number}: record has no 'prompt' field")
+            record.setdefault("id", line_number)
+            yield record
+
+
+def load_completed_job_ids(path: str) -> set:
+    """
+    Collects the job ids already present in an output file.
+
+    A truncated last line, as left behind by a crash, is ignored.
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["job_id"])
+            except (json.JSONDecodeError, KeyError):
+                logger.warning(f"Skipping unreadable line in {path}")
+    return completed
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def forge_batch(
+    records,
+    output_path: str,
+    strategies: list = None,
+    concurrency: int = 8,
+    rate_limit_per_minute: float = None,
+    chunk_size: int = 64,
+    k: int = 3,
+) -> dict:
+    """
+    Forges every record under every strategy and streams results to a JSONL file.
+
+    Prompts are read in chunks; each chunk's queries are embedded with a single
+    `encode` call and searched once per strategy, filtered to that strategy's
+    examples, before its jobs are handed to the worker pool. Jobs whose id is
+    already in `output_path` are skipped.
+
+    Args:
+        records (iterable): Dicts with "id" and "prompt", e.g. from `read_prompts`.
+        output_path (str): The JSONL file results are appended to.
+        strategies (list, optional): Keys of `SYSTEM_PROMPTS`. Defaults to all of them.
+        concurrency (int): The maximum number of forges in flight.
+        rate_limit_per_minute (float, optional): The maximum number of forges started
+            per minute. Each forge makes four LLM calls.
+        chunk_size (int): The number of prompts embedded per `encode` call.
+        k (int): The number of relevant examples to retrieve per prompt.
+
+    Returns:
+        dict: Counts of "completed", "skipped" and "failed" jobs.
+    """
+    strategies = strategies or list(SYSTEM_PROMPTS.keys())
+    unknown = [s for s in strategies if s not in SYSTEM_PROMPTS]
+    if unknown:
+        raise ValueError(f"Unknown strategies: {unknown}")
+
+    done = load_completed_job_ids(output_path)
+    stats = {"completed": 0, "skipped": 0, "failed": 0}
+    limiter = RateLimiter(rate_limit_per_minute)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        # Terminate a line truncated by a crash before appending to it.
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if needs_newline:
+            out.write("\n")
+
+        async def worker():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    queue.task_done()
+                    return
+                record, strategy, examples, embedding = job
+                await limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    result = await forge_async(
+                        record["prompt"],
+                        strategy,
+                        k,
+                        retrieved_examples=examples,
+                        query_embedding=embedding,
+                    )
+                except Exception as e:
+                    logger.error(f"Forge failed for {job_id(record['id'], strategy)}: {e}")
+                    stats["failed"] += 1
+                else:
+                    result["retrieved_examples"] = len(result["retrieved_examples"])
+                    line = {
+                        "id": record["id"],
+                        "job_id": job_id(record["id"], strategy),
+                        **result,
+                        "elapsed_s": round(time.perf_counter() - started, 3),
+                    }
+                    out.write(json.dumps(line, ensure_ascii=False) + "\n")
+                    out.flush()
+                    stats["completed"] += 1
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+        try:
+            for chunk in _chunks(records, chunk_size):
+                pending = []
+                for record in chunk:
+                    todo = [
+                        s for s in strategies if job_id(record["id"], s) not in done
+                    ]
+                    stats["skipped"] += len(strategies) - len(todo)
+                    if todo:
+                        pending.append((record, todo))
+                if not pending:
+                    continue
+
+                prompts = [record["prompt"] for record, _ in pending]
+                embeddings = await asyncio.to_thread(embed_queries, prompts)
+                # One filtered search per strategy, all reusing the chunk's embeddings.
+                examples = {}
+                for strategy in strategies:
+                    if any(strategy in todo for _, todo in pending):
+                        examples[strategy] = await asyncio.to_thread(
+                            retrieve_relevant_examples_batch,
+                            prompts,
+                            k,
+                            query_embeddings=embeddings,
+                            strategy=strategy,
+                        )
+                if embeddings is None:
+                    embeddings = [None] * len(pending)
+                for position, ((record, todo), embedding) in enumerate(
+                    zip(pending, embeddings)
+                ):
+                    for strategy in todo:
+                        await queue.put(
+                            (record, strategy, examples[strategy][position], embedding)
+                        )
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+
+    logger.info(f"Batch finished: {stats}")
+    logger.info(f"Embedding cache: {get_embedding_cache().stats()}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Forge a JSONL file of prompts under one or more strategies."
+    )
+    parser.add_argument("--input", required=True, help="JSONL file of {id, prompt}.")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to.")
+    parser.add_argument(
+        "--strategies",
+        default="all",
+        help="Comma-separated strategy names, or 'all' (default).",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--rpm", type=float, default=None, help="Maximum forges started per minute."
+    )
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("-k", type=int, default=3, help="Examples retrieved per prompt.")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the whole run (see profiling.py); PROMPTFORGE_PROFILE also enables it.",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    start_metrics_server()
+    strategies = (
+        None
+        if args.strategies == "all"
+        else [s.strip() for s in args.strategies.split(",") if s.strip()]
+    )
+    # One profile covers the run; the forges inside it are not profiled on their own.
+    with profile(f"batch-{new_correlation_id()}", enabled=args.profile or None):
+        stats = asyncio.run(
+            forge_batch(
+                read_prompts(args.input),
+                args.output,
+                strategies=strategies,
+                concurrency=args.concurrency,
+                rate_limit_per_minute=args.rpm,
+                chunk_size=args.chunk_size,
+                k=args.k,
+            )
+        )
+    print(
+        f"Completed {stats['completed']}, skipped {stats['skipped']} already done, "
+        f"failed {stats['failed']}."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Async helpers for serving many concurrent requests.
+
+`MicroBatcher` groups single-item calls that arrive within a few milliseconds of
+each other into one batched call, e.g. one `encode` for many query embeddings.
+`Coalescer` runs identical in-flight requests once and hands every caller the
+same result.
+"""
+
+import asyncio
+import logging
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects items from concurrent callers and processes them in batches.
+
+    A batch is dispatched when it reaches `max_batch_size` items or `max_wait`
+    seconds after its first item arrived, whichever comes first. `batch_fn` runs
+    in a worker thread so it may be CPU bound.
+
+    Args:
+        batch_fn (callable): Takes a list of items and returns one result per item,
+            in order, or None if no results could be produced.
+        max_batch_size (int): The largest batch passed to `batch_fn`.
+        max_wait (float): Seconds to wait for more items before dispatching.
+        name (str): The label batch sizes are recorded under in the metrics.
+    """
+
+    def __init__(
+        self,
+        batch_fn,
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+        name: str = "batch",
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        """Queues `item` and returns its result once its batch has run."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: list) -> None:
+        get_metrics().observe("promptforge_batch_size", len(batch), batcher=self.name)
+        try:
+            results = await asyncio.to_thread(self.batch_fn, [item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"Batched call '{self.name}' failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if results is None:
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class Coalescer:
+    """
+    Shares one execution among identical concurrent requests.
+
+    The first caller for a key starts the work; callers arriving with the same key
+    while it is in flight await the same task. A caller that is cancelled does not
+    cancel the shared work.
+    """
+
+    def __init__(self, name: str = "requests"):
+        self.name = name
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def run(self, key, factory):
+        """
+        Args:
+            key: A hashable identity of the request.
+            factory (callable): Returns the coroutine doing the work; only called
+                for the first caller of `key`.
+
+        Returns:
+            The work's result.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            get_metrics().inc("promptforge_coalesced_total", coalescer=self.name)
+        return await asyncio.shield(task)
@@ -0,0 +1,128 @@
+"""
+Recall-vs-latency benchmark for the supported FAISS index types.
+
+Builds every index spec over a synthetic clustered corpus of normalized vectors
+and reports, per spec and search setting: recall@k against the exact Flat
+baseline, single-query QPS, build (train + add) time and serialized index size,
+which is what the index occupies in memory.
+
+Usage:
+    python -m benchmarks.bench_ann --n 100000 --queries 1000 --k 3
+"""
+
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from vector_store import apply_search_params, create_index, resolve_index_spec
+
+SPECS = ("Flat", "IVF-Flat", "IVF-PQ", "HNSW")
+NPROBE_SWEEP = (1, 4, 16, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128)
+
+
+def synthetic_corpus(n: int, dimension: int, clusters: int, seed: int = 0):
+    """Normalized vectors drawn around random centres, like topic-clustered prompts."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((n, dimension)).astype(
+        "float32"
+    )
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def timed_search(index, queries: np.ndarray, k: int):
+    """Searches one query at a time, as `retrieve_relevant_examples` does."""
+    found = np.empty((len(queries), k), dtype="int64")
+    started = time.perf_counter()
+    for i in range(len(queries)):
+        _, found[i] = index.search(queries[i : i + 1], k)
+    elapsed = time.perf_counter() - started
+    return found, len(queries) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=100_000, help="Corpus size.")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--train-size", type=int, default=100_000)
+    parser.add_argument("--specs", default=",".join(SPECS))
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.n + args.queries, args.dimension, args.clusters)
+    vectors, queries = corpus[: args.n], corpus[args.n :]
+    ids = np.arange(args.n, dtype="int64")
+    rng = np.random.default_rng(1)
+
+    truth = None
+    results = []
+    print(
+        f"{'spec':<28} {'setting':<14} {'recall@' + str(args.k):>9} {'qps':>10} "
+        f"{'build_s':>8} {'size_mb':>8}"
+    )
+    for spec in args.specs.split(","):
+        factory_string = resolve_index_spec(spec, args.n, args.dimension)
+        index = create_index(factory_string, args.dimension)
+        started = time.perf_counter()
+        if not index.is_trained:
+            sample = vectors[
+                rng.choice(args.n, min(args.train_size, args.n), replace=False)
+            ]
+            index.train(sample)
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - started
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+
+        if "IVF" in factory_string:
+            settings = [{"nprobe": v} for v in NPROBE_SWEEP]
+        elif "HNSW" in factory_string:
+            settings = [{"ef_search": v} for v in EF_SEARCH_SWEEP]
+        else:
+            settings = [{}]
+
+        for setting in settings:
+            apply_search_params(index, **setting)
+            found, qps = timed_search(index, queries, args.k)
+            if truth is None:
+                # The first spec is the exact Flat baseline.
+                truth = found
+            recall = recall_at_k(found, truth)
+            label = ",".join(f"{k}={v}" for k, v in setting.items()) or "exact"
+            print(
+                f"{factory_string:<28} {label:<14} {recall:>9.3f} {qps:>10.0f} "
+                f"{build_seconds:>8.2f} {size_mb:>8.1f}"
+            )
+            results.append(
+                {
+                    "spec": spec,
+                    "factory": factory_string,
+                    **setting,
+                    f"recall_at_{args.k}": recall,
+                    "qps": qps,
+                    "build_seconds": build_seconds,
+                    "size_mb": size_mb,
+                }
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
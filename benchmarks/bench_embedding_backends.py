@@ -0,0 +1,144 @@
+"""
+Query embedding cost of the PyTorch and ONNX Runtime backends.
+
+Each backend is loaded in a fresh interpreter and reports its load time, single
+query encode latency, throughput at batch sizes 1, 8 and 64, and peak RSS. The
+cosine similarity of every backend's embeddings to the PyTorch ones shows whether
+an index built with one can be queried with the other.
+
+Requires an export from `python onnx_embedder.py --quantize`.
+
+Usage:
+    python -m benchmarks.bench_embedding_backends --threads 4 --json embed.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from knowledge_base import KNOWLEDGE_BASE
+from onnx_embedder import BACKENDS, OnnxEmbedder, default_model_dir
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+BATCH_SIZES = (1, 8, 64)
+
+
+def sample_texts(n: int) -> list:
+    prompts = [entry["prompt_text"] for entry in KNOWLEDGE_BASE]
+    return [f"{prompts[i % len(prompts)]} (variant {i})" for i in range(n)]
+
+
+def load(backend: str, model_dir: str, threads: int):
+    if backend == "torch":
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        return SentenceTransformer(MODEL_NAME, device="cpu")
+    return OnnxEmbedder(model_dir, quantized=backend == "onnx-int8", threads=threads)
+
+
+def worker(backend: str, model_dir: str, threads: int, texts: int, repeats: int, output: str):
+    """Runs in a subprocess, so peak RSS covers exactly one backend."""
+    import resource
+
+    started = time.perf_counter()
+    model = load(backend, model_dir, threads)
+    load_seconds = time.perf_counter() - started
+
+    sample = sample_texts(texts)
+    model.encode(sample[:8], normalize_embeddings=True)  # Warm up.
+    single = []
+    for text in sample[:repeats]:
+        started = time.perf_counter()
+        model.encode([text], normalize_embeddings=True)
+        single.append(time.perf_counter() - started)
+
+    throughput = {}
+    for batch_size in BATCH_SIZES:
+        started = time.perf_counter()
+        embeddings = model.encode(sample, batch_size=batch_size, normalize_embeddings=True)
+        throughput[batch_size] = len(sample) / (time.perf_counter() - started)
+
+    np.save(output, np.asarray(embeddings, dtype="float32"))
+    print(
+        json.dumps(
+            {
+                "load_s": load_seconds,
+                "latency_p50_ms": float(np.median(single)) * 1000,
+                "latency_p95_ms": float(np.quantile(single, 0.95)) * 1000,
+                **{f"texts_per_s_batch_{b}": v for b, v in throughput.items()},
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--model-dir", default=default_model_dir(MODEL_NAME))
+    parser.add_argument("--threads", type=int, default=0, help="0 lets each runtime choose.")
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=50, help="Single-query encodes timed.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.model_dir, args.threads, args.texts, args.repeats, args.output)
+        return
+
+    results, embeddings = {}, {}
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends.split(","):
+            output = os.path.join(directory, f"{backend}.npy")
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_embedding_backends"]
+                + ["--worker", backend, "--model-dir", args.model_dir]
+                + ["--threads", str(args.threads), "--texts", str(args.texts)]
+                + ["--repeats", str(args.repeats), "--output", output],
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode:
+                error = process.stderr.strip().splitlines()[-1:] or ["failed"]
+                print(f"{backend:<10} skipped: {error[0]}")
+                continue
+            results[backend] = json.loads(process.stdout.strip().splitlines()[-1])
+            embeddings[backend] = np.load(output)
+
+    reference = embeddings.get("torch")
+    print(
+        f"{'backend':<10} {'load_s':>7} {'p50_ms':>7} {'p95_ms':>7} "
+        + " ".join(f"{'b' + str(b) + '/s':>8}" for b in BATCH_SIZES)
+        + f" {'rss_mb':>7} {'cos_min':>8} {'cos_mean':>8}"
+    )
+    for backend, result in results.items():
+        if reference is not None:
+            cosines = np.sum(embeddings[backend] * reference, axis=1)
+            result["cosine_min"] = float(cosines.min())
+            result["cosine_mean"] = float(cosines.mean())
+        print(
+            f"{backend:<10} {result['load_s']:>7.2f} {result['latency_p50_ms']:>7.2f} "
+            f"{result['latency_p95_ms']:>7.2f} "
+            + " ".join(f"{result[f'texts_per_s_batch_{b}']:>8.0f}" for b in BATCH_SIZES)
+            + f" {result['peak_rss_mb']:>7.0f} {result.get('cosine_min', float('nan')):>8.5f}"
+            f" {result.get('cosine_mean', float('nan')):>8.5f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Hit rate, latency and memory of the query embedding cache under repeated traffic.
+
+Replays a stream of queries drawn from a pool of distinct prompts with a Zipf
+popularity, some re-sent with different whitespace as resubmits and reruns
+produce, through `engine.embed_queries` in requests of `--batch` queries. Runs
+once with the cache disabled and once per memory budget, and reports the hit
+rate, encoder calls, mean latency per query and the bytes the cached vectors use.
+Also reports how far the float16 round trip moves an embedding (the smallest
+cosine similarity between a cached vector and its float32 original).
+
+Embeddings come from the engine's model, so set PROMPTFORGE_EMBEDDING_BACKEND
+(e.g. to onnx) as for the app.
+
+Usage:
+    python -m benchmarks.bench_embedding_cache --queries 20000 --distinct 2000 \
+        --cache-mb 0.5,2,32
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import engine
+from embedding_cache import EmbeddingCache
+
+WORDS = (
+    "write a story about a brave knight explain quantum computing to a child "
+    "summarize the causes of the french revolution in a markdown table for a patient"
+).split()
+
+
+def make_traffic(queries: int, distinct: int, zipf: float, reformat: float, seed: int):
+    rng = np.random.default_rng(seed)
+    pool = [" ".join(rng.choice(WORDS, rng.integers(6, 30))) for _ in range(distinct)]
+    weights = 1.0 / np.arange(1, distinct + 1) ** zipf
+    picks = rng.choice(distinct, size=queries, p=weights / weights.sum())
+    traffic = []
+    for pick in picks:
+        text = pool[pick]
+        if rng.random() < reformat:
+            text = "  " + text.replace(" ", "  ", 2) + "\n"
+        traffic.append(text)
+    return pool, traffic
+
+
+def replay(cache: EmbeddingCache, traffic: list, batch: int) -> dict:
+    engine.set_embedding_cache(cache)
+    started = time.perf_counter()
+    for start in range(0, len(traffic), batch):
+        engine.embed_queries(traffic[start : start + batch])
+    seconds = time.perf_counter() - started
+    stats = cache.stats()
+    return {
+        "cache_mb": round(cache.max_bytes / 2**20, 3) if cache.enabled else 0,
+        "hit_rate": stats["hit_rate"],
+        "encode_calls": stats["encode_calls"],
+        "us_per_query": seconds / len(traffic) * 1e6,
+        "entries": stats["entries"],
+        "evictions": stats["evictions"],
+        "memory_bytes": stats["memory_bytes"],
+    }
+
+
+def float16_fidelity(pool: list) -> float:
+    engine.set_embedding_cache(EmbeddingCache(enabled=False))
+    exact = engine.embed_queries(pool)
+    engine.set_embedding_cache(EmbeddingCache())
+    cached = engine.embed_queries(pool)
+    cosine = (exact * cached).sum(axis=1) / (
+        np.linalg.norm(exact, axis=1) * np.linalg.norm(cached, axis=1)
+    )
+    return float(cosine.min())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=20_000)
+    parser.add_argument("--distinct", type=int, default=2_000, help="Distinct prompts.")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Popularity skew.")
+    parser.add_argument(
+        "--reformat", type=float, default=0.3, help="Share of queries re-sent with other whitespace."
+    )
+    parser.add_argument("--batch", type=int, default=1, help="Queries per embed_queries call.")
+    parser.add_argument(
+        "--cache-mb", default="0.5,2,32", help="Comma-separated memory budgets to compare."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    if engine.get_rag_model() is None:
+        raise SystemExit("The embedding model could not be loaded.")
+    pool, traffic = make_traffic(
+        args.queries, args.distinct, args.zipf, args.reformat, args.seed
+    )
+    engine.embed_queries(pool[:8])  # Warm up.
+
+    rows = [replay(EmbeddingCache(enabled=False), traffic, args.batch)]
+    for mb in (float(value) for value in args.cache_mb.split(",")):
+        rows.append(replay(EmbeddingCache(max_bytes=int(mb * 2**20)), traffic, args.batch))
+    fidelity = float16_fidelity(pool)
+
+    print(f"{len(traffic)} queries over {len(pool)} prompts, {args.batch} per call")
+    print(
+        f"{'cache_mb':>8} {'hit_rate':>8} {'encodes':>8} {'us/query':>9} "
+        f"{'entries':>8} {'evictions':>9} {'bytes':>10}"
+    )
+    for row in rows:
+        print(
+            f"{row['cache_mb']:>8g} {row['hit_rate']:>8.3f} {row['encode_calls']:>8} "
+            f"{row['us_per_query']:>9.1f} {row['entries']:>8} {row['evictions']:>9} "
+            f"{row['memory_bytes']:>10}"
+        )
+    print(f"float16 round trip: min cosine to the float32 embedding 1 - {1 - fidelity:.1e}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {"config": vars(args), "results": rows, "min_float16_cosine": fidelity},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Cost of the forge history store as it grows.
+
+Appends synthetic forge records of realistic output size to a fresh SQLite
+history, then times what the Streamlit sidebar does on every rerun (count one
+page of summaries, the per-strategy aggregate) and opening one entry. Also
+reports the on-disk size against the raw size of the records.
+
+Usage:
+    python -m benchmarks.bench_history --entries 100000 --json history.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from history_store import SQLiteHistoryStore
+
+STRATEGIES = ("Chain-of-Thought", "Persona", "Few-Shot", "Structured Output")
+WORDS = "the model output explains each step of the analysis in plain terms".split()
+
+
+def fake_record(rng, output_words: int) -> dict:
+    def text(n):
+        return " ".join(rng.choice(WORDS, n))
+
+    original_score = int(rng.integers(3, 9))
+    return {
+        "user_prompt": text(20),
+        "strategy": STRATEGIES[rng.integers(len(STRATEGIES))],
+        "refined_prompt": text(120),
+        "original_output": text(output_words),
+        "refined_output": text(output_words),
+        "original_score": original_score,
+        "refined_score": min(original_score + int(rng.integers(-1, 4)), 10),
+    }
+
+
+def timed(fn, repeats: int) -> dict:
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1000
+    return {"mean_ms": latencies.mean(), "p95_ms": np.quantile(latencies, 0.95)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--output-words", type=int, default=400, help="Words per output.")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.sqlite3")
+        store = SQLiteHistoryStore(path)
+        raw_bytes = 0
+        started = time.perf_counter()
+        for i in range(args.entries):
+            record = fake_record(rng, args.output_words)
+            raw_bytes += sum(len(str(v).encode("utf-8")) for v in record.values())
+            store.append(record, user_id=f"user{i % args.users}", session_id=f"s{i // 50}")
+        append_ms = (time.perf_counter() - started) * 1000 / args.entries
+        store._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        user = "user0"
+        newest = store.recent(user_id=user, limit=1)[0]["id"]
+        results = {
+            "append_mean_ms": append_ms,
+            "raw_mb": raw_bytes / 2**20,
+            "db_mb": os.path.getsize(path) / 2**20,
+            "count": timed(lambda: store.count(user_id=user), args.repeats),
+            "page": timed(
+                lambda: store.recent(user_id=user, limit=args.page_size, offset=args.page_size),
+                args.repeats,
+            ),
+            "strategy_stats_user": timed(
+                lambda: store.strategy_stats(user_id=user), args.repeats
+            ),
+            "strategy_stats_all": timed(lambda: store.strategy_stats(), max(args.repeats // 20, 1)),
+            "open_entry": timed(lambda: store.get(newest), args.repeats),
+        }
+
+    print(
+        f"{args.entries} entries: append {results['append_mean_ms']:.3f} ms each, "
+        f"{results['raw_mb']:.1f} MB raw -> {results['db_mb']:.1f} MB on disk"
+    )
+    print(f"{'query':<22} {'mean_ms':>8} {'p95_ms':>8}")
+    for name, value in results.items():
+        if isinstance(value, dict):
+            print(f"{name:<22} {value['mean_ms']:>8.3f} {value['p95_ms']:>8.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2, default=float)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Retrieval quality and latency of dense, BM25 and hybrid (RRF) search.
+
+Builds a synthetic corpus whose documents share topic vocabulary and embeddings
+with their cluster but each carry a rare exact term (like "DCF" or "HIPAA") that
+only a few documents of the topic contain. Most queries name their target
+document's rare term plus a few topic words, and every query embedding is a noisy
+copy of the target's. Reports recall@k and MRR@k against the target, the mean
+pairwise similarity of the top k (redundancy), and per-query latency, for each
+retrieval mode, a sweep of fusion weights, and dense and hybrid results re-ranked
+with maximal marginal relevance.
+
+Usage:
+    python -m benchmarks.bench_hybrid --n 100000 --queries 1000 -k 3
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from lexical_index import BM25Index, reciprocal_rank_fusion, write_bm25_index
+from vector_store import maximal_marginal_relevance, reconstruct_vectors
+
+CANDIDATES_PER_RESULT = 10
+# (dense weight, lexical weight) pairs evaluated in hybrid mode.
+WEIGHTS = ((1.0, 1.0), (2.0, 1.0), (1.0, 2.0))
+
+
+def synthetic_corpus(n: int, dimension: int, spread: float, seed: int = 0):
+    """Texts and normalized embeddings of n documents in n // 100 topics."""
+    rng = np.random.default_rng(seed)
+    topics = max(n // 100, 1)
+    labels = rng.integers(0, topics, size=n)
+    topic_words = rng.integers(0, 5000, size=(topics, 40))
+    common = rng.zipf(1.3, size=(n, 10)) % 5000
+    chosen = topic_words[labels[:, None], rng.integers(0, 40, size=(n, 20))]
+    # Every rare code is shared by about five documents of the same topic, so the
+    # code alone does not single out a document and topic words do not either.
+    codes = np.empty(n, dtype="int64")
+    order = np.argsort(labels, kind="stable")
+    codes[order] = np.arange(n) // 5
+    texts = [
+        " ".join([f"w{w}" for w in np.concatenate((chosen[i], common[i]))])
+        + f" code{codes[i]}"
+        for i in range(n)
+    ]
+
+    centres = rng.standard_normal((topics, dimension)).astype("float32")
+    vectors = centres[labels] + spread * rng.standard_normal((n, dimension)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return texts, vectors, chosen, codes
+
+
+def make_queries(
+    vectors, chosen, codes, count: int, noise: float, code_rate: float, seed: int = 1
+):
+    rng = np.random.default_rng(seed)
+    targets = rng.choice(len(vectors), size=count, replace=False)
+    texts = [
+        " ".join(
+            ([f"code{codes[t]}"] if rng.random() < code_rate else [])
+            + [f"w{w}" for w in rng.choice(chosen[t], 3)]
+        )
+        for t in targets
+    ]
+    embeddings = vectors[targets] + noise * rng.standard_normal(
+        (count, vectors.shape[1])
+    ).astype("float32")
+    faiss.normalize_L2(embeddings)
+    return targets, texts, embeddings
+
+
+def evaluate(rankings, targets, k: int, vectors) -> dict:
+    recall, reciprocal, redundancy = 0, 0.0, []
+    for ranking, target in zip(rankings, targets):
+        top = list(ranking[:k])
+        if target in top:
+            recall += 1
+            reciprocal += 1 / (top.index(target) + 1)
+        if len(top) > 1:
+            similarity = vectors[top] @ vectors[top].T
+            redundancy.append(similarity[np.triu_indices(len(top), 1)].mean())
+    return {
+        f"recall_at_{k}": recall / len(targets),
+        f"mrr_at_{k}": reciprocal / len(targets),
+        "redundancy": float(np.mean(redundancy)) if redundancy else 0.0,
+    }
+
+
+def timed(search, items):
+    results, latencies = [], []
+    for item in items:
+        started = time.perf_counter()
+        results.append(search(item))
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1000
+    return results, {"mean_ms": latencies.mean(), "p95_ms": np.quantile(latencies, 0.95)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=100_000, help="Corpus size.")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument(
+        "--spread", type=float, default=0.25, help="Document embedding spread within a topic."
+    )
+    parser.add_argument("--noise", type=float, default=0.08, help="Query embedding noise.")
+    parser.add_argument(
+        "--code-rate", type=float, default=0.7, help="Share of queries naming the rare term."
+    )
+    parser.add_argument(
+        "--mmr-factor", type=int, default=4, help="MMR over-fetch factor (candidates per k)."
+    )
+    parser.add_argument("--mmr-lambda", type=float, default=0.7)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    texts, vectors, chosen, codes = synthetic_corpus(args.n, args.dimension, args.spread)
+    targets, query_texts, query_embeddings = make_queries(
+        vectors, chosen, codes, args.queries, args.noise, args.code_rate
+    )
+    print(f"Generated {args.n} documents in {time.perf_counter() - started:.1f}s")
+
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(args.dimension))
+    index.add_with_ids(vectors, np.arange(args.n, dtype="int64"))
+    depth = args.k * CANDIDATES_PER_RESULT
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        meta = write_bm25_index(directory + "/bm25", np.arange(args.n), texts)
+        build_seconds = time.perf_counter() - started
+        bm25 = BM25Index(directory + "/bm25")
+        print(
+            f"Built BM25 index in {build_seconds:.1f}s: {meta['terms']} terms, "
+            f"{meta['postings']} postings"
+        )
+
+        dense, dense_time = timed(
+            lambda q: index.search(q[None, :], depth)[1][0], query_embeddings
+        )
+        lexical, lexical_time = timed(lambda q: bm25.search(q, depth), query_texts)
+
+    def rerank(rankings, by_rank):
+        """Re-ranks `args.k * args.mmr_factor` candidates per query with MMR."""
+        width = args.k * args.mmr_factor
+
+        def one(pair):
+            query, ranking = pair
+            candidates = np.full((1, width), -1, dtype="int64")
+            candidates[0, : min(len(ranking), width)] = ranking[:width]
+            relevance = (1 - np.arange(width) / width)[None, :] if by_rank else None
+            picks = maximal_marginal_relevance(
+                query[None, :],
+                reconstruct_vectors(index, candidates),
+                candidates >= 0,
+                args.k,
+                args.mmr_lambda,
+                relevance,
+            )[0]
+            return candidates[0, picks[picks >= 0]]
+
+        return timed(one, list(zip(query_embeddings, rankings)))
+
+    def add_time(*times):
+        return {key: sum(t[key] for t in times) for key in ("mean_ms", "p95_ms")}
+
+    rows = [
+        {"mode": "dense", **evaluate(dense, targets, args.k, vectors), **dense_time},
+        {"mode": "lexical", **evaluate(lexical, targets, args.k, vectors), **lexical_time},
+    ]
+    for dense_weight, lexical_weight in WEIGHTS:
+        fused, fusion_time = timed(
+            lambda pair: reciprocal_rank_fusion(
+                list(pair), [dense_weight, lexical_weight], limit=depth
+            ),
+            list(zip(dense, lexical)),
+        )
+        rows.append(
+            {
+                "mode": f"hybrid {dense_weight:g}:{lexical_weight:g}",
+                **evaluate(fused, targets, args.k, vectors),
+                # A hybrid query runs both searches and the fusion.
+                **add_time(dense_time, lexical_time, fusion_time),
+            }
+        )
+        if (dense_weight, lexical_weight) == WEIGHTS[0]:
+            hybrid, hybrid_time = fused, add_time(dense_time, lexical_time, fusion_time)
+
+    # MMR re-ranks the same over-fetched candidates; its time adds to the search's.
+    reranked, rerank_time = rerank(dense, by_rank=False)
+    rows.append(
+        {
+            "mode": "dense+mmr",
+            **evaluate(reranked, targets, args.k, vectors),
+            **add_time(dense_time, rerank_time),
+        }
+    )
+    reranked, rerank_time = rerank(hybrid, by_rank=True)
+    rows.append(
+        {
+            "mode": "hybrid+mmr",
+            **evaluate(reranked, targets, args.k, vectors),
+            **add_time(hybrid_time, rerank_time),
+        }
+    )
+
+    print(
+        f"{'mode':<14} {'recall@' + str(args.k):>9} {'mrr@' + str(args.k):>7} "
+        f"{'redundancy':>10} {'mean_ms':>8} {'p95_ms':>8}"
+    )
+    for row in rows:
+        print(
+            f"{row['mode']:<14} {row[f'recall_at_{args.k}']:>9.3f} "
+            f"{row[f'mrr_at_{args.k}']:>7.3f} {row['redundancy']:>10.3f} "
+            f"{row['mean_ms']:>8.3f} {row['p95_ms']:>8.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2, default=float)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Throughput and peak memory of streaming ingestion against the in-memory build.
+
+Writes synthetic JSONL knowledge bases of increasing size and indexes each one
+in a fresh interpreter, either with `ingest.ingest` (streamed in chunks, encoded
+by N worker processes) or by loading the whole file into a list and calling
+`vector_store.build_index`, as `knowledge_base.py` does. Reports records per
+second and the peak RSS of the indexing process and of its workers.
+
+After the first streaming run, the same file is ingested again with
+`append=True, on_error="skip"` into the index it built, which must reject every
+record as a duplicate and add none (the "re-append" row).
+
+Usage:
+    python -m benchmarks.bench_ingest --sizes 20000,100000 --workers 0,2 \
+        --embedding-backend onnx
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+WORDS = (
+    "analyze the quarterly report and summarize key risks for a patient audience "
+    "explain each step of the migration plan with examples in a markdown table"
+).split()
+
+PROBE = """
+import json, resource, time
+started = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": seconds,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "children_max_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+}}))
+"""
+
+STREAMING = """
+from ingest import ingest
+ingest({input!r}, embedding_backend={backend!r}, workers={workers}, chunk_size={chunk_size})
+"""
+
+REAPPEND = """
+from ingest import ingest
+stats = ingest(
+    {input!r}, embedding_backend={backend!r}, workers=0, chunk_size={chunk_size},
+    append=True, on_error="skip",
+)
+assert stats["ingested"] == 0 and stats["duplicates"] == {size}, stats
+"""
+
+IN_MEMORY = """
+import json
+from ingest import load_model
+from vector_store import build_index
+model = load_model("all-MiniLM-L6-v2", {backend!r})
+with open({input!r}, encoding="utf-8") as f:
+    knowledge_base = [json.loads(line) for line in f]
+build_index(knowledge_base, model, "all-MiniLM-L6-v2", embedding_backend={backend!r})
+"""
+
+
+def write_corpus(path: str, size: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            entry = {
+                "domain": f"Domain {i % 12}",
+                "strategy": f"Strategy {i % 8}",
+                "prompt_id": f"SYN-{i:08d}",
+                "prompt_text": " ".join(rng.choice(WORDS, 60)),
+                "explanation": " ".join(rng.choice(WORDS, 30)),
+            }
+            f.write(json.dumps(entry) + "\n")
+
+
+def measure(statement: str, directory: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=directory,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join([os.getcwd()] + sys.path)},
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="20000,100000", help="Comma-separated corpus sizes.")
+    parser.add_argument(
+        "--workers", default="0,2", help="Comma-separated encoding process counts to stream with."
+    )
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument(
+        "--embedding-backend", choices=("torch", "onnx", "onnx-int8"), default="onnx"
+    )
+    parser.add_argument(
+        "--skip-in-memory", action="store_true", help="Only measure streaming ingestion."
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    rows = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = os.path.join(directory, "corpus.jsonl")
+            write_corpus(corpus, size)
+            runs = [
+                (
+                    f"stream/{workers}w",
+                    STREAMING.format(
+                        input=corpus,
+                        backend=args.embedding_backend,
+                        workers=int(workers),
+                        chunk_size=args.chunk_size,
+                    ),
+                )
+                for workers in args.workers.split(",")
+            ]
+            runs.insert(
+                1,
+                (
+                    "re-append",
+                    REAPPEND.format(
+                        input=corpus,
+                        backend=args.embedding_backend,
+                        chunk_size=args.chunk_size,
+                        size=size,
+                    ),
+                ),
+            )
+            if not args.skip_in_memory:
+                runs.append(
+                    ("in-memory", IN_MEMORY.format(input=corpus, backend=args.embedding_backend))
+                )
+            for name, statement in runs:
+                # Re-appending needs the index the run before it built.
+                for entry in [] if name == "re-append" else os.listdir(directory):
+                    path = os.path.join(directory, entry)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    elif entry != "corpus.jsonl":
+                        os.remove(path)
+                result = measure(statement, directory)
+                rows.append(
+                    {
+                        "mode": name,
+                        "records": size,
+                        "records_per_second": size / result["seconds"],
+                        "peak_rss_mb": result["max_rss_kb"] / 1024,
+                        "worker_peak_rss_mb": result["children_max_rss_kb"] / 1024,
+                    }
+                )
+
+    print(f"{'mode':<12} {'records':>9} {'records/s':>10} {'peak_rss_mb':>11} {'worker_mb':>9}")
+    for row in rows:
+        print(
+            f"{row['mode']:<12} {row['records']:>9} {row['records_per_second']:>10.0f} "
+            f"{row['peak_rss_mb']:>11.1f} {row['worker_peak_rss_mb']:>9.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
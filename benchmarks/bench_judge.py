@@ -0,0 +1,171 @@
+"""
+Judge calls, latency and score accuracy of the single and batched judge modes.
+
+Evaluates pairs of outputs with a known true quality, concurrently as a batch run
+does, against a simulated judge that adds a position bias to whichever response
+it sees first, plus noise. Reports judge calls per pair, wall time, the error of
+the measured uplift (refined minus original score) against the true uplift, the
+mean bias left in the uplift, and how many batched responses failed validation
+and fell back to single-pair calls.
+
+Usage:
+    python -m benchmarks.bench_judge --pairs 200 --bias 1.0 --malformed-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import numpy as np
+
+import engine
+from context_budget import ContextBudget
+from fake_llm import FakeResponse
+from llm_cache import LLMCache
+from metrics import Metrics, set_metrics
+
+_QUALITY = re.compile(r"quality (\d+)")
+
+
+class SimulatedJudge:
+    """
+    A client that scores every "quality N" response N + noise, plus `bias` when it
+    is Response A. With probability `malformed_rate` a batched answer is cut short.
+    """
+
+    def __init__(self, delay: float, bias: float, noise: float, malformed_rate: float, seed=0):
+        self.delay = delay
+        self.bias = bias
+        self.noise = noise
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = self
+        self.aio = type("Aio", (), {"models": _AsyncModels(self)})()
+
+    def _score(self, quality: int, first: bool) -> int:
+        value = quality + (self.bias if first else 0) + self._random.gauss(0, self.noise)
+        return int(min(max(round(value), 1), 10))
+
+    def _answer(self, contents: str, config: dict) -> str:
+        with self._lock:
+            self.calls += 1
+            sections = contents.split("**Evaluation ")[1:] or [contents]
+            verdicts = []
+            for section in sections:
+                a, b = (int(q) for q in _QUALITY.findall(section)[:2])
+                verdicts.append(
+                    {"score_A": self._score(a, True), "score_B": self._score(b, False)}
+                )
+            if "verdicts" not in config["response_schema"].model_fields:
+                return json.dumps(verdicts[0])
+            if self._random.random() < self.malformed_rate:
+                verdicts = verdicts[:-1]
+            return json.dumps({"verdicts": verdicts})
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.delay)
+        return FakeResponse(self._answer(contents, config))
+
+
+class _AsyncModels:
+    def __init__(self, judge):
+        self._judge = judge
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self._judge.delay)
+        return FakeResponse(self._judge._answer(contents, config))
+
+
+def make_pairs(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    original = rng.integers(3, 8, size=count)
+    refined = np.clip(original + rng.integers(-1, 4, size=count), 1, 10)
+    pairs = [
+        (f"Response of quality {o}.", f"Response of quality {r}.", f"Prompt {i}")
+        for i, (o, r) in enumerate(zip(original, refined))
+    ]
+    return pairs, refined - original
+
+
+async def evaluate_all(pairs, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(pair):
+        async with semaphore:
+            return await engine.evaluate_outputs_async(*pair)
+
+    return await asyncio.gather(*(one(pair) for pair in pairs))
+
+
+def run(mode: str, args, pairs, true_uplift) -> dict:
+    os.environ["PROMPTFORGE_JUDGE_MODE"] = mode
+    os.environ["PROMPTFORGE_JUDGE_BATCH_PAIRS"] = str(args.batch_pairs)
+    metrics = Metrics()
+    set_metrics(metrics)
+    judge = SimulatedJudge(args.delay, args.bias, args.noise, args.malformed_rate)
+    engine.set_gemini_client(judge)
+
+    started = time.perf_counter()
+    scores = asyncio.run(evaluate_all(pairs, args.concurrency))
+    seconds = time.perf_counter() - started
+
+    uplift = np.array([s["score_B"] - s["score_A"] for s in scores])
+    fallbacks = sum(
+        c["value"]
+        for c in metrics.snapshot()["counters"]
+        if c["labels"].get("stage") == "scores_batch_parse"
+    )
+    return {
+        "mode": mode,
+        "judge_calls_per_pair": judge.calls / len(pairs),
+        "seconds": seconds,
+        "uplift_mae": float(np.abs(uplift - true_uplift).mean()),
+        "uplift_bias": float((uplift - true_uplift).mean()),
+        "batch_fallbacks": fallbacks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-pairs", type=int, default=4, help="Pairs per batched call.")
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds per judge call.")
+    parser.add_argument("--bias", type=float, default=1.0, help="Points added to Response A.")
+    parser.add_argument("--noise", type=float, default=0.7, help="Judge score noise (stdev).")
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+    # Every malformed batch would otherwise log its fallback.
+    logging.getLogger("engine").setLevel(logging.ERROR)
+
+    engine.set_llm_cache(LLMCache(enabled=False))
+    engine.set_context_budget(ContextBudget(judge_tokens=0))
+    pairs, true_uplift = make_pairs(args.pairs)
+    rows = [run(mode, args, pairs, true_uplift) for mode in engine.JUDGE_MODES]
+
+    print(
+        f"{'mode':<8} {'calls/pair':>10} {'seconds':>8} {'uplift_mae':>10} "
+        f"{'uplift_bias':>11} {'fallbacks':>9}"
+    )
+    for row in rows:
+        print(
+            f"{row['mode']:<8} {row['judge_calls_per_pair']:>10.2f} {row['seconds']:>8.2f} "
+            f"{row['uplift_mae']:>10.3f} {row['uplift_bias']:>+11.3f} {row['batch_fallbacks']:>9}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
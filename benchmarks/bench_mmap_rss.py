@@ -0,0 +1,140 @@
+"""
+Multi-process memory benchmark for memory-mapped index and metadata loading.
+
+Builds a synthetic index and metadata store, then starts N worker processes that
+load them the way the engine does, run searches, and report their memory while
+all workers are alive. With a private ("ram") load every worker holds its own
+copy; with "mmap" the vectors and metadata are shared page-cache pages, so the
+summed PSS (proportional set size) stays near a single copy.
+
+Linux only: memory is read from /proc/self/smaps_rollup.
+
+Usage:
+    python -m benchmarks.bench_mmap_rss --workers 4 --n 200000 --spec Flat
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+
+import faiss
+import numpy as np
+
+from benchmarks.bench_ann import synthetic_corpus
+from metadata_store import MetadataStore, MetadataWriter
+from vector_store import KNOWLEDGE_BASE_FIELDS, create_index, resolve_index_spec
+
+
+def memory_mb() -> dict:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:", "Pss_Anon:", "Pss_File:"):
+                fields[parts[0].rstrip(":").lower()] = int(parts[1]) / 1024
+    return fields
+
+
+def build_fixture(directory: str, n: int, dimension: int, spec: str):
+    vectors = synthetic_corpus(n, dimension, clusters=200)
+    factory_string = resolve_index_spec(spec, n, dimension)
+    index = create_index(factory_string, dimension)
+    if not index.is_trained:
+        index.train(vectors[: min(n, 50_000)])
+    index.add_with_ids(vectors, np.arange(n, dtype="int64"))
+    index_path = os.path.join(directory, "index.bin")
+    faiss.write_index(index, index_path)
+
+    writer = MetadataWriter(os.path.join(directory, "meta"))
+    for start in range(0, n, 10_000):
+        stop = min(n, start + 10_000)
+        writer.add(
+            np.arange(start, stop),
+            [
+                {field: f"{field} of entry {i} " * 8 for field in KNOWLEDGE_BASE_FIELDS}
+                for i in range(start, stop)
+            ],
+        )
+    writer.close()
+    return index_path, factory_string
+
+
+def worker(mode, index_path, factory_string, meta_path, queries, loaded, done, results):
+    if mode == "mmap":
+        flag = faiss.IO_FLAG_MMAP if "IVF" in factory_string else faiss.IO_FLAG_MMAP_IFC
+        index = faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+        metadata = MetadataStore(meta_path)
+        lookup = metadata.get
+    else:
+        index = faiss.read_index(index_path)
+        # The pre-mmap engine held the knowledge base as a list of dicts.
+        store = MetadataStore(meta_path)
+        entries = {int(store.ids[row]): store.row(row) for row in range(len(store))}
+        lookup = entries.get
+
+    _, ids = index.search(queries, 3)
+    for row in ids:
+        for i in row:
+            lookup(int(i))
+    if mode == "mmap":
+        # Touch every page once, as a long-running worker eventually would.
+        metadata.preload()
+
+    loaded.wait()
+    results.put(memory_mb())
+    done.wait()
+
+
+def run(mode, workers, index_path, factory_string, meta_path, queries):
+    ctx = mp.get_context("spawn")
+    loaded, done = ctx.Barrier(workers + 1), ctx.Barrier(workers + 1)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=worker,
+            args=(mode, index_path, factory_string, meta_path, queries, loaded, done, results),
+        )
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    loaded.wait()
+    samples = [results.get() for _ in procs]
+    done.wait()
+    for p in procs:
+        p.join()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--n", type=int, default=200_000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--spec", default="Flat")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path, factory_string = build_fixture(
+            directory, args.n, args.dimension, args.spec
+        )
+        meta_path = os.path.join(directory, "meta")
+        queries = synthetic_corpus(100, args.dimension, clusters=200, seed=7)
+        print(
+            f"{factory_string}, {args.n} vectors, index file "
+            f"{os.path.getsize(index_path) / 2**20:.0f}MB, {args.workers} workers"
+        )
+        for mode in ("ram", "mmap"):
+            samples = run(mode, args.workers, index_path, factory_string, meta_path, queries)
+            total_rss = sum(s["rss"] for s in samples)
+            total_pss = sum(s["pss"] for s in samples)
+            print(
+                f"{mode:<5} per-worker rss={samples[0]['rss']:.0f}MB "
+                f"(anon={samples[0]['pss_anon']:.0f}MB file={samples[0]['pss_file']:.0f}MB)  "
+                f"sum rss={total_rss:.0f}MB  sum pss={total_pss:.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Latency benchmark for the forge pipeline against a fake LLM client.
+
+Compares the serial five-step chain used by the original app against the
+`forge_async` dependency graph. With a per-call delay `d`, the serial chain
+takes about 4d and the graph about 3d.
+
+Usage:
+    python -m benchmarks.bench_pipeline --delay 0.5 --runs 3
+"""
+
+import argparse
+import asyncio
+import time
+
+import engine
+from fake_llm import FakeGeminiClient
+from llm_cache import LLMCache
+
+PROMPT = "Write a story about a brave knight."
+STRATEGY = "Creative Writing"
+
+
+async def serial_forge(user_prompt: str, strategy: str) -> dict:
+    """The original app.py chain: every stage waits for the previous one."""
+    examples = engine.retrieve_relevant_examples(user_prompt, k=3)
+    refined_prompt = await engine.refine_prompt_async(
+        user_prompt,
+        engine.SYSTEM_PROMPTS[strategy],
+        engine.assemble_refiner_examples(
+            user_prompt, engine.SYSTEM_PROMPTS[strategy], examples
+        ),
+    )
+    original_output = await engine.get_llm_response_async(user_prompt)
+    refined_output = await engine.get_llm_response_async(refined_prompt)
+    return await engine.evaluate_outputs_async(
+        original_output, refined_output, user_prompt
+    )
+
+
+def measure(label: str, make_coro, client: FakeGeminiClient, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        client.calls = 0
+        started = time.perf_counter()
+        asyncio.run(make_coro())
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(
+        f"{label:<10} best={best:.3f}s  llm_calls={client.calls}  "
+        f"critical_path={best / client.delay:.2f} calls"
+    )
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds per LLM call.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--with-rag",
+        action="store_true",
+        help="Use the real embedding model and FAISS index instead of fixed examples.",
+    )
+    args = parser.parse_args()
+
+    client = FakeGeminiClient(delay=args.delay)
+    engine.set_gemini_client(client)
+    # Repeated runs would otherwise be answered from the response cache.
+    engine.set_llm_cache(LLMCache(enabled=False))
+    if not args.with_rag:
+        engine.retrieve_relevant_examples = lambda query, k=3, **filters: [
+            "Example (from Benchmark/Creative Writing):\nPrompt: ...\nExplanation: ...\n"
+        ] * k
+
+    serial = measure("serial", lambda: serial_forge(PROMPT, STRATEGY), client, args.runs)
+    graph = measure(
+        "pipeline", lambda: engine.forge_async(PROMPT, STRATEGY), client, args.runs
+    )
+    print(f"speedup    {serial / graph:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
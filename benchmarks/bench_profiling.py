@@ -0,0 +1,106 @@
+"""
+Overhead of the profiling hooks, off and with each profiler.
+
+Times the hook itself while profiling is off (the `profile()` call and an empty
+`with` block, which every forge pays), then runs the same forges against the
+fake LLM client with profiling off, with the stack sampler and with cProfile,
+and reports the mean forge latency of each mode and its overhead over "off".
+Profiles are written to a temporary directory.
+
+Without `--with-rag`, embeddings and retrieval are replaced by synthetic ones so
+that no model or index is needed.
+
+Usage:
+    python -m benchmarks.bench_profiling --forges 50 --delay 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import engine
+import profiling
+from fake_llm import FakeGeminiClient
+from llm_cache import LLMCache
+
+EXAMPLE = "Example (from Benchmark/Creative Writing):\nPrompt: ...\nExplanation: ...\n"
+
+
+def hook_overhead_ns(repeats: int) -> float:
+    os.environ.pop("PROMPTFORGE_PROFILE", None)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        with profiling.profile("forge-benchmark"):
+            pass
+    return (time.perf_counter() - started) / repeats * 1e9
+
+
+def forge_latency(mode: str, forges: int, strategy: str) -> float:
+    if mode == "off":
+        os.environ.pop("PROMPTFORGE_PROFILE", None)
+    else:
+        os.environ["PROMPTFORGE_PROFILE"] = mode
+    latencies = []
+    for i in range(forges):
+        started = time.perf_counter()
+        asyncio.run(engine.forge_async(f"Write a story about knight number {i}.", strategy))
+        latencies.append(time.perf_counter() - started)
+    os.environ.pop("PROMPTFORGE_PROFILE", None)
+    return float(np.mean(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--forges", type=int, default=50, help="Forges per mode.")
+    parser.add_argument("--delay", type=float, default=0.01, help="Seconds per LLM call.")
+    parser.add_argument("--repeats", type=int, default=1_000_000, help="Disabled hook calls.")
+    parser.add_argument(
+        "--with-rag",
+        action="store_true",
+        help="Use the real embedding model and FAISS index instead of synthetic ones.",
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+    # Per-stage INFO lines would dominate the run time.
+    logging.basicConfig(level=logging.WARNING)
+
+    engine.set_gemini_client(FakeGeminiClient(delay=args.delay))
+    # Repeated runs would otherwise be answered from the response cache.
+    engine.set_llm_cache(LLMCache(enabled=False))
+    if not args.with_rag:
+        engine.retrieve_relevant_examples = lambda query, k=3, **filters: [EXAMPLE] * k
+    else:
+        engine.start_warmup().join()
+    strategy = next(iter(engine.SYSTEM_PROMPTS))
+
+    results = {"disabled_hook_ns": hook_overhead_ns(args.repeats), "modes": []}
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["PROMPTFORGE_PROFILE_DIR"] = directory
+        # The first forges pay for imports and lazy initialization.
+        forge_latency("off", 3, strategy)
+        for mode in ("off", *profiling.PROFILERS):
+            results["modes"].append(
+                {"mode": mode, "forge_ms": forge_latency(mode, args.forges, strategy) * 1000}
+            )
+    off = results["modes"][0]["forge_ms"]
+    for row in results["modes"]:
+        row["overhead"] = row["forge_ms"] / off - 1
+
+    print(f"disabled hook  {results['disabled_hook_ns']:.0f} ns per forge")
+    print(f"{'mode':<9} {'forge_ms':>9} {'overhead':>9}")
+    for row in results["modes"]:
+        print(f"{row['mode']:<9} {row['forge_ms']:>9.2f} {row['overhead']:>+9.1%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Success rate and tail latency of LLM calls with and without `ResilientClient`.
+
+Runs the same stream of calls against a fake client that injects failures (503s)
+and occasional slow responses, once bare, once with retries and once with
+retries plus hedging, and reports success rate, p50/p99 latency and the number
+of backend calls each setting made.
+
+Then simulates two outages. In the first, the backend is unreachable and every
+call raises the `httpx.ConnectError` the real client raises. The circuit breaker
+must open, so that later calls fail fast without reaching the backend. In the
+second, the backend hangs and sync calls time out. Once the attempts left
+running hold every worker thread, later calls must fail fast rather than queue
+behind them.
+
+Usage:
+    python -m benchmarks.bench_resilience --calls 500 --failure-rate 0.1 --slow-rate 0.03
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from fake_llm import FakeGeminiClient
+from resilient_client import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientClient,
+    WorkersExhaustedError,
+)
+
+
+async def run(client, calls: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await client.aio.models.generate_content(model="fake", contents=f"call {i}")
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return np.array(latencies), failures
+
+
+def failure_counts(call, calls: int) -> dict:
+    counts = {}
+    for i in range(calls):
+        try:
+            call(i)
+            kind = "success"
+        except Exception as e:
+            kind = type(e).__name__
+        counts[kind] = counts.get(kind, 0) + 1
+    return counts
+
+
+def unreachable_backend(calls: int) -> None:
+    fake = FakeGeminiClient(delay=0, errors={"connect": 1.0})
+    client = ResilientClient(
+        fake,
+        max_attempts=2,
+        backoff_base=0,
+        breaker=CircuitBreaker(failure_threshold=5, reset_timeout=60),
+    )
+
+    async def call_async(i):
+        await client.aio.models.generate_content(model="fake", contents=f"async {i}")
+
+    counts = failure_counts(
+        lambda i: client.models.generate_content(model="fake", contents=f"sync {i}"), calls
+    )
+    for kind, count in failure_counts(lambda i: asyncio.run(call_async(i)), calls).items():
+        counts[kind] = counts.get(kind, 0) + count
+    print(
+        f"unreachable: {2 * calls} calls, {fake.calls} reached the backend, "
+        f"breaker {client.breaker.state}, outcomes {counts}"
+    )
+    assert client.breaker.state == "open" and counts.get(CircuitOpenError.__name__), counts
+
+
+def hung_backend(calls: int, workers: int) -> None:
+    fake = FakeGeminiClient(delay=1.0)
+    client = ResilientClient(
+        fake,
+        timeout=0.05,
+        max_attempts=1,
+        max_workers=workers,
+        breaker=CircuitBreaker(failure_threshold=calls + 1),
+    )
+    started = time.perf_counter()
+    counts = failure_counts(
+        lambda i: client.models.generate_content(model="fake", contents=f"hung {i}"), calls
+    )
+    seconds = time.perf_counter() - started
+    print(
+        f"hung:        {calls} sync calls, {fake.calls} reached the backend with "
+        f"{workers} workers, outcomes {counts}, {seconds:.2f}s"
+    )
+    assert fake.calls == workers and counts.get(WorkersExhaustedError.__name__), counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-delay", type=float, default=1.0)
+    parser.add_argument("--outage-calls", type=int, default=20, help="Calls per outage.")
+    args = parser.parse_args()
+    # Every injected failure would otherwise log a retry warning.
+    logging.getLogger("resilient_client").setLevel(logging.ERROR)
+
+    settings = {
+        "bare": None,
+        "retries": {"max_attempts": 3},
+        "retries+hedge": {"max_attempts": 3, "hedge": True},
+    }
+    print(f"{'setting':<14} {'success':>8} {'p50_s':>7} {'p99_s':>7} {'backend_calls':>14}")
+    for label, options in settings.items():
+        fake = FakeGeminiClient(
+            delay=args.delay,
+            failure_rate=args.failure_rate,
+            slow_rate=args.slow_rate,
+            slow_delay=args.slow_delay,
+            seed=42,
+        )
+        client = fake
+        if options is not None:
+            # A high threshold keeps the breaker out of a steady-state error rate.
+            client = ResilientClient(
+                fake,
+                timeout=args.slow_delay * 2,
+                backoff_base=args.delay,
+                breaker=CircuitBreaker(failure_threshold=1000),
+                **options,
+            )
+        latencies, failures = asyncio.run(run(client, args.calls, args.concurrency))
+        p50, p99 = np.quantile(latencies, [0.5, 0.99]) if len(latencies) else (0, 0)
+        print(
+            f"{label:<14} {1 - failures / args.calls:>8.1%} {p50:>7.3f} {p99:>7.3f} "
+            f"{fake.calls:>14}"
+        )
+
+    unreachable_backend(args.outage_calls)
+    hung_backend(args.outage_calls, workers=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Startup benchmark: wall time and peak RSS of `import engine`.
+
+Each measurement runs in a fresh interpreter. The "eager" scenario also loads
+the embedding model and FAISS index right after the import, which is what the
+engine used to do at import time; "lazy" is the bare import.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = {
+    "lazy": "import engine",
+    "eager": "import engine; engine.get_rag_model(); engine.get_faiss_index()",
+}
+
+PROBE = """
+import json, resource, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+
+def measure(statement: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, statement in SCENARIOS.items():
+        samples = [measure(statement) for _ in range(args.runs)]
+        seconds = statistics.median(s["seconds"] for s in samples)
+        rss_mb = statistics.median(s["max_rss_kb"] for s in samples) / 1024
+        print(f"{name:<6} median_wall={seconds:.3f}s  peak_rss={rss_mb:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Accuracy and latency of local strategy auto-selection.
+
+Cross-validates the nearest-centroid `StrategyClassifier` on a labelled corpus:
+the entries are split into folds, the classifier is trained on all but one fold
+and predicts the strategy of the held-out entries from their embeddings. Reports
+top-1 and top-2 accuracy against always guessing the most common strategy, the
+mean confidence of the top pick (a calibrated classifier's matches its top-1
+accuracy) and the latency of ranking one query, which is what a forge in auto
+mode adds on top of the embedding it already computes for retrieval.
+
+The corpus is the built-in knowledge base, a JSONL file in the `ingest.py`
+format (both embedded with the engine's model), or with `--synthetic` random
+clustered vectors, which need no model.
+
+Usage:
+    python -m benchmarks.bench_strategy_select --folds 6
+    python -m benchmarks.bench_strategy_select --input prompts.jsonl
+    python -m benchmarks.bench_strategy_select --synthetic 20000 --strategies 8
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from strategy_classifier import StrategyClassifierTrainer
+
+
+def load_corpus(args):
+    """Returns (labels, embeddings) of the chosen corpus."""
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        centers = rng.normal(size=(args.strategies, args.dimension))
+        centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+        labels = rng.integers(args.strategies, size=args.synthetic)
+        noise = rng.normal(scale=args.spread, size=(args.synthetic, args.dimension))
+        vectors = centers[labels] + noise
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.array([f"Strategy {i}" for i in labels]), vectors.astype("float32")
+
+    import engine
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    else:
+        from knowledge_base import KNOWLEDGE_BASE
+
+        entries = KNOWLEDGE_BASE
+    embeddings = engine.embed_queries([entry["prompt_text"] for entry in entries])
+    if embeddings is None:
+        raise SystemExit("The embedding model could not be loaded; try --synthetic.")
+    return np.array([entry["strategy"] for entry in entries]), embeddings
+
+
+def cross_validate(labels, vectors, folds: int, seed: int) -> dict:
+    order = np.random.default_rng(seed).permutation(len(labels))
+    top1 = top2 = confidence = 0.0
+    classifier = None
+    for fold in np.array_split(order, folds):
+        train = np.setdiff1d(order, fold)
+        trainer = StrategyClassifierTrainer()
+        trainer.add(labels[train], vectors[train])
+        classifier = trainer.finish()
+        for truth, ranking in zip(labels[fold], classifier.rank(vectors[fold])):
+            names = [name for name, _ in ranking]
+            top1 += names[0] == truth
+            top2 += truth in names[:2]
+            confidence += ranking[0][1]
+    _, counts = np.unique(labels, return_counts=True)
+    return {
+        "entries": len(labels),
+        "strategies": len(counts),
+        "top1_accuracy": top1 / len(labels),
+        "top2_accuracy": top2 / len(labels),
+        "majority_baseline": counts.max() / len(labels),
+        "mean_top_confidence": confidence / len(labels),
+        "temperature": classifier.temperature,
+    }
+
+
+def rank_latency(labels, vectors, repeats: int) -> dict:
+    trainer = StrategyClassifierTrainer()
+    trainer.add(labels, vectors)
+    classifier = trainer.finish()
+    names = sorted(set(labels.tolist()))
+    latencies = []
+    for i in range(repeats):
+        query = vectors[i % len(vectors)].reshape(1, -1)
+        started = time.perf_counter()
+        classifier.rank(query, names)
+        latencies.append(time.perf_counter() - started)
+    latencies = np.array(latencies) * 1e6
+    return {
+        "rank_mean_us": float(latencies.mean()),
+        "rank_p99_us": float(np.quantile(latencies, 0.99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--input", help="A JSONL corpus; default: the built-in knowledge base.")
+    parser.add_argument("--synthetic", type=int, help="Use this many synthetic vectors instead.")
+    parser.add_argument("--strategies", type=int, default=4, help="Synthetic strategies.")
+    parser.add_argument("--dimension", type=int, default=384, help="Synthetic dimension.")
+    parser.add_argument("--spread", type=float, default=0.4, help="Synthetic noise per dimension.")
+    parser.add_argument("--folds", type=int, default=6)
+    parser.add_argument("--repeats", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    labels, vectors = load_corpus(args)
+    results = cross_validate(labels, vectors, min(args.folds, len(labels)), args.seed)
+    results.update(rank_latency(labels, vectors, args.repeats))
+
+    print(
+        f"{results['entries']} entries, {results['strategies']} strategies, "
+        f"{args.folds}-fold cross-validation"
+    )
+    print(f"top-1 accuracy       {results['top1_accuracy']:.3f}")
+    print(f"top-2 accuracy       {results['top2_accuracy']:.3f}")
+    print(f"majority baseline    {results['majority_baseline']:.3f}")
+    print(f"mean top confidence  {results['mean_top_confidence']:.3f}")
+    print(
+        f"rank latency         {results['rank_mean_us']:.1f} us mean, "
+        f"{results['rank_p99_us']:.1f} us p99"
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+LLM calls, tokens and latency of a strategy tournament against separate forges.
+
+Forges each prompt under every strategy twice against the fake LLM client: once
+as one `forge_async` per strategy, run concurrently, and once as a single
+`tournament_async`. Reports per prompt the LLM calls, the judge's and all calls'
+input tokens, the embeddings computed and the wall time of each mode.
+
+Without `--with-rag`, embeddings and retrieval are replaced by synthetic ones so
+that no model or index is needed; embeddings are still counted.
+
+Usage:
+    python -m benchmarks.bench_tournament --prompts 20 --delay 0.2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+import numpy as np
+
+import engine
+import fake_llm
+from fake_llm import FakeGeminiClient
+from llm_cache import LLMCache
+from metrics import Metrics, set_metrics
+
+PROMPTS = [
+    "Write a story about a brave knight.",
+    "Explain quantum computing to a child.",
+    "Summarize the causes of the French Revolution.",
+    "Give me a checklist for migrating a database to a new region.",
+]
+EXAMPLE = "Example (from Benchmark/Creative Writing):\nPrompt: ...\nExplanation: ...\n"
+
+
+def use_distinct_texts() -> None:
+    """
+    Makes every fake text depend on the whole call, system instruction included.
+
+    The fake client echoes only the head of the contents, so the refiners of all
+    strategies would return the same prompt and the coalescer would merge their
+    generations and judge calls, which real responses would not allow.
+    """
+    fake_text = fake_llm._fake_text
+
+    def distinct_text(contents, config, seed=0):
+        text = fake_text(contents, config, seed)
+        if isinstance(config, dict) and config.get("response_mime_type") == "application/json":
+            return text
+        digest = hashlib.sha256(f"{contents!r}{config!r}".encode("utf-8")).hexdigest()
+        return f"{text} [{digest[:12]}]"
+
+    fake_llm._fake_text = distinct_text
+
+
+def use_synthetic_retrieval(counter: dict) -> None:
+    def embed_queries(queries):
+        counter["embeddings"] += len(queries)
+        return np.ones((len(queries), 384), dtype="float32") / np.sqrt(384)
+
+    def retrieve(query, k=3, **filters):
+        embed_queries([query])
+        return [EXAMPLE] * k
+
+    engine.embed_queries = embed_queries
+    engine.retrieve_relevant_examples = retrieve
+    engine.retrieve_relevant_examples_batch = (
+        lambda queries, k=3, query_embeddings=None, **filters: [[EXAMPLE] * k] * len(queries)
+    )
+
+
+async def separate_forges(prompt: str, strategies: list):
+    return await asyncio.gather(
+        *(engine.forge_async(prompt, strategy) for strategy in strategies)
+    )
+
+
+def counter_total(metrics: Metrics, name: str, stage: str = None) -> float:
+    return sum(
+        c["value"]
+        for c in metrics.snapshot()["counters"]
+        if c["name"] == name and (stage is None or c["labels"].get("stage") == stage)
+    )
+
+
+def run(mode: str, prompts: list, strategies: list, client, counter: dict) -> dict:
+    metrics = Metrics()
+    set_metrics(metrics)
+    client.calls = 0
+    counter["embeddings"] = 0
+    seconds = []
+    for prompt in prompts:
+        started = time.perf_counter()
+        if mode == "tournament":
+            asyncio.run(engine.tournament_async(prompt, strategies))
+        else:
+            asyncio.run(separate_forges(prompt, strategies))
+        seconds.append(time.perf_counter() - started)
+    count = len(prompts)
+    return {
+        "mode": mode,
+        "llm_calls_per_prompt": client.calls / count,
+        "input_tokens_per_prompt": counter_total(metrics, "promptforge_input_tokens_total")
+        / count,
+        "judge_input_tokens_per_prompt": counter_total(
+            metrics, "promptforge_input_tokens_total", stage="scores"
+        )
+        / count,
+        "embeddings_per_prompt": counter["embeddings"] / count,
+        "mean_seconds": float(np.mean(seconds)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--prompts", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds per LLM call.")
+    parser.add_argument(
+        "--strategies", help="Comma-separated strategies; default all of them."
+    )
+    parser.add_argument(
+        "--with-rag",
+        action="store_true",
+        help="Use the real embedding model and FAISS index instead of synthetic ones.",
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+    # Per-stage INFO lines would dominate the run time.
+    logging.basicConfig(level=logging.WARNING)
+
+    strategies = args.strategies.split(",") if args.strategies else list(engine.SYSTEM_PROMPTS)
+    prompts = [
+        f"{PROMPTS[i % len(PROMPTS)]} (variant {i})" for i in range(args.prompts)
+    ]
+    client = FakeGeminiClient(delay=args.delay)
+    engine.set_gemini_client(client)
+    # Both modes would otherwise share each other's responses.
+    engine.set_llm_cache(LLMCache(enabled=False))
+    use_distinct_texts()
+    counter = {"embeddings": 0}
+    if not args.with_rag:
+        use_synthetic_retrieval(counter)
+
+    rows = [run(mode, prompts, strategies, client, counter) for mode in ("forges", "tournament")]
+
+    print(f"{len(strategies)} strategies, {len(prompts)} prompts")
+    print(
+        f"{'mode':<11} {'llm_calls':>9} {'input_tokens':>12} {'judge_tokens':>12} "
+        f"{'embeddings':>10} {'seconds':>8}"
+    )
+    for row in rows:
+        print(
+            f"{row['mode']:<11} {row['llm_calls_per_prompt']:>9.1f} "
+            f"{row['input_tokens_per_prompt']:>12.0f} {row['judge_input_tokens_per_prompt']:>12.0f} "
+            f"{row['embeddings_per_prompt']:>10.1f} {row['mean_seconds']:>8.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Load test for the HTTP API in `server.py` against a fake LLM client.
+
+Starts the server in-process on a local port (or targets `--url`) and sends
+`--requests` forge requests from `--concurrency` concurrent clients. A share of
+them (`--duplicate-ratio`) repeats a handful of popular prompts, which the server
+coalesces while they are in flight. Reports throughput, p50/p95/p99 latency,
+upstream LLM calls and the mean embedding batch size.
+
+Without `--with-rag`, embeddings and retrieval are replaced by a synthetic
+encoder with a fixed per-call overhead, so batching shows up without the model.
+
+Usage:
+    python -m benchmarks.load_test --requests 400 --concurrency 64 --delay 0.2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+import threading
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+
+import engine
+from fake_llm import FakeGeminiClient
+from llm_cache import LLMCache
+from metrics import get_metrics
+
+DIMENSION = 384
+POPULAR_PROMPTS = [
+    "Write a story about a brave knight.",
+    "Explain quantum computing to a child.",
+    "Summarize the causes of the French Revolution.",
+]
+
+
+def fake_embed_queries(queries: list, overhead: float = 0.005, per_query: float = 0.0005):
+    """Deterministic unit vectors; the sleep models a forward pass's fixed and per-item cost."""
+    time.sleep(overhead + per_query * len(queries))
+    rows = []
+    for query in queries:
+        seed = int.from_bytes(hashlib.sha256(query.encode("utf-8")).digest()[:4], "little")
+        row = np.random.default_rng(seed).standard_normal(DIMENSION)
+        rows.append(row / np.linalg.norm(row))
+    return np.asarray(rows, dtype="float32")
+
+
+def start_server(port: int, warm_up: bool) -> uvicorn.Server:
+    from server import create_app
+
+    config = uvicorn.Config(
+        create_app(warm_up=warm_up), host="127.0.0.1", port=port, log_level="warning"
+    )
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="load-test-server", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(url: str, requests: int, concurrency: int, duplicate_ratio: float, seed: int):
+    rng = random.Random(seed)
+    payloads = [
+        {
+            "prompt": rng.choice(POPULAR_PROMPTS)
+            if rng.random() < duplicate_ratio
+            else f"Write a haiku about request number {i}.",
+            "strategy": rng.choice(list(engine.SYSTEM_PROMPTS)),
+        }
+        for i in range(requests)
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+
+        async def one(payload):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/forge", json=payload)
+                if response.status_code != 200:
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(payload) for payload in payloads))
+        elapsed = time.perf_counter() - started
+    return np.array(latencies), failures, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds per LLM call.")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--url", help="Load an already running server instead of starting one."
+    )
+    parser.add_argument(
+        "--with-rag",
+        action="store_true",
+        help="Use the real embedding model and FAISS index instead of synthetic ones.",
+    )
+    args = parser.parse_args()
+    # Per-stage INFO lines would dominate the run time.
+    logging.basicConfig(level=logging.WARNING)
+
+    fake = None
+    url = args.url
+    if url is None:
+        fake = FakeGeminiClient(delay=args.delay)
+        engine.set_gemini_client(fake)
+        # Repeated prompts would otherwise be answered from the response cache.
+        engine.set_llm_cache(LLMCache(enabled=False))
+        if not args.with_rag:
+            engine.embed_queries = fake_embed_queries
+            engine.retrieve_relevant_examples_batch = (
+                lambda queries, k=3, query_embeddings=None, **filters: [
+                    ["Example (from Benchmark/Creative Writing):\nPrompt: ...\n"] * k
+                ]
+                * len(queries)
+            )
+        start_server(args.port, warm_up=args.with_rag)
+        url = f"http://127.0.0.1:{args.port}"
+
+    latencies, failures, elapsed = asyncio.run(
+        run(url, args.requests, args.concurrency, args.duplicate_ratio, args.seed)
+    )
+    p50, p95, p99 = np.quantile(latencies, [0.5, 0.95, 0.99]) if len(latencies) else (0, 0, 0)
+    print(f"requests      {args.requests} ({failures} failed)")
+    print(f"throughput    {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency       p50={p50:.3f}s  p95={p95:.3f}s  p99={p99:.3f}s")
+    if fake is not None:
+        batches = [
+            series
+            for series in get_metrics().snapshot()["latencies"]
+            if series["name"] == "promptforge_batch_size"
+        ]
+        coalesced = sum(
+            counter["value"]
+            for counter in get_metrics().snapshot()["counters"]
+            if counter["name"] == "promptforge_coalesced_total"
+        )
+        print(f"llm_calls     {fake.calls} (4 per uncoalesced forge = {4 * args.requests})")
+        print(f"coalesced     {coalesced:g} requests or LLM calls")
+        if batches:
+            mean = batches[0]["sum"] / batches[0]["count"]
+            print(f"embed_batches {batches[0]['count']} (mean size {mean:.1f})")
+
+
+if __name__ == "__main__":
+    main()
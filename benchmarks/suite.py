@@ -0,0 +1,279 @@
+"""
+End-to-end benchmark suite that runs offline and writes machine-readable results.
+
+Measures embedding throughput per batch size, FAISS search QPS per index type and
+corpus size, `forge` latency, and `batch.forge_batch` throughput. LLM calls go to
+the deterministic `FakeGeminiClient`, so runs need no API key and are comparable
+across machines and commits. Results are written as JSON; `--compare` prints the
+relative change of every metric against an earlier results file.
+
+Without `--with-rag`, the forge and batch sections use synthetic embeddings and
+fixed examples instead of the embedding model and the built index.
+
+Usage:
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --output new.json --compare bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+import batch
+import engine
+from benchmarks.bench_ann import synthetic_corpus
+from benchmarks.load_test import fake_embed_queries
+from fake_llm import LATENCY_DISTRIBUTIONS, FakeGeminiClient
+from llm_cache import LLMCache
+from vector_store import create_index, resolve_index_spec
+
+SECTIONS = ("embedding", "faiss", "forge", "batch")
+
+
+def sample_prompts(n: int) -> list:
+    topics = ("a brave knight", "quantum computing", "the French Revolution", "sourdough")
+    tasks = ("Write a story about", "Explain", "Summarize the history of", "List facts on")
+    return [f"{tasks[i % len(tasks)]} {topics[i // len(tasks) % len(topics)]} #{i}" for i in range(n)]
+
+
+def percentiles(latencies) -> dict:
+    p50, p95, p99 = np.quantile(latencies, [0.5, 0.95, 0.99])
+    return {"mean_s": float(np.mean(latencies)), "p50_s": p50, "p95_s": p95, "p99_s": p99}
+
+
+@contextlib.contextmanager
+def offline_retrieval():
+    """Replaces embedding and retrieval in the engine and batch modules with fixed stand-ins."""
+    examples = ["Example (from Benchmark/Creative Writing):\nPrompt: ...\nExplanation: ...\n"]
+
+    def retrieve_batch(queries, k=3, query_embeddings=None, **filters):
+        return [examples * k for _ in queries]
+
+    patches = {
+        (engine, "embed_queries"): fake_embed_queries,
+        (batch, "embed_queries"): fake_embed_queries,
+        (engine, "retrieve_relevant_examples_batch"): retrieve_batch,
+        (batch, "retrieve_relevant_examples_batch"): retrieve_batch,
+        (engine, "retrieve_relevant_examples"): lambda query, k=3, **filters: examples * k,
+    }
+    originals = {target: getattr(*target) for target in patches}
+    for (module, name), replacement in patches.items():
+        setattr(module, name, replacement)
+    try:
+        yield
+    finally:
+        for (module, name), original in originals.items():
+            setattr(module, name, original)
+
+
+def bench_embedding(args) -> dict:
+    model = engine.get_rag_model()
+    if model is None:
+        return {"skipped": "embedding model unavailable"}
+    texts = sample_prompts(args.embed_texts)
+    model.encode(texts[:8], normalize_embeddings=True)  # Warm up.
+    results = {}
+    for batch_size in args.batch_sizes:
+        started = time.perf_counter()
+        model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+        elapsed = time.perf_counter() - started
+        results[f"batch_{batch_size}"] = {"texts_per_s": len(texts) / elapsed}
+    return results
+
+
+def bench_faiss(args) -> dict:
+    results = {}
+    for n in args.sizes:
+        corpus = synthetic_corpus(n + args.queries, args.dimension, clusters=max(n // 200, 1))
+        vectors, queries = corpus[:n], corpus[n:]
+        for spec in args.specs:
+            factory_string = resolve_index_spec(spec, n, args.dimension)
+            index = create_index(factory_string, args.dimension)
+            started = time.perf_counter()
+            if not index.is_trained:
+                index.train(vectors)
+            index.add_with_ids(vectors, np.arange(n, dtype="int64"))
+            build_seconds = time.perf_counter() - started
+
+            # One query per call, as the app retrieves, and all queries in one call,
+            # as batch.py does.
+            started = time.perf_counter()
+            for i in range(len(queries)):
+                index.search(queries[i : i + 1], args.k)
+            single_qps = len(queries) / (time.perf_counter() - started)
+            started = time.perf_counter()
+            index.search(queries, args.k)
+            batch_qps = len(queries) / (time.perf_counter() - started)
+
+            results[f"{spec}@{n}"] = {
+                "factory": factory_string,
+                "build_s": build_seconds,
+                "single_qps": single_qps,
+                "batch_qps": batch_qps,
+            }
+    return results
+
+
+def fake_client(args) -> FakeGeminiClient:
+    return FakeGeminiClient(
+        delay=args.delay, latency=args.latency, jitter=args.jitter, seed=args.seed
+    )
+
+
+def bench_forge(args) -> dict:
+    client = fake_client(args)
+    engine.set_gemini_client(client)
+    strategy = next(iter(engine.SYSTEM_PROMPTS))
+    latencies = []
+    for prompt in sample_prompts(args.forges):
+        started = time.perf_counter()
+        asyncio.run(engine.forge_async(prompt, strategy))
+        latencies.append(time.perf_counter() - started)
+    return {
+        "forges": args.forges,
+        "llm_calls": client.calls,
+        **percentiles(latencies),
+        "critical_path_calls": float(np.median(latencies)) / args.delay if args.delay else None,
+    }
+
+
+def bench_batch(args) -> dict:
+    client = fake_client(args)
+    engine.set_gemini_client(client)
+    records = [{"id": i, "prompt": p} for i, p in enumerate(sample_prompts(args.batch_prompts))]
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        stats = asyncio.run(
+            batch.forge_batch(
+                records,
+                os.path.join(directory, "results.jsonl"),
+                concurrency=args.concurrency,
+            )
+        )
+        elapsed = time.perf_counter() - started
+    return {
+        "jobs": stats["completed"],
+        "failed": stats["failed"],
+        "seconds": elapsed,
+        "jobs_per_s": stats["completed"] / elapsed,
+        "llm_calls": client.calls,
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": faiss.__version__,
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = flatten(json.load(f)["results"])
+    print(f"\n{'metric':<44} {'baseline':>12} {'current':>12} {'change':>8}")
+    for path, value in flatten(results).items():
+        before = baseline.get(path)
+        if before is None:
+            continue
+        change = f"{(value - before) / before:+.1%}" if before else "n/a"
+        print(f"{path:<44} {before:>12.4g} {value:>12.4g} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sections", default=",".join(SECTIONS))
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="An earlier results file to diff against.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-texts", type=int, default=256)
+    parser.add_argument("--batch-sizes", default="1,16,64")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="FAISS corpus sizes.")
+    parser.add_argument("--specs", default="Flat,HNSW")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.05, help="Mean seconds per LLM call.")
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--forges", type=int, default=20)
+    parser.add_argument("--batch-prompts", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--with-rag",
+        action="store_true",
+        help="Use the embedding model and built index in the forge and batch sections.",
+    )
+    args = parser.parse_args()
+    args.batch_sizes = [int(v) for v in args.batch_sizes.split(",")]
+    args.sizes = [int(v) for v in args.sizes.split(",")]
+    args.specs = args.specs.split(",")
+    sections = args.sections.split(",")
+    logging.basicConfig(level=logging.WARNING)
+    # Every forge would otherwise be answered from the response cache after the first run.
+    engine.set_llm_cache(LLMCache(enabled=False))
+
+    runners = {
+        "embedding": bench_embedding,
+        "faiss": bench_faiss,
+        "forge": bench_forge,
+        "batch": bench_batch,
+    }
+    results = {}
+    for section in sections:
+        started = time.perf_counter()
+        retrieval = (
+            offline_retrieval()
+            if section in ("forge", "batch") and not args.with_rag
+            else contextlib.nullcontext()
+        )
+        with retrieval:
+            results[section] = runners[section](args)
+        print(f"{section:<10} done in {time.perf_counter() - started:.1f}s")
+        for path, value in flatten(results[section]).items():
+            print(f"  {path:<40} {value:.4g}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {"config": vars(args), "environment": environment(), "results": results},
+            f,
+            indent=2,
+        )
+    print(f"Wrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
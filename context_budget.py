@@ -0,0 +1,262 @@
+"""
+Token budgets for the contents sent to the refiner and the judge.
+
+Token counts use a local approximation of the model's subword tokenizer, so no
+network round trip is needed to size a prompt. The refiner context keeps the
+retrieved examples in rank order, drops near-duplicates and then the lowest-ranked
+examples until the call fits its budget; the judge context truncates long outputs
+to their head and tail.
+"""
+
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WORD_PATTERN = re.compile(r"\w+")
+
+# Characters per subword piece for long words; close to Gemini's ~4 chars/token.
+CHARS_PER_PIECE = 4
+
+# Each output keeps at least this many tokens, even when the user prompt alone
+# exceeds the judge budget; judging empty outputs is meaningless.
+MIN_OUTPUT_TOKENS = 64
+
+
+def _token_cost(piece: str) -> int:
+    if not piece[0].isalnum() and piece[0] != "_":
+        return 1
+    return max(1, -(-len(piece) // CHARS_PER_PIECE))
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximates the number of model tokens in `text`.
+
+    Words are split into pieces of about four characters and each punctuation
+    mark counts as one token, which slightly overestimates typical English text.
+    """
+    if not text:
+        return 0
+    return sum(_token_cost(piece) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Shortens `text` to about `max_tokens` tokens, keeping its head and tail.
+
+    The beginning of an answer usually carries its structure and the end its
+    conclusion, so two thirds of the budget go to the head and the rest to the tail.
+
+    Returns:
+        str: `text` unchanged if it fits, otherwise the head, an omission marker
+            and the tail.
+    """
+    matches = list(_TOKEN_PATTERN.finditer(text))
+    costs = [_token_cost(m.group()) for m in matches]
+    total = sum(costs)
+    if total <= max_tokens:
+        return text
+
+    # Leave room for the omission marker itself.
+    max_tokens = max(max_tokens - count_tokens("[... 0000 tokens omitted ...]"), 0)
+    head_budget = max_tokens * 2 // 3
+    tail_budget = max_tokens - head_budget
+
+    head_end, used = 0, 0
+    for match, cost in zip(matches, costs):
+        if used + cost > head_budget:
+            break
+        used += cost
+        head_end = match.end()
+
+    tail_start, used_tail = len(text), 0
+    for match, cost in zip(reversed(matches), reversed(costs)):
+        if used_tail + cost > tail_budget or match.start() < head_end:
+            break
+        used_tail += cost
+        tail_start = match.start()
+
+    omitted = total - used - used_tail
+    return (
+        f"{text[:head_end]}\n[... {omitted} tokens omitted ...]\n{text[tail_start:]}"
+    )
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextBudget:
+    """
+    Enforces per-call input token budgets.
+
+    Args:
+        refiner_tokens (int): Budget for the refiner call: system instruction, user
+            prompt and examples. 0 disables it.
+        judge_tokens (int): Budget for the judge call: instructions, user prompt and
+            both outputs. 0 disables it.
+        dedupe_threshold (float): Word-trigram Jaccard similarity at or above which
+            an example is a near-duplicate of a higher-ranked one.
+    """
+
+    def __init__(
+        self,
+        refiner_tokens: int = 2000,
+        judge_tokens: int = 6000,
+        dedupe_threshold: float = 0.8,
+    ):
+        self.refiner_tokens = refiner_tokens
+        self.judge_tokens = judge_tokens
+        self.dedupe_threshold = dedupe_threshold
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens_in = 0
+        self.tokens_saved = 0
+
+    def _record(self, used: int, saved: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.tokens_in += used
+            self.tokens_saved += saved
+
+    def assemble_examples(self, examples: list, fixed_text: str) -> list:
+        """
+        Selects the examples that fit the refiner budget.
+
+        Args:
+            examples (list): Formatted examples, best match first.
+            fixed_text (str): Everything else sent with the call (system
+                instruction and the prompt template with the user prompt).
+
+        Returns:
+            list: The kept examples, still best match first. The best example is
+                truncated rather than dropped if it alone exceeds the budget.
+        """
+        fixed = count_tokens(fixed_text)
+        costs = [count_tokens(example) for example in examples]
+        original = fixed + sum(costs)
+
+        kept, kept_costs, kept_shingles = [], [], []
+        duplicates = 0
+        for example, cost in zip(examples, costs):
+            shingles = _shingles(example)
+            if any(
+                _jaccard(shingles, other) >= self.dedupe_threshold
+                for other in kept_shingles
+            ):
+                duplicates += 1
+                continue
+            kept.append(example)
+            kept_costs.append(cost)
+            kept_shingles.append(shingles)
+
+        dropped = 0
+        if self.refiner_tokens:
+            available = self.refiner_tokens - fixed
+            while kept and sum(kept_costs) > available:
+                if len(kept) == 1:
+                    if available > 0:
+                        kept[0] = truncate_to_tokens(kept[0], available)
+                        kept_costs[0] = count_tokens(kept[0])
+                    else:
+                        kept, kept_costs = [], []
+                        dropped += 1
+                    break
+                # Examples arrive best match first; the last one scored lowest.
+                kept.pop()
+                kept_costs.pop()
+                dropped += 1
+
+        used = fixed + sum(kept_costs)
+        saved = original - used
+        self._record(used, saved)
+        if saved:
+            logger.info(
+                f"Refiner context: {used} tokens, saved {saved} "
+                f"({duplicates} near-duplicate and {dropped} lowest-ranked examples "
+                f"removed, {len(kept)} of {len(examples)} kept)."
+            )
+        return kept
+
+    def fit_outputs(self, output_a: str, output_b: str, fixed_text: str) -> tuple:
+        """
+        Truncates the two outputs so the judge call fits its budget.
+
+        The budget left after `fixed_text` is split evenly; an output shorter than
+        its half gives the rest to the other one.
+
+        Returns:
+            tuple: The (possibly truncated) `output_a` and `output_b`.
+        """
+        return tuple(self.fit_many_outputs([output_a, output_b], fixed_text))
+
+    def fit_many_outputs(self, outputs: list, fixed_text: str) -> list:
+        """
+        Truncates any number of outputs so one judge call fits its budget.
+
+        The budget left after `fixed_text` is shared evenly; outputs shorter than
+        their share keep their full length and leave the rest to the longer ones.
+
+        Returns:
+            list: The (possibly truncated) outputs, in order.
+        """
+        fixed = count_tokens(fixed_text)
+        costs = [count_tokens(output) for output in outputs]
+        original = fixed + sum(costs)
+        if not self.judge_tokens or original <= self.judge_tokens:
+            self._record(original, 0)
+            return list(outputs)
+
+        remaining = max(self.judge_tokens - fixed, len(outputs) * MIN_OUTPUT_TOKENS)
+        budgets = [0] * len(outputs)
+        order = sorted(range(len(outputs)), key=costs.__getitem__)
+        for position, i in enumerate(order):
+            share = remaining // (len(outputs) - position)
+            budgets[i] = min(costs[i], share)
+            remaining -= budgets[i]
+        fitted = [
+            truncate_to_tokens(output, budget) for output, budget in zip(outputs, budgets)
+        ]
+
+        used = fixed + sum(count_tokens(output) for output in fitted)
+        saved = original - used
+        self._record(used, saved)
+        logger.info(f"Judge context: {used} tokens, saved {saved} by truncating outputs.")
+        return fitted
+
+    def stats(self) -> dict:
+        """Returns the number of budgeted calls and the tokens sent and saved."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "tokens_in": self.tokens_in,
+                "tokens_saved": self.tokens_saved,
+                "refiner_tokens": self.refiner_tokens,
+                "judge_tokens": self.judge_tokens,
+            }
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a budget from PROMPTFORGE_REFINER_TOKENS (default 2000),
+        PROMPTFORGE_JUDGE_TOKENS (default 6000) and PROMPTFORGE_DEDUPE_THRESHOLD
+        (default 0.8). A budget of 0 disables that limit.
+        """
+        return cls(
+            refiner_tokens=int(os.getenv("PROMPTFORGE_REFINER_TOKENS", 2000)),
+            judge_tokens=int(os.getenv("PROMPTFORGE_JUDGE_TOKENS", 6000)),
+            dedupe_threshold=float(os.getenv("PROMPTFORGE_DEDUPE_THRESHOLD", 0.8)),
+        )
@@ -0,0 +1,303 @@
+"""
+Bounded cache of query embeddings.
+
+Prompts recur: resubmits, Streamlit reruns and re-runs of a batch encode the same
+text again, often with different whitespace. Entries are keyed by a digest of the
+embedding model and the normalized text (Unicode NFKC, whitespace runs collapsed
+to one space, ends stripped), and the normalized text is what gets encoded, so a
+cached vector is the same one a fresh encode would return.
+
+Vectors are kept as float16 rows of one array allocated on first use, sized by
+the memory budget; a dict maps each key to its row, in least recently used
+order, and evicted rows are reused. With a disk path, every new vector is also
+written to a SQLite file, which is bounded by its own budget and survives
+restarts; vectors evicted from memory are read back from it.
+
+Every vector is returned as float32 after the float16 round trip, whether it was
+just encoded or cached, so repeated lookups return identical vectors.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Returns the form of `text` used as cache key and sent to the model."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def _key(model_name: str, text: str) -> bytes:
+    return hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+class _DiskTier:
+    """
+    SQLite store of float16 vectors, evicting the least recently accessed ones once
+    the stored vectors exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(
+                self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+            )
+        if found:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            self._conn.commit()
+        return found
+
+    def set_many(self, items: list) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+            [(key, vector, now) for key, vector in items],
+        )
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        if total > self.max_bytes:
+            excess, freed, victims = total - self.max_bytes, 0, []
+            for key, size in self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access"
+            ):
+                victims.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+            self.evictions += len(victims)
+        self._conn.commit()
+
+    @property
+    def bytes_used(self) -> int:
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+
+class EmbeddingCache:
+    """
+    Query embedding cache with float16 storage, an LRU memory tier and an optional
+    SQLite tier.
+
+    Args:
+        max_bytes (int): Size of the float16 vector array; it holds
+            `max_bytes // (2 * dimension)` vectors.
+        disk_path (str, optional): SQLite file vectors are also written to.
+        disk_max_bytes (int): Size bound of the SQLite tier.
+        enabled (bool): When False, every text is encoded and nothing is stored.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        disk_path: str = None,
+        disk_max_bytes: int = 256 * 1024 * 1024,
+        enabled: bool = True,
+    ):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.disk = _DiskTier(disk_path, disk_max_bytes) if disk_path and enabled else None
+        self._vectors = None
+        self._slots = OrderedDict()  # key -> row of _vectors, in LRU order
+        self._free = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.encode_calls = 0
+
+    @property
+    def capacity(self) -> int:
+        """The number of vectors the memory tier holds; 0 before the first one."""
+        return 0 if self._vectors is None else len(self._vectors)
+
+    def _allocate(self, dimension: int) -> None:
+        rows = self.max_bytes // (2 * dimension)
+        self._vectors = np.zeros((rows, dimension), dtype="float16")
+        self._free = list(range(rows - 1, -1, -1))
+
+    def _store(self, key: bytes, vector: np.ndarray) -> None:
+        """Puts a float16 vector in the memory tier. The caller holds the lock."""
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            # A model of another dimension starts over.
+            self._slots.clear()
+            self._allocate(vector.shape[0])
+        if not len(self._vectors):
+            return
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                _, slot = self._slots.popitem(last=False)
+                self.evictions += 1
+        self._slots[key] = slot
+        self._slots.move_to_end(key)
+        self._vectors[slot] = vector
+
+    def encode(self, texts: list, model_name: str, encode_fn) -> np.ndarray:
+        """
+        Returns the embeddings of `texts`, encoding only the ones not cached.
+
+        All misses are encoded in one `encode_fn` call, each distinct normalized
+        text once.
+
+        Args:
+            texts (list): The query strings.
+            model_name (str): Identifies the model (and backend) of the embeddings.
+            encode_fn (callable): Maps a list of texts to an array of normalized
+                embeddings, one row per text.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension), or None if
+                `encode_fn` returned None.
+        """
+        if not self.enabled or not texts:
+            embeddings = encode_fn(list(texts))
+            with self._lock:
+                self.encode_calls += 1
+            return None if embeddings is None else np.asarray(embeddings, dtype="float32")
+
+        normalized = [normalize_text(text) for text in texts]
+        keys = [_key(model_name, text) for text in normalized]
+        found = {}
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is not None and key not in found:
+                    self._slots.move_to_end(key)
+                    found[key] = self._vectors[slot].copy()
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        disk_found = {}
+        if missing and self.disk is not None:
+            with self._lock:
+                for key, blob in self.disk.get_many(missing).items():
+                    disk_found[key] = np.frombuffer(blob, dtype="float16")
+                    self._store(key, disk_found[key])
+            found.update(disk_found)
+            missing = [key for key in missing if key not in disk_found]
+
+        if missing:
+            text_of = dict(zip(keys, normalized))
+            embeddings = encode_fn([text_of[key] for key in missing])
+            if embeddings is None:
+                return None
+            fresh = np.asarray(embeddings).astype("float16")
+            with self._lock:
+                for key, vector in zip(missing, fresh):
+                    found[key] = vector
+                    self._store(key, vector)
+                if self.disk is not None:
+                    self.disk.set_many(
+                        [(key, vector.tobytes()) for key, vector in zip(missing, fresh)]
+                    )
+
+        with self._lock:
+            # Repeats of a text within the call count as hits: it is encoded once.
+            self.encode_calls += bool(missing)
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+            self.disk_hits += len(disk_found)
+            self.memory_hits += len(keys) - len(missing) - len(disk_found)
+        return np.stack([found[key] for key in keys]).astype("float32")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._slots.clear()
+            if self._vectors is not None:
+                self._free = list(range(len(self._vectors) - 1, -1, -1))
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters, occupancy and the bytes used by each tier."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            itemsize = 0 if self._vectors is None else self._vectors.shape[1] * 2
+            return {
+                "enabled": self.enabled,
+                "lookups": lookups,
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "encode_calls": self.encode_calls,
+                "entries": len(self._slots),
+                "capacity": self.capacity,
+                "evictions": self.evictions,
+                "memory_bytes": len(self._slots) * itemsize,
+                "memory_bytes_allocated": 0 if self._vectors is None else self._vectors.nbytes,
+                "disk_bytes": self.disk.bytes_used if self.disk else 0,
+                "disk_evictions": self.disk.evictions if self.disk else 0,
+            }
+
+    @classmethod
+    def from_env(cls) -> "EmbeddingCache":
+        """
+        Builds a cache from environment variables:
+
+        - PROMPTFORGE_EMBEDDING_CACHE: "0" disables caching (default "1").
+        - PROMPTFORGE_EMBEDDING_CACHE_MB: Size of the float16 vector array (default 32).
+        - PROMPTFORGE_EMBEDDING_CACHE_PATH: SQLite file for the disk tier, empty for
+          memory only (the default).
+        - PROMPTFORGE_EMBEDDING_CACHE_DISK_MB: Size bound of the disk tier (default 256).
+        """
+        cache = cls(
+            max_bytes=int(float(os.getenv("PROMPTFORGE_EMBEDDING_CACHE_MB", 32)) * 2**20),
+            disk_path=os.getenv("PROMPTFORGE_EMBEDDING_CACHE_PATH", "") or None,
+            disk_max_bytes=int(
+                float(os.getenv("PROMPTFORGE_EMBEDDING_CACHE_DISK_MB", 256)) * 2**20
+            ),
+            enabled=os.getenv("PROMPTFORGE_EMBEDDING_CACHE", "1") != "0",
+        )
+        logger.info(
+            f"Embedding cache initialized: {cache.max_bytes // 2**20} MB in memory, "
+            f"disk tier {cache.disk.path if cache.disk else 'off'}"
+        )
+        return cache
@@ -1,45 +1,786 @@
 import os
 import json
+import time
+import asyncio
+import contextvars
+import functools
 import logging
+import threading
+import weakref
 
-import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from pydantic import BaseModel, Field, ValidationError, create_model
 
-from google import genai
-from google.genai import types
+from batching import Coalescer, MicroBatcher
+from context_budget import MIN_OUTPUT_TOKENS, ContextBudget, count_tokens
+from embedding_cache import EmbeddingCache
+from llm_cache import LLMCache, cache_key
+from metadata_store import MetadataStore
+from metrics import get_metrics, new_correlation_id
+import profiling
+from resilient_client import ResilientClient
+from semantic_cache import SemanticCache
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from vector_store import (
+    INDEX_PATH as FAISS_INDEX_PATH,
+    MANIFEST_PATH as INDEX_MANIFEST_PATH,
+    apply_search_params,
+    enable_reconstruction,
+    filtered_search_params,
+    knowledge_base_hash,
+    maximal_marginal_relevance,
+    prompt_faiss_id,
+    read_manifest,
+    reconstruct_vectors,
+)
 
-import streamlit as st
-from pydantic import BaseModel
+# Logging is configured by the entry point (app.py, batch.py); the engine only logs.
+logger = logging.getLogger(__name__)
 
-from knowledge_base import KNOWLEDGE_BASE  # Import KNOWLEDGE_BASE at the top
+LLM_MODEL = "gemini-2.0-flash"
+RAG_MODEL_NAME = "all-MiniLM-L6-v2"
 
-# LOGGER CONFIG
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    filename="engine.log",
-)
-logger = logging.getLogger(__name__)
+# Heavy resources are created on first use rather than at import time, so that
+# callers needing only SYSTEM_PROMPTS or the prompt builders start instantly.
+# Each resource has its own lock so a slow model load never blocks the client.
+_GEMINI_LOCK = threading.Lock()
+_RAG_MODEL_LOCK = threading.Lock()
+_FAISS_INDEX_LOCK = threading.Lock()
+_WARMUP_LOCK = threading.Lock()
+_LLM_CACHE_LOCK = threading.Lock()
+_SEMANTIC_CACHE_LOCK = threading.Lock()
+_EMBEDDING_CACHE_LOCK = threading.Lock()
+_CONTEXT_BUDGET_LOCK = threading.Lock()
+_BM25_LOCK = threading.Lock()
+_STRATEGY_CLASSIFIER_LOCK = threading.Lock()
+_gemini_client = None
+_llm_cache = None
+_semantic_cache = None
+_semantic_cache_configured = False
+_embedding_cache = None
+_context_budget = None
+_rag_model = None
+_rag_model_key = None  # Model and backend, keys the embedding cache.
+_faiss_index = None
+_kb_lookup = None
+_mmr_supported = False
+_bm25_index = None
+_bm25_checked = False
+_strategy_classifier = None
+_strategy_classifier_checked = False
+_FILTER_PARAMS_LOCK = threading.Lock()
+_filter_params = {}  # (strategy, domain, prompt_id_prefix, k) -> SearchParameters
+FILTER_PARAMS_CACHE_SIZE = 256
+_warmup_thread = None
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+# Candidates taken from each ranking before hybrid fusion, per requested example.
+HYBRID_CANDIDATES_PER_RESULT = 10
+# In-flight LLM calls per event loop; asyncio tasks cannot be shared across loops.
+_llm_coalescers = weakref.WeakKeyDictionary()
+# A one-item list counting the calls that reach the model in the current context,
+# set by `tournament_async`; cache hits and coalesced followers are not counted.
+_model_calls = contextvars.ContextVar("model_calls", default=None)
+JUDGE_MODES = ("single", "batched")
+# Passed as the strategy, picks one from the prompt's embedding; see `rank_strategies`.
+AUTO_STRATEGY = "Auto"
+# Pending judge pairs per event loop, packed into batched judge calls.
+_judge_batchers = weakref.WeakKeyDictionary()
+
+
+def get_gemini_client():
+    """
+    Returns the shared Gemini client, creating it on first use.
+
+    The client is wrapped in a `ResilientClient`, which adds timeouts, retries and
+    a circuit breaker; see `ResilientClient.from_env` for the settings. With
+    PROMPTFORGE_LLM_BACKEND=fake, the wrapped client is the offline
+    `fake_llm.FakeGeminiClient` (see its `from_env`) and no API key is needed.
+
+    Returns:
+        ResilientClient: The client, or None if it could not be created.
+    """
+    global _gemini_client
+    if _gemini_client is None:
+        with _GEMINI_LOCK:
+            if _gemini_client is None:
+                try:
+                    backend = os.getenv("PROMPTFORGE_LLM_BACKEND", "gemini")
+                    if backend == "fake":
+                        from fake_llm import FakeGeminiClient
+
+                        client = FakeGeminiClient.from_env()
+                    elif backend == "gemini":
+                        from google import genai
+
+                        # The SDK's own HTTP timeout ends hung requests, so that sync
+                        # attempts timed out by ResilientClient free their threads.
+                        timeout = float(os.getenv("PROMPTFORGE_LLM_TIMEOUT", 30))
+                        client = genai.Client(
+                            api_key=os.getenv("GOOGLE_API_KEY"),
+                            http_options={"timeout": int(timeout * 1000)} if timeout else None,
+                        )
+                    else:
+                        raise ValueError(f"Unknown LLM backend '{backend}'")
+                    _gemini_client = ResilientClient.from_env(client)
+                    logger.info(f"LLM client initialized successfully ({backend}).")
+                except Exception as e:
+                    logger.error(f"Failed to initialize Gemini client: {e}")
+    return _gemini_client
+
+
+def set_gemini_client(client) -> None:
+    """
+    Replaces the shared Gemini client, e.g. with `fake_llm.FakeGeminiClient`.
+
+    The client is used as given; wrap it in `ResilientClient` for retries.
+
+    Args:
+        client: An object exposing `models.generate_content` and `aio.models.generate_content`.
+    """
+    global _gemini_client
+    with _GEMINI_LOCK:
+        _gemini_client = client
+
+
+def get_rag_model():
+    """
+    Returns the shared sentence embedding model, loading it on first use.
+
+    With PROMPTFORGE_EMBEDDING_BACKEND=onnx (or onnx-int8, the quantized export),
+    the model's ONNX export is run with ONNX Runtime instead of PyTorch; see
+    `onnx_embedder.backend_from_env` and `OnnxEmbedder.from_env` for the settings.
+
+    Returns:
+        SentenceTransformer | OnnxEmbedder: The model, or None if it could not be loaded.
+    """
+    global _rag_model, _rag_model_key
+    if _rag_model is None:
+        with _RAG_MODEL_LOCK:
+            if _rag_model is None:
+                try:
+                    from onnx_embedder import backend_from_env
+
+                    backend = backend_from_env()
+                    _rag_model_key = f"{RAG_MODEL_NAME}:{backend}"
+                    logger.info(f"Loading embedding model {RAG_MODEL_NAME} ({backend})...")
+                    if backend in ("onnx", "onnx-int8"):
+                        from onnx_embedder import OnnxEmbedder
+
+                        _rag_model = OnnxEmbedder.from_env(
+                            RAG_MODEL_NAME, quantized=backend == "onnx-int8"
+                        )
+                    elif backend == "torch":
+                        from sentence_transformers import SentenceTransformer
+
+                        _rag_model = SentenceTransformer(RAG_MODEL_NAME)
+                    else:
+                        raise ValueError(f"Unknown embedding backend '{backend}'")
+                except Exception as e:
+                    logger.error(f"Failed to load embedding model: {e}")
+    return _rag_model
+
+
+def get_faiss_index():
+    """
+    Returns the shared FAISS index, reading it from disk on first use.
+
+    Returns:
+        faiss.Index: The index, or None if it could not be read.
+    """
+    global _faiss_index
+    if _faiss_index is None:
+        with _FAISS_INDEX_LOCK:
+            if _faiss_index is None:
+                try:
+                    import faiss
+
+                    index = faiss.read_index(FAISS_INDEX_PATH, _index_io_flags())
+                    global _kb_lookup
+                    _kb_lookup = _check_manifest(index)
+                    if _kb_lookup is not None:
+                        applied = apply_search_params(
+                            index,
+                            nprobe=_int_env("PROMPTFORGE_NPROBE"),
+                            ef_search=_int_env("PROMPTFORGE_EF_SEARCH"),
+                        )
+                        global _mmr_supported
+                        if _mmr_settings()[0] > 1:
+                            _mmr_supported = enable_reconstruction(index)
+                            if not _mmr_supported:
+                                logger.warning(
+                                    "The FAISS index cannot reconstruct vectors; "
+                                    "retrieval results are not re-ranked with MMR."
+                                )
+                        _faiss_index = index
+                        logger.info(
+                            f"FAISS index loaded successfully. Index has {index.ntotal} entries. "
+                            f"Search params: {applied or 'defaults'}"
+                        )
+                except Exception as e:
+                    logger.error(f"Failed to load FAISS index: {e}")
+    return _faiss_index
+
+
+def get_bm25_index():
+    """
+    Returns the shared BM25 index written next to the FAISS index, opening it on
+    first use.
+
+    Returns:
+        BM25Index: The index, or None if the manifest lists none.
+    """
+    global _bm25_index, _bm25_checked
+    if not _bm25_checked:
+        with _BM25_LOCK:
+            if not _bm25_checked:
+                manifest = read_manifest(INDEX_MANIFEST_PATH) or {}
+                path = os.path.join(
+                    os.path.dirname(INDEX_MANIFEST_PATH), manifest.get("bm25") or ""
+                )
+                if manifest.get("bm25") and os.path.isdir(path):
+                    try:
+                        _bm25_index = BM25Index(path)
+                        logger.info(
+                            f"BM25 index loaded: {_bm25_index.count} entries, "
+                            f"{_bm25_index.vocabulary_size} terms."
+                        )
+                    except Exception as e:
+                        logger.error(f"Failed to load BM25 index: {e}")
+                else:
+                    logger.warning(
+                        "No BM25 index found; run `python knowledge_base.py` to build it."
+                    )
+                _bm25_checked = True
+    return _bm25_index
+
+
+def get_strategy_classifier():
+    """
+    Returns the strategy classifier written next to the FAISS index, loading it on
+    first use.
+
+    Returns:
+        StrategyClassifier: The classifier, or None if the manifest lists none.
+    """
+    global _strategy_classifier, _strategy_classifier_checked
+    if not _strategy_classifier_checked:
+        with _STRATEGY_CLASSIFIER_LOCK:
+            if not _strategy_classifier_checked:
+                from strategy_classifier import StrategyClassifier
+
+                manifest = read_manifest(INDEX_MANIFEST_PATH) or {}
+                path = os.path.join(
+                    os.path.dirname(INDEX_MANIFEST_PATH),
+                    manifest.get("strategy_classifier") or "",
+                )
+                if manifest.get("strategy_classifier") and os.path.isfile(path):
+                    try:
+                        _strategy_classifier = StrategyClassifier.load(path)
+                        logger.info(
+                            f"Strategy classifier loaded: {len(_strategy_classifier.labels)} "
+                            f"strategies, temperature {_strategy_classifier.temperature:.3f}."
+                        )
+                    except Exception as e:
+                        logger.error(f"Failed to load strategy classifier: {e}")
+                else:
+                    logger.warning(
+                        "No strategy classifier found; run `python knowledge_base.py` to "
+                        "build it."
+                    )
+                _strategy_classifier_checked = True
+    return _strategy_classifier
+
+
+def _index_io_flags() -> int:
+    """
+    Chooses FAISS read flags; PROMPTFORGE_INDEX_MMAP=1 maps the index read-only.
+
+    A memory-mapped index is backed by the page cache, so every process on a host
+    that opens the same file shares one copy of the vectors. IVF indexes map their
+    inverted lists (IO_FLAG_MMAP); flat and HNSW indexes map their flat code
+    storage (IO_FLAG_MMAP_IFC).
+    """
+    import faiss
+
+    if os.getenv("PROMPTFORGE_INDEX_MMAP", "0") != "1":
+        return 0
+    manifest = read_manifest(INDEX_MANIFEST_PATH) or {}
+    if "IVF" in manifest.get("index_factory", ""):
+        flag = faiss.IO_FLAG_MMAP
+    else:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return flag | faiss.IO_FLAG_READ_ONLY
+
+
+def _int_env(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def set_search_params(nprobe: int = None, ef_search: int = None) -> dict:
+    """
+    Tunes the recall/latency trade-off of the loaded approximate index.
+
+    Args:
+        nprobe (int, optional): Inverted lists visited per query for IVF indexes.
+        ef_search (int, optional): Search-time candidate list size for HNSW indexes.
+
+    Returns:
+        dict: The parameters that the index accepted.
+    """
+    index = get_faiss_index()
+    if index is None:
+        return {}
+    applied = apply_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    # Filtered search parameters are derived from nprobe/efSearch.
+    with _FILTER_PARAMS_LOCK:
+        _filter_params.clear()
+    return applied
+
+
+def _check_embedding_backend(manifest: dict) -> None:
+    """Warns when queries are embedded by a backend too far from the index's."""
+    from onnx_embedder import backend_from_env, embedding_agreement
+
+    indexed_with = manifest.get("embedding_backend", "torch")
+    active = backend_from_env()
+    agreement = embedding_agreement(RAG_MODEL_NAME, indexed_with, active)
+    threshold = float(os.getenv("PROMPTFORGE_EMBEDDING_MIN_AGREEMENT", 0.99))
+    if agreement is None or agreement < threshold:
+        agreement_text = "unknown" if agreement is None else f"{agreement:.4f}"
+        logger.warning(
+            f"Index was built with {indexed_with} embeddings but queries use {active} "
+            f"(cosine agreement {agreement_text} < {threshold}). Re-index with "
+            f"`python knowledge_base.py --embedding-backend {active}`."
+        )
+
+
+def _check_manifest(index):
+    """
+    Validates a freshly read index against its manifest and the knowledge base.
+
+    The built-in `KNOWLEDGE_BASE` is only imported for indexes built from it
+    without a metadata store; ingested knowledge bases are never loaded into memory.
+
+    Returns:
+        MetadataStore | dict | list: Maps search result ids to knowledge base entries:
+            the memory-mapped metadata store written with the index, a dict keyed by
+            FAISS id for older manifests, or the knowledge base list itself for legacy
+            position-addressed indexes. None if the index must not be used.
+    """
+    manifest = read_manifest(INDEX_MANIFEST_PATH)
+    if manifest is None:
+        from knowledge_base import KNOWLEDGE_BASE
+
+        logger.warning(
+            "No index manifest found; assuming a legacy index addressed by list position. "
+            "Run `python knowledge_base.py` to rebuild it with stable ids."
+        )
+        return KNOWLEDGE_BASE
+
+    if manifest.get("model") != RAG_MODEL_NAME or manifest.get("dimension") != index.d:
+        logger.error(
+            f"Index was built with {manifest.get('model')} (d={manifest.get('dimension')}) "
+            f"but the engine uses {RAG_MODEL_NAME} (d={index.d}). Rebuild the index."
+        )
+        return None
+    _check_embedding_backend(manifest)
+    if manifest.get("count") != index.ntotal:
+        logger.error(
+            f"Index has {index.ntotal} entries but its manifest lists {manifest.get('count')}. "
+            "Rebuild the index."
+        )
+        return None
+    metadata_path = os.path.join(
+        os.path.dirname(INDEX_MANIFEST_PATH), manifest.get("metadata") or ""
+    )
+    has_metadata = manifest.get("metadata") and os.path.isdir(metadata_path)
+    if manifest.get("sources"):
+        # Ingested with `ingest.py`: the index does not mirror KNOWLEDGE_BASE.
+        if has_metadata:
+            return MetadataStore(metadata_path)
+        logger.error("Index was ingested from files but its metadata store is missing.")
+        return None
+
+    from knowledge_base import KNOWLEDGE_BASE
+
+    if manifest.get("hash") != knowledge_base_hash(KNOWLEDGE_BASE):
+        logger.warning(
+            "Knowledge base has changed since the index was built; edited or added entries "
+            "will not be retrieved until `python knowledge_base.py` is run."
+        )
+    if has_metadata:
+        return MetadataStore(metadata_path)
+    return {prompt_faiss_id(entry["prompt_id"]): entry for entry in KNOWLEDGE_BASE}
+
+
+def start_warmup() -> threading.Thread:
+    """
+    Loads the embedding model and FAISS index in a background thread.
+
+    Safe to call repeatedly; only the first call starts a thread.
+
+    Returns:
+        threading.Thread: The warm-up thread.
+    """
+    global _warmup_thread
+    with _WARMUP_LOCK:
+        if _warmup_thread is None:
+
+            def warm_up():
+                started = time.perf_counter()
+                get_rag_model()
+                get_faiss_index()
+                logger.info(f"RAG warm-up finished in {time.perf_counter() - started:.2f}s")
+
+            _warmup_thread = threading.Thread(
+                target=warm_up, name="promptforge-warmup", daemon=True
+            )
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def get_llm_cache() -> LLMCache:
+    """
+    Returns the shared LLM response cache, configured from the environment on first use.
+
+    Returns:
+        LLMCache: The cache. See `LLMCache.from_env` for the settings.
+    """
+    global _llm_cache
+    if _llm_cache is None:
+        with _LLM_CACHE_LOCK:
+            if _llm_cache is None:
+                _llm_cache = LLMCache.from_env()
+    return _llm_cache
+
+
+def set_llm_cache(cache: LLMCache) -> None:
+    """
+    Replaces the shared LLM response cache.
+
+    Args:
+        cache (LLMCache): The new cache, e.g. `LLMCache(enabled=False)` to bypass caching.
+    """
+    global _llm_cache
+    with _LLM_CACHE_LOCK:
+        _llm_cache = cache
+
+
+def get_semantic_cache():
+    """
+    Returns the shared semantic forge cache, or None when it is not enabled.
+
+    The cache is opt-in: set PROMPTFORGE_SEMANTIC_CACHE=1 or call `set_semantic_cache`.
+
+    Returns:
+        SemanticCache: The cache, or None.
+    """
+    global _semantic_cache, _semantic_cache_configured
+    if not _semantic_cache_configured:
+        with _SEMANTIC_CACHE_LOCK:
+            if not _semantic_cache_configured:
+                _semantic_cache = SemanticCache.from_env()
+                _semantic_cache_configured = True
+    return _semantic_cache
+
+
+def set_semantic_cache(cache) -> None:
+    """
+    Replaces the shared semantic forge cache.
+
+    Args:
+        cache (SemanticCache): The new cache, or None to disable semantic caching.
+    """
+    global _semantic_cache, _semantic_cache_configured
+    with _SEMANTIC_CACHE_LOCK:
+        _semantic_cache = cache
+        _semantic_cache_configured = True
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Returns the shared query embedding cache, configured from the environment on first use.
 
-# GEMINI CONFIG
-try:
-    GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-    GEMINI_CLIENT = genai.Client(api_key=GEMINI_API_KEY)
-    logger.info("Gemini client initialized successfully.")
-
-    # RAG Components
-    logger.info("Loading RAG components...")
-    RAG_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
-    FAISS_INDEX = faiss.read_index("knowledge_base_index.bin")
-    logger.info(
-        f"RAG components loaded successfully. Index has {FAISS_INDEX.ntotal} entries."
+    Returns:
+        EmbeddingCache: The cache. See `EmbeddingCache.from_env` for the settings.
+    """
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _EMBEDDING_CACHE_LOCK:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache.from_env()
+    return _embedding_cache
+
+
+def set_embedding_cache(cache: EmbeddingCache) -> None:
+    """
+    Replaces the shared query embedding cache.
+
+    Args:
+        cache (EmbeddingCache): The new cache, e.g. `EmbeddingCache(enabled=False)`
+            to encode every query.
+    """
+    global _embedding_cache
+    with _EMBEDDING_CACHE_LOCK:
+        _embedding_cache = cache
+
+
+def get_context_budget() -> ContextBudget:
+    """
+    Returns the shared token budget for refiner and judge calls.
+
+    Returns:
+        ContextBudget: The budget. See `ContextBudget.from_env` for the settings.
+    """
+    global _context_budget
+    if _context_budget is None:
+        with _CONTEXT_BUDGET_LOCK:
+            if _context_budget is None:
+                _context_budget = ContextBudget.from_env()
+    return _context_budget
+
+
+def set_context_budget(budget: ContextBudget) -> None:
+    """
+    Replaces the shared token budget.
+
+    Args:
+        budget (ContextBudget): The new budget, e.g. `ContextBudget(0, 0)` to send
+            every example and full outputs.
+    """
+    global _context_budget
+    with _CONTEXT_BUDGET_LOCK:
+        _context_budget = budget
+
+
+def _is_valid_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except (TypeError, json.JSONDecodeError):
+        return False
+
+
+def _count_model_call() -> None:
+    tally = _model_calls.get()
+    if tally is not None:
+        tally[0] += 1
+
+
+def _token_usage(response, contents, config, text) -> tuple:
+    """
+    Returns (input_tokens, output_tokens) from the response's usage metadata, or
+    the local approximation when the client does not report usage.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", None) is not None:
+        return usage.prompt_token_count, usage.candidates_token_count or 0
+    system = config.get("system_instruction", "") if isinstance(config, dict) else ""
+    return count_tokens(system) + count_tokens(str(contents)), count_tokens(text or "")
+
+
+def _generate_text(
+    client, contents, config=None, validate=None, stage="generate"
+) -> str:
+    """
+    Calls `generate_content` through the LLM cache and returns the response text.
+
+    Args:
+        client: The Gemini client.
+        contents: The request contents.
+        config (dict, optional): The generation config.
+        validate (callable, optional): Only responses for which this returns True are cached.
+        stage (str): The pipeline stage the call is counted under in the metrics.
+
+    Returns:
+        str: The raw response text.
+    """
+    metrics = get_metrics()
+    cache = get_llm_cache()
+    key = cache_key(LLM_MODEL, contents, config)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.record_llm_call(stage, 0, 0, cached=True)
+        return cached
+
+    with metrics.timer("promptforge_llm_seconds", stage=stage):
+        response = client.models.generate_content(
+            model=LLM_MODEL, config=config, contents=contents
+        )
+    text = response.text
+    # Counting tokens scans the whole prompt and output; skip it when metrics are off.
+    if metrics.enabled:
+        metrics.record_llm_call(
+            stage, *_token_usage(response, contents, config, text), cached=False
+        )
+    _count_model_call()
+    if text is not None and (validate is None or validate(text)):
+        cache.set(key, text)
+    return text
+
+
+def _llm_coalescer() -> Coalescer:
+    loop = asyncio.get_running_loop()
+    coalescer = _llm_coalescers.get(loop)
+    if coalescer is None:
+        coalescer = _llm_coalescers[loop] = Coalescer("llm")
+    return coalescer
+
+
+async def _generate_text_async(
+    client, contents, config=None, validate=None, stage="generate"
+) -> str:
+    """
+    Async variant of `_generate_text` using `client.aio`.
+
+    Identical calls made while one is in flight share its response instead of
+    reaching the model again.
+    """
+    key = cache_key(LLM_MODEL, contents, config)
+    cached = get_llm_cache().get(key)
+    if cached is not None:
+        get_metrics().record_llm_call(stage, 0, 0, cached=True)
+        return cached
+    return await _llm_coalescer().run(
+        key, lambda: _call_llm_async(client, contents, config, validate, stage, key)
     )
 
-except Exception as e:
-    logging.error(f"Failed to initialize Gemini client: {e}")
-    GEMINI_CLIENT = None
-    RAG_MODEL = None
-    FAISS_INDEX = None
+
+async def _call_llm_async(client, contents, config, validate, stage, key) -> str:
+    metrics = get_metrics()
+    cache = get_llm_cache()
+    with metrics.timer("promptforge_llm_seconds", stage=stage):
+        response = await client.aio.models.generate_content(
+            model=LLM_MODEL, config=config, contents=contents
+        )
+    text = response.text
+    if metrics.enabled:
+        metrics.record_llm_call(
+            stage, *_token_usage(response, contents, config, text), cached=False
+        )
+    _count_model_call()
+    if text is not None and (validate is None or validate(text)):
+        cache.set(key, text)
+    return text
+
+
+def _log_stream_timing(stage: str, started: float, first_token, cached: bool) -> None:
+    total = time.perf_counter() - started
+    metrics = get_metrics()
+    if first_token is not None:
+        metrics.observe("promptforge_first_token_seconds", first_token, stage=stage)
+    if not cached:
+        metrics.observe("promptforge_llm_seconds", total, stage=stage)
+    first = f"{first_token:.3f}s" if first_token is not None else "never"
+    source = " (cached)" if cached else ""
+    logger.info(f"{stage}{source}: first visible token {first}, total {total:.3f}s")
+
+
+def _generate_stream(client, contents, config=None, validate=None, stage="generate"):
+    """
+    Streams `generate_content_stream` chunks through the LLM cache.
+
+    A cached response is yielded as a single chunk. Otherwise the assembled text is
+    cached once the stream closes; a stream abandoned midway is not cached. Time to
+    first visible token and total time are logged under `stage`.
+
+    Yields:
+        str: Response text chunks.
+    """
+    started = time.perf_counter()
+    metrics = get_metrics()
+    cache = get_llm_cache()
+    key = cache_key(LLM_MODEL, contents, config)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.record_llm_call(stage, 0, 0, cached=True)
+        _log_stream_timing(stage, started, time.perf_counter() - started, cached=True)
+        yield cached
+        return
+
+    parts, first_token, chunk = [], None, None
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=LLM_MODEL, config=config, contents=contents
+        ):
+            if not chunk.text:
+                continue
+            if first_token is None and chunk.text.strip():
+                first_token = time.perf_counter() - started
+            parts.append(chunk.text)
+            yield chunk.text
+    except Exception:
+        metrics.inc("promptforge_errors_total", stage=stage)
+        raise
+
+    _log_stream_timing(stage, started, first_token, cached=False)
+    text = "".join(parts)
+    # The last chunk carries the usage metadata of the whole response.
+    if metrics.enabled:
+        metrics.record_llm_call(
+            stage, *_token_usage(chunk, contents, config, text), cached=False
+        )
+    _count_model_call()
+    if parts and (validate is None or validate(text)):
+        cache.set(key, text)
+
+
+async def _generate_stream_async(
+    client, contents, config=None, validate=None, stage="generate"
+):
+    """Async variant of `_generate_stream` using `client.aio`."""
+    started = time.perf_counter()
+    metrics = get_metrics()
+    cache = get_llm_cache()
+    key = cache_key(LLM_MODEL, contents, config)
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.record_llm_call(stage, 0, 0, cached=True)
+        _log_stream_timing(stage, started, time.perf_counter() - started, cached=True)
+        yield cached
+        return
+
+    parts, first_token, chunk = [], None, None
+    try:
+        stream = await client.aio.models.generate_content_stream(
+            model=LLM_MODEL, config=config, contents=contents
+        )
+        async for chunk in stream:
+            if not chunk.text:
+                continue
+            if first_token is None and chunk.text.strip():
+                first_token = time.perf_counter() - started
+            parts.append(chunk.text)
+            yield chunk.text
+    except Exception:
+        metrics.inc("promptforge_errors_total", stage=stage)
+        raise
+
+    _log_stream_timing(stage, started, first_token, cached=False)
+    text = "".join(parts)
+    # The last chunk carries the usage metadata of the whole response.
+    if metrics.enabled:
+        metrics.record_llm_call(
+            stage, *_token_usage(chunk, contents, config, text), cached=False
+        )
+    _count_model_call()
+    if parts and (validate is None or validate(text)):
+        cache.set(key, text)
+
+
+def __getattr__(name):
+    # Keeps `engine.GEMINI_CLIENT`, `engine.RAG_MODEL` and `engine.FAISS_INDEX` working
+    # for existing callers without loading them at import time.
+    accessors = {
+        "GEMINI_CLIENT": get_gemini_client,
+        "RAG_MODEL": get_rag_model,
+        "FAISS_INDEX": get_faiss_index,
+    }
+    if name in accessors:
+        return accessors[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 SYSTEM_PROMPTS = {
@@ -86,113 +827,553 @@ SYSTEM_PROMPTS = {
 }
 
 
-def retrieve_relevant_examples(query, k=3):
+def _lookup_entry(faiss_id: int):
+    """Returns the knowledge base entry stored under a search result id, or None."""
+    if isinstance(_kb_lookup, list):
+        return _kb_lookup[faiss_id] if 0 <= faiss_id < len(_kb_lookup) else None
+    if _kb_lookup is not None:
+        return _kb_lookup.get(faiss_id)
+    return None
+
+
+def _format_example(example: dict) -> str:
+    """Formats a knowledge base entry as a few-shot example for the refiner."""
+    return (
+        f"Example (from {example['domain']}/{example['strategy']}):\n"
+        f"Prompt: {example['prompt_text']}\n"
+        f"Explanation: {example['explanation']}\n"
+    )
+
+
+def retrieve_relevant_examples(
+    query, k=3, strategy=None, domain=None, prompt_id_prefix=None, mode=None
+):
     """
     Retrieves the most relevant examples from the knowledge base based on the query.
 
     Args:
         query (str): The query to search for relevant examples.
         k (int): The number of relevant examples to retrieve.
+        strategy (str, optional): Only retrieve examples of this strategy.
+        domain (str, optional): Only retrieve examples of this domain.
+        prompt_id_prefix (str, optional): Only retrieve examples whose prompt_id
+            starts with this prefix.
+        mode (str, optional): "dense", "lexical" or "hybrid"; see
+            `retrieve_relevant_examples_batch`.
 
     Returns:
         list: A list of relevant examples.
     """
-    if not RAG_MODEL or not FAISS_INDEX:
-        logging.error("ERROR: RAG/Vector Search not initialized.")
-        return []
-
-    try:
-        logging.info(f"Retrieving {k} relevant examples for query: {query}")
+    logger.info(f"Retrieving {k} relevant examples for query: {query}")
+    return retrieve_relevant_examples_batch(
+        [query],
+        k,
+        strategy=strategy,
+        domain=domain,
+        prompt_id_prefix=prompt_id_prefix,
+        mode=mode,
+    )[0]
 
-        # Encode the query
-        query_embedding = RAG_MODEL.encode([query], normalize_embeddings=True)
 
-        # Search for the most similar examples
-        distances, indices = FAISS_INDEX.search(query_embedding.astype("float32"), k)
+def _allowed_ids(strategy=None, domain=None, prompt_id_prefix=None):
+    """
+    Returns the search result ids of the entries matching the filters.
 
-        # Retrieve the relevant examples and format them
-        relevant_examples = []
-        for i in indices[0]:
-            # Ensure the index is valid
-            if 0 <= i < len(KNOWLEDGE_BASE):
-                example = KNOWLEDGE_BASE[i]
-                formatted_example = (
-                    f"Example (from {example['domain']}/{example['strategy']}):\n"
-                    f"Prompt: {example['prompt_text']}\n"
-                    f"Explanation: {example['explanation']}\n"
-                )
-                relevant_examples.append(formatted_example)
+    Returns:
+        np.ndarray: The sorted matching ids, or None if no filter was given.
+    """
+    if strategy is None and domain is None and not prompt_id_prefix:
+        return None
+    if isinstance(_kb_lookup, MetadataStore):
+        return _kb_lookup.filter_ids(
+            strategy=strategy, domain=domain, prompt_id_prefix=prompt_id_prefix
+        )
 
-        return relevant_examples
-    except Exception as e:
-        logging.error(f"Exception occurred in retrieve_relevant_examples: {e}")
-        return []
+    if isinstance(_kb_lookup, list):
+        items = enumerate(_kb_lookup)
+    else:
+        items = _kb_lookup.items()
+    return np.array(
+        sorted(
+            faiss_id
+            for faiss_id, entry in items
+            if (strategy is None or entry["strategy"] == strategy)
+            and (domain is None or entry["domain"] == domain)
+            and (not prompt_id_prefix or entry["prompt_id"].startswith(prompt_id_prefix))
+        ),
+        dtype="int64",
+    )
 
 
-def refine_prompt(user_prompt: str, system_prompt: str, retrieved_examples: str) -> str:
+def _search_params_for(faiss_index, k, strategy=None, domain=None, prompt_id_prefix=None):
     """
-    Refines a user prompt based on the specified strategy and retrieved examples.
-
-    Args:
-        user_prompt (str): The original user prompt to be refined.
-        strategy (str): The strategy to use for refining the prompt.
-        retrieved_examples (str): Examples of prompts that have been refined using the same strategy.
+    Returns search parameters restricted to the filtered partition.
 
-    Returns:
-        str: The refined prompt.
+    The selector for each filter combination is built once and reused. None means
+    a global search: no filter was given, or fewer than k entries match it.
     """
-    if not GEMINI_CLIENT:
-        logging.error("ERROR: GEMINI CLIENT not initialized.")
-        return ""
-
-    try:
-        prompt_for_refiner = f"""
-        **User's Basic Prompt:**
-        "{user_prompt}"
-
-        **Examples of High-Quality Prompts to Learn From:**
-        {retrieved_examples}
-        """
+    key = (strategy, domain, prompt_id_prefix, k)
+    with _FILTER_PARAMS_LOCK:
+        if key in _filter_params:
+            return _filter_params[key]
 
-        response = GEMINI_CLIENT.models.generate_content(
-            model="gemini-2.0-flash",
-            config=types.GenerateContentConfig(system_instruction=system_prompt),
-            contents=prompt_for_refiner,
+    allowed = _allowed_ids(strategy, domain, prompt_id_prefix)
+    if allowed is None:
+        params = None
+    elif len(allowed) < k:
+        logger.info(
+            f"Only {len(allowed)} examples match strategy={strategy}, domain={domain}, "
+            f"prompt_id_prefix={prompt_id_prefix}; searching the whole index."
         )
+        params = None
+    else:
+        params = filtered_search_params(faiss_index, allowed, k)
 
-        return response.text.strip()
+    with _FILTER_PARAMS_LOCK:
+        if len(_filter_params) >= FILTER_PARAMS_CACHE_SIZE:
+            _filter_params.pop(next(iter(_filter_params)))
+        _filter_params[key] = params
+    return params
 
-    except Exception as e:
-        logger.error(f"Exception occurred in refine_prompt: {e}")
-        return ""
 
+def _search(faiss_index, query_embeddings, k, params=None):
+    """
+    Searches the index, restricted by `params` when given.
 
-class JudgeOutput(BaseModel):
-    score_A: int
-    score_B: int
+    Rows that a filtered search on an approximate index leaves short of k results
+    are topped up from a global search.
+    """
+    if params is None:
+        _, indices = faiss_index.search(query_embeddings, k)
+        return indices
 
+    _, indices = faiss_index.search(query_embeddings, k, params=params)
+    short = np.flatnonzero((indices < 0).any(axis=1))
+    if len(short):
+        _, fallback = faiss_index.search(query_embeddings[short], k)
+        for row, extra in zip(short, fallback):
+            found = [i for i in indices[row] if i >= 0]
+            found += [i for i in extra if i >= 0 and i not in found]
+            indices[row] = (found + [-1] * k)[:k]
+    return indices
 
-def evaluate_outputs(
-    original_output: str, refined_output: str, user_prompt: str
-) -> dict:
+
+def embed_queries(queries: list):
     """
-    Evaluates and scores the original and refined outputs using a "Judge LLM".
+    Encodes queries into normalized embeddings with a single forward pass.
+
+    Queries found in the embedding cache are not encoded again; the others are
+    encoded together. See `get_embedding_cache`.
 
     Args:
-        original_output (str): The output generated from the original prompt.
-        refined_output (str): The output generated from the refined prompt.
-        user_prompt (str): The original user prompt that started the process.
+        queries (list): The query strings.
 
     Returns:
-        dict: A dictionary containing 'score_A' and 'score_B', or default scores on error.
+        np.ndarray: A float32 array of shape (len(queries), dimension), or None if the
+            embedding model is unavailable.
     """
-    if not GEMINI_CLIENT:
-        logging.error("Cannot evaluate outputs, Gemini client is not available.")
-        return {"score_A": 0, "score_B": 0}
+    rag_model = get_rag_model()
+    if not rag_model:
+        logger.error("ERROR: RAG model not initialized.")
+        return None
+    metrics = get_metrics()
+    encoded = 0
 
-    judge_prompt_template = f"""
-    You are an impartial and meticulous AI Quality Analyst. Your task is to evaluate two AI-generated responses based on a user's request. You must compare them on the following criteria:
-    1.  **Relevance**: How well does the response address the user's core request?
+    def encode(texts):
+        nonlocal encoded
+        with metrics.timer(stage="embed"):
+            embeddings = rag_model.encode(texts, normalize_embeddings=True)
+        encoded = len(texts)
+        return embeddings
+
+    cache = get_embedding_cache()
+    embeddings = cache.encode(list(queries), _rag_model_key, encode)
+    metrics.inc("promptforge_embedded_queries_total", encoded)
+    if cache.enabled:
+        metrics.inc("promptforge_embedding_cache_hits_total", len(queries) - encoded)
+        metrics.inc("promptforge_embedding_cache_misses_total", encoded)
+    return embeddings
+
+
+def auto_strategy_available() -> bool:
+    """
+    Returns whether `AUTO_STRATEGY` can pick a strategy: a strategy classifier was
+    built with the index and knows at least one of the `SYSTEM_PROMPTS` strategies.
+
+    Classifiers trained by `ingest.py` on an external corpus carry that corpus's
+    strategy labels, which need not match the refinement strategies.
+    """
+    classifier = get_strategy_classifier()
+    return classifier is not None and bool(set(classifier.labels) & set(SYSTEM_PROMPTS))
+
+
+def rank_strategies(query_embedding) -> list:
+    """
+    Ranks the `SYSTEM_PROMPTS` strategies for a prompt, locally and without an LLM call.
+
+    Args:
+        query_embedding (np.ndarray): The prompt's embedding from `embed_queries`.
+
+    Returns:
+        list: Dicts with "strategy" and "confidence", most likely first; empty if
+            no strategy classifier was built with the index or it knows none of
+            the strategies. Classifier labels that are not strategies are ignored.
+    """
+    if not auto_strategy_available():
+        return []
+    classifier = get_strategy_classifier()
+    with get_metrics().timer(stage="select_strategy"):
+        ranking = classifier.rank(
+            np.asarray(query_embedding, dtype="float32").reshape(1, -1), list(SYSTEM_PROMPTS)
+        )[0]
+    return [{"strategy": name, "confidence": confidence} for name, confidence in ranking]
+
+
+def _fusion_settings() -> tuple:
+    """Returns the (dense weight, lexical weight, RRF constant) from the environment."""
+    return (
+        float(os.getenv("PROMPTFORGE_HYBRID_DENSE_WEIGHT", 1.0)),
+        float(os.getenv("PROMPTFORGE_HYBRID_LEXICAL_WEIGHT", 1.0)),
+        int(os.getenv("PROMPTFORGE_HYBRID_RRF_K", 60)),
+    )
+
+
+def _mmr_settings() -> tuple:
+    """
+    Returns the MMR (over-fetch factor, lambda) from the environment. A factor of 1
+    disables re-ranking.
+    """
+    return (
+        max(int(os.getenv("PROMPTFORGE_MMR_FETCH_FACTOR", 4)), 1),
+        float(os.getenv("PROMPTFORGE_MMR_LAMBDA", 0.7)),
+    )
+
+
+def _rerank_mmr(faiss_index, query_embeddings, indices, k, lambda_, by_rank=False):
+    """
+    Re-ranks each row of candidate ids with maximal marginal relevance.
+
+    Relevance is the cosine similarity to the query, or with `by_rank` a linear
+    decay over the candidate order, so a fused ranking keeps its lexical matches.
+
+    Returns:
+        list: Up to k ids per query, in pick order.
+    """
+    width = max((len(row) for row in indices), default=0)
+    candidates = np.full((len(indices), width), -1, dtype="int64")
+    for row, ids in zip(candidates, indices):
+        row[: len(ids)] = ids
+    with get_metrics().timer(stage="rerank"):
+        vectors = reconstruct_vectors(faiss_index, candidates)
+        relevance = None
+        if by_rank:
+            relevance = np.broadcast_to(
+                1 - np.arange(width, dtype="float32") / width, candidates.shape
+            )
+        picks = maximal_marginal_relevance(
+            query_embeddings, vectors, candidates >= 0, k, lambda_, relevance
+        )
+    return [row[pick[pick >= 0]] for row, pick in zip(candidates, picks)]
+
+
+def _lexical_search(bm25_index, queries, depth, allowed) -> list:
+    """Returns the BM25 ranking of each query, filtered like the dense search."""
+    if allowed is not None and len(allowed) < depth:
+        # Matches the dense fallback: too few filtered entries means a global search.
+        allowed = None
+    with get_metrics().timer(stage="lexical_search"):
+        return [bm25_index.search(query, depth, allowed) for query in queries]
+
+
+def retrieve_relevant_examples_batch(
+    queries: list,
+    k: int = 3,
+    query_embeddings=None,
+    strategy: str = None,
+    domain: str = None,
+    prompt_id_prefix: str = None,
+    mode: str = None,
+) -> list:
+    """
+    Retrieves relevant examples for many queries with a single encode and search call.
+
+    With filters, only the matching partition of the index is searched. If the
+    partition has fewer than k entries the whole index is searched instead, and
+    results the filtered search cannot fill are topped up from a global search.
+
+    In "hybrid" mode the dense and BM25 rankings are each taken `k *
+    HYBRID_CANDIDATES_PER_RESULT` deep and merged with weighted reciprocal rank
+    fusion, so an example matching an exact term (e.g. "HIPAA") surfaces even when
+    its embedding is not among the nearest.
+
+    Unless PROMPTFORGE_MMR_FETCH_FACTOR is 1, dense and hybrid results are
+    over-fetched by that factor and the k examples are picked with maximal
+    marginal relevance (weighted by PROMPTFORGE_MMR_LAMBDA), so near-duplicate
+    examples do not crowd out the others.
+
+    Args:
+        queries (list): The queries to search for relevant examples.
+        k (int): The number of relevant examples to retrieve per query.
+        query_embeddings (np.ndarray, optional): Embeddings already computed with
+            `embed_queries`; the queries are not re-encoded when given.
+        strategy (str, optional): Only retrieve examples of this strategy.
+        domain (str, optional): Only retrieve examples of this domain.
+        prompt_id_prefix (str, optional): Only retrieve examples whose prompt_id
+            starts with this prefix.
+        mode (str, optional): "dense" (embeddings only), "lexical" (BM25 only) or
+            "hybrid". Defaults to PROMPTFORGE_RETRIEVAL_MODE, or "dense". Without a
+            BM25 index, every mode falls back to dense.
+
+    Returns:
+        list: One list of formatted examples per query, in input order.
+
+    Raises:
+        ValueError: If `mode` is not one of `RETRIEVAL_MODES`.
+    """
+    mode = mode or os.getenv("PROMPTFORGE_RETRIEVAL_MODE", "dense")
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}'; expected one of {RETRIEVAL_MODES}.")
+
+    faiss_index = get_faiss_index()
+    if not faiss_index:
+        logger.error("ERROR: RAG/Vector Search not initialized.")
+        return [[] for _ in queries]
+
+    bm25_index = get_bm25_index() if mode != "dense" else None
+    if bm25_index is None:
+        mode = "dense"
+    fetch_factor, mmr_lambda = _mmr_settings()
+    rerank = _mmr_supported and fetch_factor > 1 and mode != "lexical"
+    depth, allowed = k, None
+    if mode == "hybrid":
+        depth = k * max(HYBRID_CANDIDATES_PER_RESULT, fetch_factor if rerank else 1)
+    elif rerank:
+        depth = k * fetch_factor
+    if mode != "dense" or depth > k:
+        allowed = _allowed_ids(strategy, domain, prompt_id_prefix)
+        if allowed is not None and len(allowed) >= k:
+            # Over-fetching past the partition size would drop the filter.
+            depth = min(depth, len(allowed))
+
+    try:
+        dense = None
+        if mode != "lexical":
+            # Encode all queries in one forward pass
+            if query_embeddings is None:
+                query_embeddings = embed_queries(queries)
+                if query_embeddings is None:
+                    return [[] for _ in queries]
+            query_embeddings = np.asarray(query_embeddings, dtype="float32")
+
+            # Search for the most similar examples
+            params = _search_params_for(
+                faiss_index, depth, strategy, domain, prompt_id_prefix
+            )
+            search_timer = get_metrics().timer(
+                stage="search", filtered=str(params is not None).lower()
+            )
+            with search_timer:
+                dense = _search(faiss_index, query_embeddings, depth, params)
+
+        if mode == "dense":
+            indices = dense
+        else:
+            lexical = _lexical_search(bm25_index, queries, depth, allowed)
+            if mode == "lexical":
+                indices = lexical
+            else:
+                dense_weight, lexical_weight, rrf_k = _fusion_settings()
+                indices = [
+                    reciprocal_rank_fusion(
+                        [dense_row, lexical_row],
+                        [dense_weight, lexical_weight],
+                        k=rrf_k,
+                        limit=depth if rerank else k,
+                    )
+                    for dense_row, lexical_row in zip(dense, lexical)
+                ]
+
+        if rerank and depth > k:
+            indices = _rerank_mmr(
+                faiss_index, query_embeddings, indices, k, mmr_lambda, mode == "hybrid"
+            )
+
+        # Retrieve the relevant examples and format them
+        results = []
+        for row in indices:
+            examples = []
+            for i in row:
+                # Ensure the id is valid; -1 pads results when fewer than k match
+                entry = _lookup_entry(int(i))
+                if entry is not None:
+                    examples.append(_format_example(entry))
+            results.append(examples)
+        return results
+    except Exception as e:
+        logger.error(f"Exception occurred in retrieve_relevant_examples_batch: {e}")
+        return [[] for _ in queries]
+
+
+def _build_refiner_prompt(user_prompt: str, retrieved_examples: str) -> str:
+    """Builds the contents sent to the refiner model."""
+    return f"""
+        **User's Basic Prompt:**
+        "{user_prompt}"
+
+        **Examples of High-Quality Prompts to Learn From:**
+        {retrieved_examples}
+        """
+
+
+def refine_prompt(user_prompt: str, system_prompt: str, retrieved_examples: str) -> str:
+    """
+    Refines a user prompt based on the specified strategy and retrieved examples.
+
+    Args:
+        user_prompt (str): The original user prompt to be refined.
+        strategy (str): The strategy to use for refining the prompt.
+        retrieved_examples (str): Examples of prompts that have been refined using the same strategy.
+
+    Returns:
+        str: The refined prompt.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: GEMINI CLIENT not initialized.")
+        return ""
+
+    try:
+        prompt_for_refiner = _build_refiner_prompt(user_prompt, retrieved_examples)
+
+        response_text = _generate_text(
+            client,
+            contents=prompt_for_refiner,
+            config={"system_instruction": system_prompt},
+            stage="refined_prompt",
+        )
+
+        return response_text.strip()
+
+    except Exception as e:
+        logger.error(f"Exception occurred in refine_prompt: {e}")
+        return ""
+
+
+async def refine_prompt_async(
+    user_prompt: str, system_prompt: str, retrieved_examples: str
+) -> str:
+    """
+    Async variant of `refine_prompt` using the non-blocking Gemini client.
+
+    Args:
+        user_prompt (str): The original user prompt to be refined.
+        system_prompt (str): The system instruction of the selected strategy.
+        retrieved_examples (str): Examples of prompts that have been refined using the same strategy.
+
+    Returns:
+        str: The refined prompt, or an empty string on error.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: GEMINI CLIENT not initialized.")
+        return ""
+
+    try:
+        response_text = await _generate_text_async(
+            client,
+            contents=_build_refiner_prompt(user_prompt, retrieved_examples),
+            config={"system_instruction": system_prompt},
+            stage="refined_prompt",
+        )
+        return response_text.strip()
+
+    except Exception as e:
+        logger.error(f"Exception occurred in refine_prompt_async: {e}")
+        return ""
+
+
+def stream_refine_prompt(user_prompt: str, system_prompt: str, retrieved_examples: str):
+    """
+    Streaming variant of `refine_prompt` that yields the refined prompt as it arrives.
+
+    Args:
+        user_prompt (str): The original user prompt to be refined.
+        system_prompt (str): The system instruction of the selected strategy.
+        retrieved_examples (str): Examples of prompts that have been refined using the same strategy.
+
+    Yields:
+        str: Chunks of the refined prompt. Nothing is yielded on error.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: GEMINI CLIENT not initialized.")
+        return
+
+    try:
+        yield from _generate_stream(
+            client,
+            contents=_build_refiner_prompt(user_prompt, retrieved_examples),
+            config={"system_instruction": system_prompt},
+            stage="refined_prompt",
+        )
+    except Exception as e:
+        logger.error(f"Exception occurred in stream_refine_prompt: {e}")
+
+
+async def stream_refine_prompt_async(
+    user_prompt: str, system_prompt: str, retrieved_examples: str
+):
+    """
+    Async variant of `stream_refine_prompt` using the non-blocking Gemini client.
+
+    Yields:
+        str: Chunks of the refined prompt. Nothing is yielded on error.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: GEMINI CLIENT not initialized.")
+        return
+
+    try:
+        async for chunk in _generate_stream_async(
+            client,
+            contents=_build_refiner_prompt(user_prompt, retrieved_examples),
+            config={"system_instruction": system_prompt},
+            stage="refined_prompt",
+        ):
+            yield chunk
+    except Exception as e:
+        logger.error(f"Exception occurred in stream_refine_prompt_async: {e}")
+
+
+class JudgeOutput(BaseModel):
+    score_A: int
+    score_B: int
+
+
+class JudgeBatchOutput(BaseModel):
+    """A batched judge verdict: one `JudgeOutput` per evaluation, in order."""
+
+    verdicts: list[JudgeOutput]
+
+
+@functools.lru_cache(maxsize=None)
+def _judge_batch_schema(count: int):
+    """`JudgeBatchOutput` requiring exactly `count` verdicts."""
+    return create_model(
+        f"JudgeBatchOutput{count}",
+        __base__=JudgeBatchOutput,
+        verdicts=(list[JudgeOutput], Field(min_length=count, max_length=count)),
+    )
+
+
+def _build_judge_prompt(
+    original_output: str, refined_output: str, user_prompt: str
+) -> str:
+    """Builds the contents sent to the judge model."""
+    return f"""
+    You are an impartial and meticulous AI Quality Analyst. Your task is to evaluate two AI-generated responses based on a user's request. You must compare them on the following criteria:
+    1.  **Relevance**: How well does the response address the user's core request?
     2.  **Clarity**: Is the response clear, well-structured, and easy to understand?
     3.  **Detail & Completeness**: Does the response provide an appropriate level of detail to be useful?
 
@@ -214,65 +1395,1119 @@ def evaluate_outputs(
     Now, provide your evaluation. Respond ONLY with a JSON object containing two keys: "score_A" and "score_B".
     """
 
+
+def _build_batch_judge_prompt(evaluations: list) -> str:
+    """
+    Builds the contents of a batched judge call.
+
+    Args:
+        evaluations (list): (user_prompt, response_a, response_b) tuples.
+    """
+    sections = "".join(
+        f"""
+    ---
+    **Evaluation {number}**
+
+    **User's Request:**
+    "{user_prompt}"
+
+    **Response A:**
+    "{response_a}"
+
+    **Response B:**
+    "{response_b}"
+    """
+        for number, (user_prompt, response_a, response_b) in enumerate(evaluations, 1)
+    )
+    return f"""
+    You are an impartial and meticulous AI Quality Analyst. Below are {len(evaluations)} evaluations. Each has a user's request and two AI-generated responses, A and B. Compare the responses of every evaluation on the following criteria:
+    1.  **Relevance**: How well does the response address the user's core request?
+    2.  **Clarity**: Is the response clear, well-structured, and easy to understand?
+    3.  **Detail & Completeness**: Does the response provide an appropriate level of detail to be useful?
+
+    Judge each evaluation on its own merits. Score each response on a scale of 1 to 10, where 1 is poor and 10 is excellent. Your response MUST be a valid JSON object and nothing else.
+    {sections}
+    ---
+
+    Now, provide your evaluations. Respond ONLY with a JSON object with the key "verdicts": a list of exactly {len(evaluations)} objects, one per evaluation in order, each containing two keys: "score_A" and "score_B".
+    """
+
+
+def _judge_contents(original_output: str, refined_output: str, user_prompt: str) -> str:
+    """Builds the judge prompt with both outputs fitted to the judge token budget."""
+    original_output, refined_output = _fit_judge_outputs(
+        original_output, refined_output, user_prompt
+    )
+    return _build_judge_prompt(original_output, refined_output, user_prompt)
+
+
+def _fit_judge_outputs(original_output: str, refined_output: str, user_prompt: str):
+    return get_context_budget().fit_outputs(
+        original_output, refined_output, _build_judge_prompt("", "", user_prompt)
+    )
+
+
+JUDGE_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": JudgeOutput,
+}
+
+
+def _parse_judge_response(response_text: str) -> dict:
+    """
+    Parses the judge's JSON verdict into a score dictionary.
+
+    Raises:
+        json.JSONDecodeError: If the response is not valid JSON.
+    """
+    # The response text should be a JSON string.
+    response_json = json.loads(response_text)
+
+    # Basic validation to ensure the keys exist and are integers
+    score_a = int(response_json.get("score_A", 0))
+    score_b = int(response_json.get("score_B", 0))
+
+    logger.info(f"Evaluation successful: Score A={score_a}, Score B={score_b}")
+    return {"score_A": score_a, "score_B": score_b}
+
+
+def _parse_batch_judge_response(response_text: str, count: int):
+    """
+    Returns the (score_A, score_B) of each of `count` batched verdicts, or None if
+    the response does not validate against the schema or a score is out of range.
+    """
+    try:
+        verdicts = _judge_batch_schema(count).model_validate_json(response_text).verdicts
+    except (TypeError, ValueError, ValidationError):
+        return None
+    scores = [(v.score_A, v.score_B) for v in verdicts]
+    if not all(1 <= score <= 10 for pair in scores for score in pair):
+        return None
+    return scores
+
+
+class CandidateScore(BaseModel):
+    score: int
+
+
+class TournamentJudgeOutput(BaseModel):
+    """A tournament verdict: the baseline's score and one score per candidate, in order."""
+
+    baseline_score: int
+    candidate_scores: list[CandidateScore]
+
+
+@functools.lru_cache(maxsize=None)
+def _tournament_schema(count: int):
+    """`TournamentJudgeOutput` requiring exactly `count` candidate scores."""
+    return create_model(
+        f"TournamentJudgeOutput{count}",
+        __base__=TournamentJudgeOutput,
+        candidate_scores=(list[CandidateScore], Field(min_length=count, max_length=count)),
+    )
+
+
+def _build_tournament_judge_prompt(
+    baseline_output: str, candidate_outputs: list, user_prompt: str
+) -> str:
+    """Builds the contents of a tournament judge call."""
+    sections = "".join(
+        f"""
+    ---
+    **Candidate {number}:**
+    "{output}"
+    """
+        for number, output in enumerate(candidate_outputs, 1)
+    )
+    return f"""
+    You are an impartial and meticulous AI Quality Analyst. Your task is to evaluate a baseline AI-generated response and {len(candidate_outputs)} candidate responses to the same user's request. You must compare them on the following criteria:
+    1.  **Relevance**: How well does the response address the user's core request?
+    2.  **Clarity**: Is the response clear, well-structured, and easy to understand?
+    3.  **Detail & Completeness**: Does the response provide an appropriate level of detail to be useful?
+
+    Score every response on its own merits on a scale of 1 to 10, where 1 is poor and 10 is excellent; use the same standard for all of them. Your response MUST be a valid JSON object and nothing else.
+
+    ---
+    **User's Request:**
+    "{user_prompt}"
+
+    ---
+    **Baseline response (from original prompt):**
+    "{baseline_output}"
+    {sections}
+    ---
+
+    Now, provide your evaluation. Respond ONLY with a JSON object with two keys: "baseline_score", the score of the baseline response, and "candidate_scores", a list of exactly {len(candidate_outputs)} objects, one per candidate in order, each containing the key "score".
+    """
+
+
+def _parse_tournament_response(response_text: str, count: int):
+    """
+    Returns (baseline_score, candidate_scores) of a tournament verdict, or None if
+    the response does not validate against the schema or a score is out of range.
+    """
     try:
-        logging.info("Sending request to Gemini API for evaluation.")
-
-        response = GEMINI_CLIENT.models.generate_content(
-            model="gemini-2.0-flash",
-            config={
-                "response_mime_type": "application/json",
-                "response_schema": JudgeOutput,
-            },
+        verdict = _tournament_schema(count).model_validate_json(response_text)
+    except (TypeError, ValueError, ValidationError):
+        return None
+    scores = [verdict.baseline_score] + [c.score for c in verdict.candidate_scores]
+    if not all(1 <= score <= 10 for score in scores):
+        return None
+    return scores[0], scores[1:]
+
+
+async def _judge_tournament_async(
+    baseline_output: str, candidate_outputs: list, user_prompt: str
+) -> tuple:
+    """
+    Scores the baseline and every candidate output in one judge call.
+
+    Falls back to one single-pair call per candidate, each against the baseline,
+    if the response fails validation; the baseline's score is then the mean of its
+    scores in those calls.
+
+    Returns:
+        tuple: (baseline_score, candidate_scores, judge_calls). Scores are 0 on error.
+    """
+    count = len(candidate_outputs)
+    client = get_gemini_client()
+    if not client:
+        logger.error("Cannot evaluate outputs, Gemini client is not available.")
+        return 0, [0] * count, 0
+
+    fitted = get_context_budget().fit_many_outputs(
+        [baseline_output, *candidate_outputs],
+        _build_tournament_judge_prompt("", [""] * count, user_prompt),
+    )
+    response_text = None
+    try:
+        logger.info(f"Sending tournament evaluation of {count} candidates to Gemini API.")
+        response_text = await _generate_text_async(
+            client,
+            contents=_build_tournament_judge_prompt(fitted[0], fitted[1:], user_prompt),
+            config={**JUDGE_CONFIG, "response_schema": _tournament_schema(count)},
+            validate=lambda text: _parse_tournament_response(text, count) is not None,
+            stage="scores",
+        )
+    except Exception as e:
+        logger.error(f"An exception occurred during tournament evaluation: {e}")
+    verdict = _parse_tournament_response(response_text, count)
+    if verdict is not None:
+        logger.info(f"Tournament evaluation successful: {verdict}")
+        return (*verdict, 1)
+
+    get_metrics().inc("promptforge_errors_total", stage="tournament_parse")
+    logger.warning(
+        f"Tournament evaluation response failed validation; judging {count} candidates "
+        f"one by one.\nResponse text: {response_text}"
+    )
+    verdicts = await asyncio.gather(
+        *(
+            evaluate_outputs_async(baseline_output, output, user_prompt)
+            for output in candidate_outputs
+        )
+    )
+    baseline_scores = [v["score_A"] for v in verdicts if v["score_A"]]
+    baseline_score = sum(baseline_scores) / len(baseline_scores) if baseline_scores else 0
+    return baseline_score, [v["score_B"] for v in verdicts], 1 + count
+
+
+def _judge_settings() -> tuple:
+    """
+    Returns the judge (mode, pairs per batched call, seconds a batch waits for more
+    pairs) from PROMPTFORGE_JUDGE_MODE, PROMPTFORGE_JUDGE_BATCH_PAIRS and
+    PROMPTFORGE_JUDGE_BATCH_WAIT_MS.
+
+    Raises:
+        ValueError: If the mode is not one of `JUDGE_MODES`.
+    """
+    mode = os.getenv("PROMPTFORGE_JUDGE_MODE", "single")
+    if mode not in JUDGE_MODES:
+        raise ValueError(f"Unknown judge mode '{mode}'; expected one of {JUDGE_MODES}.")
+    return (
+        mode,
+        max(int(os.getenv("PROMPTFORGE_JUDGE_BATCH_PAIRS", 4)), 1),
+        float(os.getenv("PROMPTFORGE_JUDGE_BATCH_WAIT_MS", 20)) / 1000,
+    )
+
+
+def _evaluate_pair_batch(client, pairs: list) -> list:
+    """
+    Scores pairs in one judge call, each in both orders, and averages the orders.
+
+    All outputs are fitted together to the judge token budget of one call. Pairs
+    that would not fit even with every output cut to its minimum length are split
+    over several calls. Falls back to one single-pair call per pair if the batched
+    response fails validation.
+    """
+    budget = get_context_budget()
+    # Every output is sent twice, once in each order.
+    outputs = [output for original, refined, _ in pairs for output in (original, refined)]
+    fixed_text = _build_batch_judge_prompt([(p, "", "") for _, _, p in pairs] * 2)
+    if len(pairs) > 1 and budget.judge_tokens:
+        fixed = count_tokens(fixed_text)
+        floor = fixed + 2 * len(outputs) * MIN_OUTPUT_TOKENS
+        full = fixed + 2 * sum(count_tokens(output) for output in outputs)
+        if min(floor, full) > budget.judge_tokens:
+            middle = len(pairs) // 2
+            return _evaluate_pair_batch(client, pairs[:middle]) + _evaluate_pair_batch(
+                client, pairs[middle:]
+            )
+    shared = budget.fit_many_outputs(outputs * 2, fixed_text)
+    # Equal outputs can get budgets one token apart; both copies use the shorter cut.
+    shared = [min(a, b, key=len) for a, b in zip(shared, shared[len(outputs) :])]
+    fitted = [
+        (user_prompt, shared[2 * i], shared[2 * i + 1])
+        for i, (_, _, user_prompt) in enumerate(pairs)
+    ]
+    # Every pair is judged as given and then swapped, so each response is seen in
+    # both positions. The swapped copies follow all originals rather than their pair.
+    evaluations = [(p, original, refined) for p, original, refined in fitted] + [
+        (p, refined, original) for p, original, refined in fitted
+    ]
+    count = len(evaluations)
+    response_text = None
+    try:
+        logger.info(f"Sending batched evaluation of {len(pairs)} pairs to Gemini API.")
+        response_text = _generate_text(
+            client,
+            contents=_build_batch_judge_prompt(evaluations),
+            config={**JUDGE_CONFIG, "response_schema": _judge_batch_schema(count)},
+            validate=lambda text: _parse_batch_judge_response(text, count) is not None,
+            stage="scores",
+        )
+    except Exception as e:
+        logger.error(f"An exception occurred during batched evaluation: {e}")
+    verdicts = _parse_batch_judge_response(response_text, count)
+    if verdicts is None:
+        get_metrics().inc("promptforge_errors_total", stage="scores_batch_parse")
+        logger.warning(
+            f"Batched evaluation response failed validation; judging {len(pairs)} "
+            f"pairs one by one.\nResponse text: {response_text}"
+        )
+        return [_evaluate_single(*pair) for pair in pairs]
+
+    results = []
+    metrics = get_metrics()
+    for (a, b), (swapped_a, swapped_b) in zip(verdicts, verdicts[len(pairs) :]):
+        # Both orders must agree on which response is better (or on a tie).
+        consistent = bool(np.sign(b - a) == np.sign(swapped_a - swapped_b))
+        metrics.inc("promptforge_judge_pairs_total", consistent=str(consistent).lower())
+        results.append(
+            {
+                "score_A": (a + swapped_b) / 2,
+                "score_B": (b + swapped_a) / 2,
+                "consistent": consistent,
+            }
+        )
+    logger.info(f"Batched evaluation successful: {results}")
+    return results
+
+
+def evaluate_pairs(pairs: list) -> list:
+    """
+    Evaluates many (original, refined) output pairs with batched judge calls.
+
+    Up to PROMPTFORGE_JUDGE_BATCH_PAIRS pairs share one call. Each pair is also
+    judged with its responses swapped, and its scores are the mean of both orders,
+    which cancels the judge's preference for a position. "consistent" tells
+    whether both orders picked the same winner.
+
+    Args:
+        pairs (list): (original_output, refined_output, user_prompt) tuples.
+
+    Returns:
+        list: One dict per pair with 'score_A', 'score_B' and 'consistent', in order.
+            Pairs judged by the single-pair fallback carry no 'consistent'; on error
+            the scores are 0.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("Cannot evaluate outputs, Gemini client is not available.")
+        return [{"score_A": 0, "score_B": 0} for _ in pairs]
+    _, pairs_per_call, _ = _judge_settings()
+    results = []
+    for start in range(0, len(pairs), pairs_per_call):
+        results.extend(_evaluate_pair_batch(client, pairs[start : start + pairs_per_call]))
+    return results
+
+
+def _judge_batcher() -> MicroBatcher:
+    loop = asyncio.get_running_loop()
+    batcher = _judge_batchers.get(loop)
+    if batcher is None:
+        _, pairs_per_call, wait = _judge_settings()
+        batcher = _judge_batchers[loop] = MicroBatcher(
+            evaluate_pairs, max_batch_size=pairs_per_call, max_wait=wait, name="judge"
+        )
+    return batcher
+
+
+def evaluate_outputs(
+    original_output: str, refined_output: str, user_prompt: str
+) -> dict:
+    """
+    Evaluates and scores the original and refined outputs using a "Judge LLM".
+
+    With PROMPTFORGE_JUDGE_MODE=batched, the pair is judged in both orders in one
+    call; see `evaluate_pairs`.
+
+    Args:
+        original_output (str): The output generated from the original prompt.
+        refined_output (str): The output generated from the refined prompt.
+        user_prompt (str): The original user prompt that started the process.
+
+    Returns:
+        dict: A dictionary containing 'score_A' and 'score_B', or default scores on error.
+    """
+    if _judge_settings()[0] == "batched":
+        return evaluate_pairs([(original_output, refined_output, user_prompt)])[0]
+    return _evaluate_single(original_output, refined_output, user_prompt)
+
+
+def _evaluate_single(original_output: str, refined_output: str, user_prompt: str) -> dict:
+    """Scores one pair in one judge call, original first."""
+    client = get_gemini_client()
+    if not client:
+        logger.error("Cannot evaluate outputs, Gemini client is not available.")
+        return {"score_A": 0, "score_B": 0}
+
+    judge_prompt_template = _judge_contents(
+        original_output, refined_output, user_prompt
+    )
+
+    try:
+        logger.info("Sending request to Gemini API for evaluation.")
+
+        response_text = _generate_text(
+            client,
             contents=judge_prompt_template,
+            config=JUDGE_CONFIG,
+            validate=_is_valid_json,
+            stage="scores",
         )
 
-        # The response text should be a JSON string.
-        response_json = json.loads(response.text)
+        return _parse_judge_response(response_text)
+
+    except json.JSONDecodeError as e:
+        get_metrics().inc("promptforge_errors_total", stage="scores_parse")
+        logger.error(
+            f"Failed to parse JSON from evaluation response: {e}\nResponse text: {response_text}"
+        )
+        return {"score_A": 0, "score_B": 0}
+    except Exception as e:
+        logger.error(f"An exception occurred during evaluation: {e}")
+        return {"score_A": 0, "score_B": 0}
 
-        # Basic validation to ensure the keys exist and are integers
-        score_a = int(response_json.get("score_A", 0))
-        score_b = int(response_json.get("score_B", 0))
 
-        logging.info(f"Evaluation successful: Score A={score_a}, Score B={score_b}")
-        return {"score_A": score_a, "score_B": score_b}
+async def evaluate_outputs_async(
+    original_output: str, refined_output: str, user_prompt: str
+) -> dict:
+    """
+    Async variant of `evaluate_outputs` using the non-blocking Gemini client.
+
+    With PROMPTFORGE_JUDGE_MODE=batched, pairs submitted concurrently (e.g. by the
+    forges of a batch run) are packed into shared judge calls.
+
+    Args:
+        original_output (str): The output generated from the original prompt.
+        refined_output (str): The output generated from the refined prompt.
+        user_prompt (str): The original user prompt that started the process.
+
+    Returns:
+        dict: A dictionary containing 'score_A' and 'score_B', or default scores on error.
+    """
+    if _judge_settings()[0] == "batched":
+        try:
+            return await _judge_batcher().submit(
+                (original_output, refined_output, user_prompt)
+            )
+        except Exception as e:
+            logger.error(f"An exception occurred during batched evaluation: {e}")
+            return {"score_A": 0, "score_B": 0}
+
+    client = get_gemini_client()
+    if not client:
+        logger.error("Cannot evaluate outputs, Gemini client is not available.")
+        return {"score_A": 0, "score_B": 0}
+
+    try:
+        logger.info("Sending async request to Gemini API for evaluation.")
+        response_text = await _generate_text_async(
+            client,
+            contents=_judge_contents(original_output, refined_output, user_prompt),
+            config=JUDGE_CONFIG,
+            validate=_is_valid_json,
+            stage="scores",
+        )
+        return _parse_judge_response(response_text)
 
     except json.JSONDecodeError as e:
-        logging.error(
-            f"Failed to parse JSON from evaluation response: {e}\nResponse text: {response.text}"
+        get_metrics().inc("promptforge_errors_total", stage="scores_parse")
+        logger.error(
+            f"Failed to parse JSON from evaluation response: {e}\nResponse text: {response_text}"
         )
         return {"score_A": 0, "score_B": 0}
     except Exception as e:
-        logging.error(f"An exception occurred during evaluation: {e}")
+        logger.error(f"An exception occurred during evaluation: {e}")
         return {"score_A": 0, "score_B": 0}
 
 
-@st.cache_data
-def get_llm_response(prompt: str) -> str:
+def get_llm_response(prompt: str, stage: str = "generate") -> str:
     """
     Generates a response from an LLM based on the given prompt.
 
     Args:
         prompt (str): The prompt to send to the LLM.
+        stage (str): The pipeline stage the call is counted under in the metrics.
 
     Returns:
         str: The LLM's generated response.
     """
-    if GEMINI_API_KEY is None:
-        logger.error("ERROR: Gemini API key not available for LLM response generation.")
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: Gemini client not available for LLM response generation.")
         return "Error: LLM API not configured."
 
     try:
-        #     response = GEMINI_CLIENT.models.generate_content(
-        #     model="gemini-2.0-flash",
-        #     config=types.GenerateContentConfig(system_instruction=system_prompt),
-        #     contents=prompt_for_refiner,
-        # )
-        response = GEMINI_CLIENT.models.generate_content(
-            model="gemini-2.0-flash", contents=prompt
-        )
-        return response.text.strip()
+        response_text = _generate_text(client, contents=prompt, stage=stage)
+        return response_text.strip()
     except Exception as e:
         logger.error(
             f"Exception occurred in get_llm_response with prompt '{prompt[:50]}...': {e}"
         )
         return f"Error generating response: {e}"
+
+
+async def get_llm_response_async(prompt: str, stage: str = "generate") -> str:
+    """
+    Async variant of `get_llm_response` using the non-blocking Gemini client.
+
+    Args:
+        prompt (str): The prompt to send to the LLM.
+        stage (str): The pipeline stage the call is counted under in the metrics.
+
+    Returns:
+        str: The LLM's generated response.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: Gemini client not available for LLM response generation.")
+        return "Error: LLM API not configured."
+
+    try:
+        response_text = await _generate_text_async(client, contents=prompt, stage=stage)
+        return response_text.strip()
+    except Exception as e:
+        logger.error(
+            f"Exception occurred in get_llm_response_async with prompt '{prompt[:50]}...': {e}"
+        )
+        return f"Error generating response: {e}"
+
+
+def stream_llm_response(prompt: str, stage: str = "generate"):
+    """
+    Streaming variant of `get_llm_response` that yields the response as it arrives.
+
+    Args:
+        prompt (str): The prompt to send to the LLM.
+        stage (str): The name response timings are logged under.
+
+    Yields:
+        str: Response text chunks, or a single error message.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: Gemini client not available for LLM response generation.")
+        yield "Error: LLM API not configured."
+        return
+
+    try:
+        yield from _generate_stream(client, contents=prompt, stage=stage)
+    except Exception as e:
+        logger.error(
+            f"Exception occurred in stream_llm_response with prompt '{prompt[:50]}...': {e}"
+        )
+        yield f"Error generating response: {e}"
+
+
+async def stream_llm_response_async(prompt: str, stage: str = "generate"):
+    """
+    Async variant of `stream_llm_response` using the non-blocking Gemini client.
+
+    Yields:
+        str: Response text chunks, or a single error message.
+    """
+    client = get_gemini_client()
+    if not client:
+        logger.error("ERROR: Gemini client not available for LLM response generation.")
+        yield "Error: LLM API not configured."
+        return
+
+    try:
+        async for chunk in _generate_stream_async(client, contents=prompt, stage=stage):
+            yield chunk
+    except Exception as e:
+        logger.error(
+            f"Exception occurred in stream_llm_response_async with prompt '{prompt[:50]}...': {e}"
+        )
+        yield f"Error generating response: {e}"
+
+
+# --- Forge pipeline ---
+
+
+def format_examples(retrieved_examples_list: list) -> str:
+    """Joins retrieved examples into the block passed to the refiner."""
+    return (
+        "\n\n".join(retrieved_examples_list)
+        if retrieved_examples_list
+        else "No relevant examples found in knowledge base."
+    )
+
+
+def assemble_refiner_examples(
+    user_prompt: str, system_prompt: str, retrieved_examples_list: list
+) -> str:
+    """
+    Joins the retrieved examples that fit the refiner token budget.
+
+    Near-duplicate examples are removed, then the lowest-ranked ones until the
+    system instruction, user prompt and examples fit; see `ContextBudget`.
+
+    Args:
+        user_prompt (str): The original user prompt.
+        system_prompt (str): The system instruction of the selected strategy.
+        retrieved_examples_list (list): Formatted examples, best match first.
+
+    Returns:
+        str: The block passed to the refiner.
+    """
+    examples = get_context_budget().assemble_examples(
+        retrieved_examples_list or [],
+        system_prompt + _build_refiner_prompt(user_prompt, ""),
+    )
+    return format_examples(examples)
+
+
+async def _run_graph(stages: dict, timings: dict = None) -> dict:
+    """
+    Runs a dependency graph of async stages, starting each as soon as its inputs are ready.
+
+    Args:
+        stages (dict): Maps a stage name to a `(dependencies, coroutine_function)` tuple.
+            The coroutine function is called with the results of its dependencies as
+            keyword arguments.
+        timings (dict, optional): Filled with the duration of each stage in seconds.
+
+    Returns:
+        dict: The result of every stage, keyed by stage name.
+    """
+    tasks = {}
+
+    async def run_stage(name):
+        deps, fn = stages[name]
+        inputs = {dep: await tasks[dep] for dep in deps}
+        started = time.perf_counter()
+        with get_metrics().timer(stage=name):
+            result = await fn(**inputs)
+        elapsed = time.perf_counter() - started
+        if timings is not None:
+            timings[name] = round(elapsed, 4)
+        logger.info(f"Stage '{name}' finished in {elapsed:.3f}s")
+        return result
+
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run_stage(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    return {name: task.result() for name, task in tasks.items()}
+
+
+async def forge_async(
+    user_prompt: str,
+    strategy: str,
+    k: int = 3,
+    retrieved_examples: list = None,
+    query_embedding=None,
+    domain: str = None,
+    on_chunk=None,
+    profile: bool = None,
+) -> dict:
+    """
+    Runs the full forge pipeline with independent stages overlapping.
+
+    The original prompt is generated concurrently with retrieval and refinement,
+    so the critical path is refine -> generate refined -> judge (three LLM calls)
+    instead of four serial ones.
+
+    With `on_chunk`, the refined prompt and both outputs are streamed, and the
+    callback receives the text so far of each as chunks arrive. It runs on the
+    event loop thread. The judge starts as soon as both output streams close.
+
+    With `AUTO_STRATEGY` as the strategy, the prompt is embedded first and the
+    most likely strategy of `rank_strategies` is used; that embedding is then
+    reused for retrieval and the semantic cache.
+
+    Args:
+        user_prompt (str): The original user prompt.
+        strategy (str): A key of `SYSTEM_PROMPTS`, or `AUTO_STRATEGY`.
+        k (int): The number of relevant examples to retrieve.
+        retrieved_examples (list, optional): Precomputed examples, e.g. from
+            `retrieve_relevant_examples_batch`. Retrieval is skipped when given.
+        query_embedding (np.ndarray, optional): The prompt's embedding from
+            `embed_queries`, reused for strategy selection, retrieval and the
+            semantic cache.
+        domain (str, optional): Only retrieve examples of this domain. Examples are
+            always filtered to `strategy`.
+        on_chunk (callable, optional): Called as `on_chunk(stage, text)` with stage
+            "refined_prompt", "original_output" or "refined_output".
+        profile (bool, optional): Profile this forge (True) or never (False); by
+            default PROMPTFORGE_PROFILE decides, see `profiling.profile`.
+
+    Returns:
+        dict: The forge record: user_prompt, strategy, retrieved_examples, refined_prompt,
+            original_output, refined_output, original_score, refined_score and the
+            correlation_id of the forge's log events. Results
+            served by the semantic cache also carry semantic_cache_hit, similarity and
+            cached_prompt. With `AUTO_STRATEGY`, strategy_ranking lists every
+            strategy with its confidence. Profiled forges list their profile files
+            in profile.
+
+    Raises:
+        ValueError: If the strategy is not a key of `SYSTEM_PROMPTS`, or it is
+            `AUTO_STRATEGY` and no strategy could be selected.
+    """
+    # Every log event and metric of this forge carries the same correlation ID.
+    correlation_id = new_correlation_id()
+    with profiling.profile(f"forge-{correlation_id}", enabled=profile) as profiler:
+        record = await _forge_async(
+            user_prompt,
+            strategy,
+            k,
+            retrieved_examples,
+            query_embedding,
+            domain,
+            on_chunk,
+            correlation_id,
+        )
+    if profiler is not None and profiler.paths:
+        record["profile"] = profiler.paths
+    return record
+
+
+async def _forge_async(
+    user_prompt: str,
+    strategy: str,
+    k: int,
+    retrieved_examples: list,
+    query_embedding,
+    domain: str,
+    on_chunk,
+    correlation_id: str,
+) -> dict:
+    strategy_ranking = None
+    if strategy == AUTO_STRATEGY:
+        if query_embedding is None:
+            embeddings = await asyncio.to_thread(embed_queries, [user_prompt])
+            query_embedding = embeddings[0] if embeddings is not None else None
+        classifier = get_strategy_classifier()
+        if classifier is None:
+            raise ValueError(
+                "Strategy auto-selection needs a strategy classifier; run "
+                "`python knowledge_base.py` or `python ingest.py` to build one."
+            )
+        if not auto_strategy_available():
+            raise ValueError(
+                "Strategy auto-selection is unavailable: the strategy classifier was "
+                f"trained on the strategies {sorted(classifier.labels)[:5]} of the "
+                "ingested corpus, none of which is a refinement strategy. Pick a "
+                "strategy explicitly."
+            )
+        if query_embedding is not None:
+            strategy_ranking = rank_strategies(query_embedding)
+        if not strategy_ranking:
+            raise ValueError(
+                "Strategy auto-selection needs the embedding model, which could not "
+                "be loaded."
+            )
+        strategy = strategy_ranking[0]["strategy"]
+        logger.info(
+            f"Auto-selected strategy {strategy} "
+            f"(confidence {strategy_ranking[0]['confidence']:.2f})"
+        )
+    system_prompt = SYSTEM_PROMPTS.get(strategy)
+    if not system_prompt:
+        raise ValueError(f"Invalid strategy: {strategy}")
+
+    metrics = get_metrics()
+    started = time.perf_counter()
+
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        if query_embedding is None:
+            embeddings = await asyncio.to_thread(embed_queries, [user_prompt])
+            query_embedding = embeddings[0] if embeddings is not None else None
+        if query_embedding is not None:
+            cached, similarity = semantic_cache.lookup(query_embedding, strategy)
+            if cached is not None:
+                logger.info(
+                    f"Semantic cache hit (similarity={similarity:.3f}) for prompt: {user_prompt[:50]}"
+                )
+                cached["cached_prompt"] = cached["user_prompt"]
+                cached["user_prompt"] = user_prompt
+                cached["semantic_cache_hit"] = True
+                cached["similarity"] = similarity
+                cached["correlation_id"] = correlation_id
+                if strategy_ranking is not None:
+                    cached["strategy_ranking"] = strategy_ranking
+                metrics.inc("promptforge_forges_total", strategy=strategy, cached="true")
+                metrics.event(
+                    "forge",
+                    strategy=strategy,
+                    semantic_cache_hit=True,
+                    similarity=round(similarity, 4),
+                    seconds=round(time.perf_counter() - started, 4),
+                )
+                return cached
+
+    async def retrieve():
+        if retrieved_examples is not None:
+            return retrieved_examples
+        # Embedding and FAISS search are CPU bound; keep them off the event loop.
+        if query_embedding is not None:
+            examples = await asyncio.to_thread(
+                retrieve_relevant_examples_batch,
+                [user_prompt],
+                k,
+                query_embeddings=np.asarray(query_embedding).reshape(1, -1),
+                strategy=strategy,
+                domain=domain,
+            )
+            return examples[0]
+        return await asyncio.to_thread(
+            retrieve_relevant_examples, user_prompt, k, strategy=strategy, domain=domain
+        )
+
+    async def collect(stage, chunks):
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            on_chunk(stage, "".join(parts))
+        return "".join(parts).strip()
+
+    async def refine(retrieved_examples):
+        examples = assemble_refiner_examples(
+            user_prompt, system_prompt, retrieved_examples
+        )
+        if on_chunk is None:
+            refined = await refine_prompt_async(user_prompt, system_prompt, examples)
+        else:
+            refined = await collect(
+                "refined_prompt",
+                stream_refine_prompt_async(user_prompt, system_prompt, examples),
+            )
+        if not refined:
+            logger.warning("Refined prompt is empty, falling back to the original.")
+            return user_prompt
+        return refined
+
+    async def original_output():
+        if on_chunk is None:
+            return await get_llm_response_async(user_prompt, "original_output")
+        return await collect(
+            "original_output", stream_llm_response_async(user_prompt, "original_output")
+        )
+
+    async def refined_output(refined_prompt):
+        if on_chunk is None:
+            return await get_llm_response_async(refined_prompt, "refined_output")
+        return await collect(
+            "refined_output", stream_llm_response_async(refined_prompt, "refined_output")
+        )
+
+    async def scores(original_output, refined_output):
+        return await evaluate_outputs_async(
+            original_output, refined_output, user_prompt
+        )
+
+    timings = {}
+    results = await _run_graph(
+        {
+            "retrieved_examples": ((), retrieve),
+            "original_output": ((), original_output),
+            "refined_prompt": (("retrieved_examples",), refine),
+            "refined_output": (("refined_prompt",), refined_output),
+            "scores": (("original_output", "refined_output"), scores),
+        },
+        timings,
+    )
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Forge pipeline finished in {elapsed:.3f}s")
+
+    record = {
+        "user_prompt": user_prompt,
+        "strategy": strategy,
+        "retrieved_examples": results["retrieved_examples"],
+        "refined_prompt": results["refined_prompt"],
+        "original_output": results["original_output"],
+        "refined_output": results["refined_output"],
+        "original_score": results["scores"].get("score_A", 0),
+        "refined_score": results["scores"].get("score_B", 0),
+        "correlation_id": correlation_id,
+    }
+    metrics.inc("promptforge_forges_total", strategy=strategy, cached="false")
+    metrics.observe("promptforge_forge_seconds", elapsed, strategy=strategy)
+    metrics.event(
+        "forge",
+        strategy=strategy,
+        semantic_cache_hit=False,
+        seconds=round(elapsed, 4),
+        stages=timings,
+        retrieved_examples=len(record["retrieved_examples"]),
+        original_score=record["original_score"],
+        refined_score=record["refined_score"],
+    )
+
+    # Only fully judged results are worth serving to similar prompts.
+    if (
+        semantic_cache is not None
+        and query_embedding is not None
+        and record["original_score"]
+        and record["refined_score"]
+    ):
+        semantic_cache.add(query_embedding, strategy, record)
+
+    if strategy_ranking is not None:
+        record["strategy_ranking"] = strategy_ranking
+
+    return record
+
+
+def forge(
+    user_prompt: str,
+    strategy: str,
+    k: int = 3,
+    domain: str = None,
+    on_chunk=None,
+    profile: bool = None,
+) -> dict:
+    """
+    Blocking wrapper around `forge_async` for callers without an event loop.
+
+    Args:
+        user_prompt (str): The original user prompt.
+        strategy (str): A key of `SYSTEM_PROMPTS`, or `AUTO_STRATEGY`.
+        k (int): The number of relevant examples to retrieve.
+        domain (str, optional): Only retrieve examples of this domain.
+        on_chunk (callable, optional): Streams the refined prompt and both outputs,
+            see `forge_async`.
+        profile (bool, optional): Profile this forge, see `forge_async`.
+
+    Returns:
+        dict: The forge record, see `forge_async`.
+    """
+    return asyncio.run(
+        forge_async(
+            user_prompt, strategy, k, domain=domain, on_chunk=on_chunk, profile=profile
+        )
+    )
+
+
+# LLM calls of one forge: refine, original output, refined output and judge.
+FORGE_LLM_CALLS = 4
+
+
+async def tournament_async(
+    user_prompt: str,
+    strategies: list = None,
+    k: int = 3,
+    query_embedding=None,
+    domain: str = None,
+    profile: bool = None,
+) -> dict:
+    """
+    Forges a prompt under several strategies at once and ranks the results.
+
+    Running one forge per strategy would embed the prompt, generate its baseline
+    output and call the judge once per strategy. A tournament embeds once and
+    reuses the embedding for every strategy's retrieval, generates the baseline
+    once, refines and generates under all strategies concurrently, and scores the
+    baseline and every candidate in a single judge call. N strategies take 2N + 2
+    LLM calls instead of 4N, fewer when responses come from the LLM cache.
+
+    Args:
+        user_prompt (str): The original user prompt.
+        strategies (list, optional): Keys of `SYSTEM_PROMPTS`; default all of them.
+        k (int): The number of relevant examples to retrieve per strategy.
+        query_embedding (np.ndarray, optional): The prompt's embedding from
+            `embed_queries`; computed when not given.
+        domain (str, optional): Only retrieve examples of this domain.
+        profile (bool, optional): Profile this tournament, see `forge_async`.
+
+    Returns:
+        dict: user_prompt, original_output, baseline_score, candidates (dicts with
+            strategy, retrieved_examples, refined_prompt, refined_output, score and
+            uplift over the baseline, best first), llm_calls (planned by the
+            tournament, made: those that reached the model rather than the LLM
+            cache or an identical call in flight, needed by separate forges and
+            saved by planning), timings and the
+            correlation_id of the tournament's log events. Profiled tournaments
+            list their profile files in profile.
+
+    Raises:
+        ValueError: If a strategy is not a key of `SYSTEM_PROMPTS`.
+    """
+    strategies = list(dict.fromkeys(strategies or SYSTEM_PROMPTS))
+    invalid = [strategy for strategy in strategies if strategy not in SYSTEM_PROMPTS]
+    if invalid:
+        raise ValueError(f"Invalid strategies: {', '.join(invalid)}")
+
+    correlation_id = new_correlation_id()
+    metrics = get_metrics()
+    started = time.perf_counter()
+
+    def retrieve_all():
+        if query_embedding is not None:
+            embeddings = np.asarray(query_embedding).reshape(1, -1)
+        else:
+            embeddings = embed_queries([user_prompt])
+        if embeddings is None:
+            return {
+                strategy: retrieve_relevant_examples(
+                    user_prompt, k, strategy=strategy, domain=domain
+                )
+                for strategy in strategies
+            }
+        return {
+            strategy: retrieve_relevant_examples_batch(
+                [user_prompt],
+                k,
+                query_embeddings=embeddings,
+                strategy=strategy,
+                domain=domain,
+            )[0]
+            for strategy in strategies
+        }
+
+    async def retrieve():
+        # Embedding and FAISS search are CPU bound; keep them off the event loop.
+        return await asyncio.to_thread(retrieve_all)
+
+    async def original_output():
+        return await get_llm_response_async(user_prompt, "original_output")
+
+    async def candidate(strategy, retrieved_examples):
+        system_prompt = SYSTEM_PROMPTS[strategy]
+        examples = assemble_refiner_examples(user_prompt, system_prompt, retrieved_examples)
+        refined = await refine_prompt_async(user_prompt, system_prompt, examples)
+        if not refined:
+            logger.warning(
+                f"Refined prompt for {strategy} is empty, falling back to the original."
+            )
+            refined = user_prompt
+        return {
+            "strategy": strategy,
+            "retrieved_examples": retrieved_examples,
+            "refined_prompt": refined,
+            "refined_output": await get_llm_response_async(refined, "refined_output"),
+        }
+
+    async def candidates(retrieved_examples):
+        return await asyncio.gather(
+            *(candidate(strategy, retrieved_examples[strategy]) for strategy in strategies)
+        )
+
+    async def scores(original_output, candidates):
+        return await _judge_tournament_async(
+            original_output, [c["refined_output"] for c in candidates], user_prompt
+        )
+
+    timings = {}
+    model_calls = [0]
+    token = _model_calls.set(model_calls)
+    try:
+        with profiling.profile(f"tournament-{correlation_id}", enabled=profile) as profiler:
+            results = await _run_graph(
+                {
+                    "retrieved_examples": ((), retrieve),
+                    "original_output": ((), original_output),
+                    "candidates": (("retrieved_examples",), candidates),
+                    "scores": (("original_output", "candidates"), scores),
+                },
+                timings,
+            )
+    finally:
+        _model_calls.reset(token)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Tournament of {len(strategies)} strategies finished in {elapsed:.3f}s")
+
+    baseline_score, candidate_scores, judge_calls = results["scores"]
+    ranked = [
+        {**c, "score": score, "uplift": score - baseline_score if score else 0}
+        for c, score in zip(results["candidates"], candidate_scores)
+    ]
+    ranked.sort(key=lambda c: c["score"], reverse=True)
+    planned = 2 * len(strategies) + 1 + judge_calls
+    made = model_calls[0]
+    separate = FORGE_LLM_CALLS * len(strategies)
+    record = {
+        "user_prompt": user_prompt,
+        "original_output": results["original_output"],
+        "baseline_score": baseline_score,
+        "candidates": ranked,
+        "llm_calls": {
+            "planned": planned,
+            "made": made,
+            "separate_forges": separate,
+            "saved": separate - planned,
+        },
+        "timings": timings,
+        "correlation_id": correlation_id,
+    }
+    if profiler is not None and profiler.paths:
+        record["profile"] = profiler.paths
+    metrics.inc("promptforge_tournaments_total")
+    metrics.inc("promptforge_tournament_llm_calls_saved_total", separate - planned)
+    metrics.observe("promptforge_tournament_seconds", elapsed)
+    metrics.event(
+        "tournament",
+        strategies=strategies,
+        seconds=round(elapsed, 4),
+        stages=timings,
+        baseline_score=baseline_score,
+        scores={c["strategy"]: c["score"] for c in ranked},
+        llm_calls=made,
+        planned_llm_calls=planned,
+    )
+    return record
+
+
+def tournament(
+    user_prompt: str,
+    strategies: list = None,
+    k: int = 3,
+    domain: str = None,
+    profile: bool = None,
+) -> dict:
+    """
+    Blocking wrapper around `tournament_async` for callers without an event loop.
+
+    Args:
+        user_prompt (str): The original user prompt.
+        strategies (list, optional): Keys of `SYSTEM_PROMPTS`; default all of them.
+        k (int): The number of relevant examples to retrieve per strategy.
+        domain (str, optional): Only retrieve examples of this domain.
+        profile (bool, optional): Profile this tournament, see `forge_async`.
+
+    Returns:
+        dict: The tournament record, see `tournament_async`.
+    """
+    return asyncio.run(
+        tournament_async(user_prompt, strategies, k, domain=domain, profile=profile)
+    )
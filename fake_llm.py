@@ -0,0 +1,264 @@
+"""
+A stand-in for `google.genai.Client` that answers locally after a configurable delay.
+
+Used by the benchmarks to measure pipeline latency without a live GOOGLE_API_KEY,
+and selected as the engine's client with PROMPTFORGE_LLM_BACKEND=fake. Responses
+are a deterministic function of the request: text calls echo the contents, and
+calls with a JSON response schema (the judge) get a valid instance of it with
+scores derived from a hash of the contents. Streaming calls spread the same delay
+over a few chunks. Latency is drawn from a fixed, uniform, exponential or
+lognormal distribution, and failures with chosen status codes, or the httpx
+connection errors and timeouts the real client raises when the backend is
+unreachable, can be injected, both with a seeded random generator to exercise
+`resilient_client`.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import typing
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+# Injectable failures that never reach the API: raised as httpx exceptions.
+TRANSPORT_ERRORS = ("connect", "timeout")
+
+
+class FakeAPIError(Exception):
+    """Mimics `google.genai.errors.APIError`, which carries the HTTP status in `code`."""
+
+    def __init__(self, code: int, message: str = "injected failure"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _transport_error(kind: str) -> Exception:
+    """Returns the httpx exception google-genai raises for an unreachable backend."""
+    import httpx
+
+    request = httpx.Request("POST", "https://generativelanguage.googleapis.com/")
+    if kind == "connect":
+        return httpx.ConnectError("injected connection failure", request=request)
+    return httpx.ReadTimeout("injected read timeout", request=request)
+
+
+class FakeResponse:
+    """Mimics the `.text` attribute of a Gemini `GenerateContentResponse`."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _digest(contents, seed: int) -> bytes:
+    return hashlib.sha256(f"{seed}:{contents}".encode("utf-8")).digest()
+
+
+def _fake_values(schema, digest: bytes, offset: int = 0) -> dict:
+    placeholders = {str: "fake", float: 0.5, bool: True}
+    values = {}
+    for position, (name, field) in enumerate(schema.model_fields.items(), start=offset):
+        item = None
+        if typing.get_origin(field.annotation) is list:
+            item = typing.get_args(field.annotation)[0]
+        if field.annotation is int:
+            values[name] = 1 + digest[position % len(digest)] % 10
+        elif hasattr(item, "model_fields"):
+            count = max([getattr(m, "min_length", 0) or 0 for m in field.metadata] + [1])
+            width = len(item.model_fields)
+            values[name] = [
+                _fake_values(item, digest, position + i * width) for i in range(count)
+            ]
+        else:
+            values[name] = placeholders.get(field.annotation)
+    return values
+
+
+def _fake_json(schema, digest: bytes) -> str:
+    """
+    Builds a valid instance of a pydantic response schema, e.g. `JudgeOutput`.
+
+    Integer fields are scores from 1 to 10 taken from the digest; lists of models
+    get as many items as their minimum length (at least one); other fields get a
+    placeholder of their type.
+    """
+    if not getattr(schema, "model_fields", None):
+        return json.dumps({"score_A": 1 + digest[0] % 10, "score_B": 1 + digest[1] % 10})
+    return schema.model_validate(_fake_values(schema, digest)).model_dump_json()
+
+
+def _fake_text(contents, config, seed: int = 0) -> str:
+    """Produces a plausible response, JSON scores when a response schema is requested."""
+    if isinstance(config, dict) and config.get("response_mime_type") == "application/json":
+        return _fake_json(config.get("response_schema"), _digest(contents, seed))
+    return f"Fake response to: {str(contents).strip()[:80]}"
+
+
+STREAM_CHUNKS = 4
+
+
+def _split(text: str, parts: int = STREAM_CHUNKS) -> list:
+    """Splits text into roughly equal chunks on word boundaries."""
+    words = text.split(" ")
+    size = max(1, -(-len(words) // parts))
+    chunks = [" ".join(words[i : i + size]) for i in range(0, len(words), size)]
+    return [c + " " for c in chunks[:-1]] + chunks[-1:]
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        delay = self._client._next_delay()
+        time.sleep(delay)
+        self._client._maybe_fail()
+        return FakeResponse(_fake_text(contents, config, self._client.seed))
+
+    def generate_content_stream(self, model, contents, config=None):
+        delay = self._client._next_delay()
+        chunks = _split(_fake_text(contents, config, self._client.seed))
+        for i, chunk in enumerate(chunks):
+            time.sleep(delay / len(chunks))
+            if i == 0:
+                self._client._maybe_fail()
+            yield FakeResponse(chunk)
+
+
+class _FakeAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model, contents, config=None):
+        delay = self._client._next_delay()
+        await asyncio.sleep(delay)
+        self._client._maybe_fail()
+        return FakeResponse(_fake_text(contents, config, self._client.seed))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        delay = self._client._next_delay()
+        chunks = _split(_fake_text(contents, config, self._client.seed))
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(delay / len(chunks))
+                if i == 0:
+                    self._client._maybe_fail()
+                yield FakeResponse(chunk)
+
+        return stream()
+
+
+class _FakeAio:
+    def __init__(self, client):
+        self.models = _FakeAsyncModels(client)
+
+
+class FakeGeminiClient:
+    """
+    Drop-in replacement for `GEMINI_CLIENT` exposing `models` and `aio.models`.
+
+    Args:
+        delay (float): Mean seconds a `generate_content` call takes.
+        failure_rate (float): Probability that a call raises `FakeAPIError` with
+            `failure_code`.
+        failure_code (int): The status code of injected failures (503: unavailable).
+        slow_rate (float): Probability that a call takes `slow_delay` instead.
+        slow_delay (float): Seconds a slow call takes.
+        seed (int): Seeds the latency and failure draws and the judge scores.
+        latency (str): One of `LATENCY_DISTRIBUTIONS`. "uniform" spreads delays over
+            `delay * (1 ± jitter)`, "lognormal" uses `jitter` as the log standard
+            deviation; both keep the mean at `delay`.
+        jitter (float): The spread of the uniform and lognormal distributions.
+        errors (dict, optional): Maps status codes, or "connect" / "timeout" for
+            httpx transport errors, to the probability a call fails with them, e.g.
+            `{503: 0.05, 429: 0.02, "connect": 0.01}`. Added to `failure_rate`.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.5,
+        failure_rate: float = 0.0,
+        failure_code: int = 503,
+        slow_rate: float = 0.0,
+        slow_delay: float = 5.0,
+        seed: int = 0,
+        latency: str = "fixed",
+        jitter: float = 0.5,
+        errors: dict = None,
+    ):
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution '{latency}'; expected one of {LATENCY_DISTRIBUTIONS}."
+            )
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = dict(errors or {})
+        if failure_rate:
+            self.errors[failure_code] = self.errors.get(failure_code, 0) + failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.models = _FakeModels(self)
+        self.aio = _FakeAio(self)
+
+    def _next_delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                return self.slow_delay
+            if self.latency == "uniform":
+                return self.delay * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            if self.latency == "exponential":
+                return self._random.expovariate(1 / self.delay) if self.delay else 0.0
+            if self.latency == "lognormal":
+                return self.delay * math.exp(
+                    self._random.gauss(0, self.jitter) - self.jitter**2 / 2
+                )
+            return self.delay
+
+    def _maybe_fail(self) -> None:
+        if not self.errors:
+            return
+        with self._lock:
+            draw = self._random.random()
+            threshold = 0.0
+            for code, rate in sorted(self.errors.items(), key=lambda item: str(item[0])):
+                threshold += rate
+                if draw < threshold:
+                    self.failures += 1
+                    if code in TRANSPORT_ERRORS:
+                        raise _transport_error(code)
+                    raise FakeAPIError(code)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a client from PROMPTFORGE_FAKE_LLM_DELAY (default 0.5 s),
+        PROMPTFORGE_FAKE_LLM_LATENCY (default "fixed"), PROMPTFORGE_FAKE_LLM_JITTER
+        (default 0.5), PROMPTFORGE_FAKE_LLM_ERRORS (comma-separated `code:rate`
+        pairs, e.g. "503:0.05,429:0.02,connect:0.01") and PROMPTFORGE_FAKE_LLM_SEED (default 0).
+        """
+        errors = {}
+        for pair in os.getenv("PROMPTFORGE_FAKE_LLM_ERRORS", "").split(","):
+            if pair.strip():
+                code, rate = pair.split(":")
+                code = code.strip()
+                errors[code if code in TRANSPORT_ERRORS else int(code)] = float(rate)
+        return cls(
+            delay=float(os.getenv("PROMPTFORGE_FAKE_LLM_DELAY", 0.5)),
+            latency=os.getenv("PROMPTFORGE_FAKE_LLM_LATENCY", "fixed"),
+            jitter=float(os.getenv("PROMPTFORGE_FAKE_LLM_JITTER", 0.5)),
+            errors=errors,
+            seed=int(os.getenv("PROMPTFORGE_FAKE_LLM_SEED", 0)),
+        )
@@ -0,0 +1,276 @@
+"""
+Persistent history of forge results.
+
+Each completed forge is appended as one record. Prompts, strategy and scores are
+plain columns, indexed by user, session, time and strategy. The two generated
+outputs, which are by far the largest fields, are stored zlib-compressed in a
+single blob and only decoded when an entry is opened. Listing and aggregate
+queries never read them.
+
+The store is pluggable: `HistoryStore` defines the interface, `SQLiteHistoryStore`
+is the default backend, and `set_history_store` installs another one.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Outputs smaller than this are stored uncompressed; zlib gains little on them.
+COMPRESS_MIN_BYTES = 256
+
+# Columns returned when listing entries; the outputs are loaded separately.
+SUMMARY_FIELDS = (
+    "id",
+    "user_id",
+    "session_id",
+    "created_at",
+    "strategy",
+    "user_prompt",
+    "refined_prompt",
+    "original_score",
+    "refined_score",
+    "uplift",
+)
+
+
+def _encode_outputs(outputs: dict) -> tuple:
+    data = json.dumps(outputs, ensure_ascii=False).encode("utf-8")
+    if len(data) < COMPRESS_MIN_BYTES:
+        return data, None
+    return zlib.compress(data, 6), "zlib"
+
+
+def _decode_outputs(data: bytes, codec) -> dict:
+    if codec == "zlib":
+        data = zlib.decompress(data)
+    return json.loads(data.decode("utf-8"))
+
+
+class HistoryStore:
+    """
+    Interface of a forge history backend.
+
+    Records are dicts with the keys of `SUMMARY_FIELDS` plus `original_output` and
+    `refined_output`. Filters left as None match everything.
+    """
+
+    def append(self, record: dict, user_id: str, session_id: str) -> int:
+        """Stores a forge result and returns its id."""
+        raise NotImplementedError
+
+    def recent(
+        self, user_id: str = None, session_id: str = None, limit: int = 10, offset: int = 0
+    ) -> list:
+        """Returns summaries (no outputs) of the newest entries, newest first."""
+        raise NotImplementedError
+
+    def count(self, user_id: str = None, session_id: str = None) -> int:
+        """Returns the number of matching entries."""
+        raise NotImplementedError
+
+    def get(self, entry_id: int):
+        """Returns the full record of an entry, outputs included, or None."""
+        raise NotImplementedError
+
+    def strategy_stats(self, user_id: str = None, since: float = None) -> list:
+        """
+        Returns per strategy the number of forges, the mean original and refined
+        scores, the mean uplift and the share of forges the refinement improved,
+        ordered by mean uplift.
+        """
+        raise NotImplementedError
+
+    def clear(self, user_id: str = None) -> None:
+        """Deletes the entries of a user, or all entries."""
+        raise NotImplementedError
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    History backend storing every entry as a row of a single SQLite table.
+
+    Args:
+        path (str): The database file; ":memory:" keeps the history in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS forge_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                strategy TEXT NOT NULL,
+                user_prompt TEXT NOT NULL,
+                refined_prompt TEXT NOT NULL,
+                original_score REAL NOT NULL,
+                refined_score REAL NOT NULL,
+                uplift REAL NOT NULL,
+                outputs BLOB NOT NULL,
+                outputs_codec TEXT
+            )
+            """
+        )
+        # Every listing filters on user or session and sorts by time. Aggregates
+        # group by strategy; carrying the scores makes that index covering, so they
+        # never read the rows with their outputs.
+        for name, columns in (
+            ("user_time", "user_id, created_at"),
+            ("session_time", "session_id, created_at"),
+            ("time", "created_at"),
+            ("strategy_time", "strategy, created_at, original_score, refined_score, uplift"),
+        ):
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS forge_history_{name} ON forge_history ({columns})"
+            )
+        self._conn.commit()
+
+    @staticmethod
+    def _where(user_id=None, session_id=None, since=None) -> tuple:
+        clauses, params = [], []
+        for column, value, operator in (
+            ("user_id", user_id, "="),
+            ("session_id", session_id, "="),
+            ("created_at", since, ">="),
+        ):
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def append(self, record: dict, user_id: str, session_id: str) -> int:
+        original_score = float(record.get("original_score") or 0)
+        refined_score = float(record.get("refined_score") or 0)
+        outputs, codec = _encode_outputs(
+            {
+                "original_output": record.get("original_output", ""),
+                "refined_output": record.get("refined_output", ""),
+            }
+        )
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO forge_history (
+                    user_id, session_id, created_at, strategy, user_prompt,
+                    refined_prompt, original_score, refined_score, uplift, outputs,
+                    outputs_codec
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    user_id,
+                    session_id,
+                    record.get("created_at") or time.time(),
+                    record["strategy"],
+                    record["user_prompt"],
+                    record.get("refined_prompt", ""),
+                    original_score,
+                    refined_score,
+                    refined_score - original_score,
+                    outputs,
+                    codec,
+                ),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def recent(
+        self, user_id: str = None, session_id: str = None, limit: int = 10, offset: int = 0
+    ) -> list:
+        where, params = self._where(user_id, session_id)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(SUMMARY_FIELDS)} FROM forge_history{where} "
+                "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return [dict(zip(SUMMARY_FIELDS, row)) for row in rows]
+
+    def count(self, user_id: str = None, session_id: str = None) -> int:
+        where, params = self._where(user_id, session_id)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM forge_history{where}", params
+            ).fetchone()[0]
+
+    def get(self, entry_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(SUMMARY_FIELDS)}, outputs, outputs_codec "
+                "FROM forge_history WHERE id = ?",
+                (entry_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(SUMMARY_FIELDS, row))
+        record.update(_decode_outputs(row[-2], row[-1]))
+        return record
+
+    def strategy_stats(self, user_id: str = None, since: float = None) -> list:
+        where, params = self._where(user_id, since=since)
+        fields = (
+            "strategy",
+            "forges",
+            "mean_original_score",
+            "mean_refined_score",
+            "mean_uplift",
+            "improved_rate",
+        )
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT strategy, COUNT(*), AVG(original_score), AVG(refined_score),
+                    AVG(uplift), AVG(uplift > 0)
+                FROM forge_history{where}
+                GROUP BY strategy
+                ORDER BY AVG(uplift) DESC
+                """,
+                params,
+            ).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def clear(self, user_id: str = None) -> None:
+        where, params = self._where(user_id)
+        with self._lock:
+            self._conn.execute(f"DELETE FROM forge_history{where}", params)
+            self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> "SQLiteHistoryStore":
+        """
+        Opens the database at PROMPTFORGE_HISTORY_PATH (default
+        "forge_history.sqlite3"); an empty value keeps the history in memory.
+        """
+        return cls(os.getenv("PROMPTFORGE_HISTORY_PATH", "forge_history.sqlite3") or ":memory:")
+
+
+_HISTORY_LOCK = threading.Lock()
+_history_store = None
+
+
+def get_history_store() -> HistoryStore:
+    """Returns the shared history store, opening the SQLite backend on first use."""
+    global _history_store
+    if _history_store is None:
+        with _HISTORY_LOCK:
+            if _history_store is None:
+                _history_store = SQLiteHistoryStore.from_env()
+                logger.info(f"Forge history store opened at {_history_store.path}")
+    return _history_store
+
+
+def set_history_store(store: HistoryStore) -> None:
+    """Replaces the shared history store, e.g. with another backend."""
+    global _history_store
+    with _HISTORY_LOCK:
+        _history_store = store
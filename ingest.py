@@ -0,0 +1,597 @@
+"""
+Streaming ingestion of external knowledge bases into the RAG index.
+
+Reads a JSONL or Parquet file chunk by chunk, validates each record against the
+knowledge base schema (`KNOWLEDGE_BASE_FIELDS`), encodes the prompt texts in a
+pool of worker processes and appends the vectors, metadata and BM25 postings as
+each chunk comes back. The corpus is never held in memory: at most `2 * workers`
+chunks are in flight, metadata goes straight to the column store's files and
+BM25 postings to a scratch run file. What grows with the corpus is the FAISS
+index itself, 8 bytes per record for duplicate detection and, for IVF/PQ
+indexes, the first `train_size` vectors buffered for training.
+
+Everything is written next to the final paths and swapped in at the end, so an
+ingest that fails halfway leaves the current index untouched. With `--append`
+the records are added to the existing index instead of replacing it.
+
+Usage:
+    python ingest.py --input prompts.jsonl --workers 4 --index-spec IVF-PQ
+    python ingest.py --input more.parquet --append
+"""
+
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from vector_store import (
+    BM25_PATH,
+    INDEX_PATH,
+    KNOWLEDGE_BASE_FIELDS,
+    MANIFEST_PATH,
+    METADATA_PATH,
+    STRATEGY_CLASSIFIER_PATH,
+    _atomic_write,
+    create_index,
+    prompt_faiss_id,
+    read_manifest,
+    resolve_index_spec,
+)
+
+logger = logging.getLogger(__name__)
+
+INPUT_FORMATS = ("jsonl", "parquet")
+ERROR_POLICIES = ("fail", "skip")
+
+# Fields that must not be empty or whitespace.
+REQUIRED_TEXT_FIELDS = ("prompt_id", "prompt_text")
+
+# Invalid records logged individually when they are skipped; the rest are counted.
+MAX_LOGGED_ERRORS = 10
+
+
+def infer_format(path: str) -> str:
+    """Infers the input format from the file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    raise ValueError(f"Cannot infer the format of {path}; expected one of {INPUT_FORMATS}.")
+
+
+def count_records(path: str, fmt: str = None) -> int:
+    """
+    Counts the records of an input file without parsing them.
+
+    JSONL files are scanned for non-blank lines; Parquet files report their row
+    count in the footer.
+    """
+    fmt = fmt or infer_format(path)
+    if fmt == "parquet":
+        return _parquet_file(path).metadata.num_rows
+    count = 0
+    with open(path, "rb") as f:
+        for line in f:
+            count += bool(line.strip())
+    return count
+
+
+def _parquet_file(path: str):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Reading Parquet needs pyarrow: `pip install pyarrow`, or convert the file to JSONL."
+        ) from e
+    return pq.ParquetFile(path)
+
+
+def read_records(path: str, fmt: str = None, batch_size: int = 1024):
+    """
+    Streams the records of an input file.
+
+    Yields:
+        tuple: `(location, record)`, where location names the line or row for error
+            messages and record is the decoded dict, or the `ValueError` of a JSONL
+            line that is not valid JSON.
+    """
+    fmt = fmt or infer_format(path)
+    if fmt == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield f"line {number}", json.loads(line)
+                except ValueError as e:
+                    yield f"line {number}", ValueError(f"invalid JSON ({e})")
+        return
+
+    parquet = _parquet_file(path)
+    columns = [c for c in KNOWLEDGE_BASE_FIELDS if c in parquet.schema_arrow.names]
+    row = 0
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        for record in batch.to_pylist():
+            row += 1
+            yield f"row {row}", record
+
+
+def validate_record(record) -> dict:
+    """
+    Checks a record against the knowledge base schema.
+
+    Args:
+        record: A decoded input record.
+
+    Returns:
+        dict: The record reduced to `KNOWLEDGE_BASE_FIELDS`.
+
+    Raises:
+        ValueError: If a field is missing or not a string, or a required field is
+            empty.
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError(f"expected an object, got {type(record).__name__}")
+    entry = {}
+    for field in KNOWLEDGE_BASE_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str):
+            state = "missing" if value is None else f"a {type(value).__name__}"
+            raise ValueError(f"field '{field}' is {state}, expected a string")
+        if field in REQUIRED_TEXT_FIELDS and not value.strip():
+            raise ValueError(f"field '{field}' is empty")
+        entry[field] = value
+    return entry
+
+
+class _IdSet:
+    """
+    The FAISS ids seen so far, as sorted runs whose sizes at least double.
+
+    Membership tests binary-search each run and inserts merge equal-sized runs,
+    so n ids cost O(n log n) time and 8 bytes each, without a Python set.
+    """
+
+    def __init__(self, ids=None):
+        self._runs = []
+        if ids is not None and len(ids):
+            self._runs.append(np.sort(np.asarray(ids, dtype="int64")))
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(ids), dtype=bool)
+        for run in self._runs:
+            if not len(run):
+                continue
+            positions = np.minimum(np.searchsorted(run, ids), len(run) - 1)
+            found |= run[positions] == ids
+        return found
+
+    def add(self, ids: np.ndarray) -> None:
+        if not len(ids):
+            # A chunk of duplicates only; an empty run would break `contains`.
+            return
+        run = np.sort(ids)
+        while self._runs and len(self._runs[-1]) <= len(run):
+            run = np.sort(np.concatenate((self._runs.pop(), run)), kind="mergesort")
+        self._runs.append(run)
+
+
+# Each worker process loads its own copy of the model once, in `_init_worker`.
+_worker_model = None
+
+
+def load_model(model_name: str, embedding_backend: str = "torch", threads: int = None):
+    """
+    Loads the embedding model for `embedding_backend` ("torch", "onnx" or "onnx-int8").
+
+    Args:
+        model_name (str): The sentence transformer model name.
+        embedding_backend (str): How embeddings are computed.
+        threads (int, optional): Intra-op threads; the library's default if None.
+    """
+    if embedding_backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+
+    from onnx_embedder import OnnxEmbedder, default_model_dir
+
+    return OnnxEmbedder(
+        os.getenv("PROMPTFORGE_ONNX_DIR") or default_model_dir(model_name),
+        quantized=embedding_backend == "onnx-int8",
+        threads=threads,
+    )
+
+
+def _init_worker(model_name: str, embedding_backend: str, threads: int) -> None:
+    global _worker_model
+    _worker_model = load_model(model_name, embedding_backend, threads)
+
+
+def _encode(texts: list, batch_size: int) -> np.ndarray:
+    vectors = _worker_model.encode(
+        texts, batch_size=batch_size, convert_to_tensor=False, normalize_embeddings=True
+    )
+    return np.asarray(vectors, dtype="float32")
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _replace_path(tmp_path: str, path: str) -> None:
+    """Moves a finished file or directory over `path`."""
+    if os.path.isdir(tmp_path):
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(tmp_path, path)
+
+
+class _IndexSink:
+    """
+    Receives encoded chunks and adds them to the FAISS index.
+
+    The index is created from the first chunk, once the dimension is known. An
+    untrained (IVF/PQ) index buffers vectors until `train_size` have arrived, is
+    trained on them and then receives the buffer.
+    """
+
+    def __init__(self, index, index_spec: str, expected_count: int, train_size: int):
+        self.index = index
+        self.index_spec = index_spec
+        self.factory_string = None
+        self.expected_count = expected_count
+        self.train_size = train_size
+        self._buffer = []
+        self._buffered = 0
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if self.index is None:
+            self.factory_string = resolve_index_spec(
+                self.index_spec, self.expected_count, vectors.shape[1]
+            )
+            self.index = create_index(self.factory_string, vectors.shape[1])
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self._buffer.append((ids, vectors))
+        self._buffered += len(ids)
+        if self._buffered >= self.train_size:
+            self._train()
+
+    def _train(self) -> None:
+        sample = np.concatenate([vectors for _, vectors in self._buffer])[: self.train_size]
+        print(f"Training {self.factory_string} on the first {len(sample)} vectors...")
+        self.index.train(sample)
+        for ids, vectors in self._buffer:
+            self.index.add_with_ids(vectors, ids)
+        self._buffer, self._buffered = [], 0
+
+    def finish(self):
+        if self._buffer:
+            self._train()
+        return self.index
+
+
+def ingest(
+    input_path: str,
+    model_name: str = "all-MiniLM-L6-v2",
+    embedding_backend: str = "torch",
+    index_spec: str = "Flat",
+    append: bool = False,
+    input_format: str = None,
+    chunk_size: int = 1024,
+    workers: int = None,
+    encode_batch_size: int = 64,
+    train_size: int = 100_000,
+    on_error: str = "fail",
+    index_path: str = INDEX_PATH,
+    manifest_path: str = MANIFEST_PATH,
+    metadata_path: str = METADATA_PATH,
+    bm25_path: str = BM25_PATH,
+    strategy_classifier_path: str = STRATEGY_CLASSIFIER_PATH,
+) -> dict:
+    """
+    Builds the FAISS index, metadata store, BM25 index, strategy classifier and
+    manifest from a file.
+
+    Args:
+        input_path (str): A JSONL file of one entry per line, or a Parquet file
+            with one column per field of `KNOWLEDGE_BASE_FIELDS`.
+        model_name (str): The embedding model, recorded in the manifest.
+        embedding_backend (str): "torch", "onnx" or "onnx-int8".
+        index_spec (str): The index type, see `resolve_index_spec`. Ignored when
+            appending, which keeps the existing index's layout.
+        append (bool): Add the records to the existing index instead of replacing it.
+        input_format (str, optional): "jsonl" or "parquet"; inferred from the
+            extension if None.
+        chunk_size (int): Records validated, encoded and written per step.
+        workers (int, optional): Encoding processes; 0 encodes in this process.
+            Defaults to the CPU count, at most 4. The CPUs are split evenly
+            between their intra-op thread pools.
+        encode_batch_size (int): Texts per forward pass within a chunk.
+        train_size (int): Vectors IVF/PQ indexes are trained on: the first ones
+            ingested, so shuffle inputs that are sorted by topic.
+        on_error (str): "fail" stops at the first invalid or duplicate record,
+            "skip" logs and counts it.
+        index_path, manifest_path, metadata_path, bm25_path,
+            strategy_classifier_path (str): Output paths.
+
+    Returns:
+        dict: Counts of ingested, invalid and duplicate records, the total entry
+            count, and the duration and throughput.
+
+    Raises:
+        ValueError: On an invalid or duplicate record with on_error="fail", or when
+            appending to an index built with another model or backend.
+    """
+    import faiss
+
+    from lexical_index import BM25Writer
+    from metadata_store import MetadataStore, MetadataWriter
+    from strategy_classifier import StrategyClassifier, StrategyClassifierTrainer
+
+    if on_error not in ERROR_POLICIES:
+        raise ValueError(f"Unknown on_error '{on_error}'; expected one of {ERROR_POLICIES}.")
+    fmt = input_format or infer_format(input_path)
+    started = time.perf_counter()
+
+    manifest = read_manifest(manifest_path) if append else None
+    if append and (manifest is None or not manifest.get("metadata")):
+        logger.warning("No index with a metadata store to append to; building a new one.")
+        append = False
+    if append and (
+        manifest.get("model") != model_name
+        or manifest.get("embedding_backend", "torch") != embedding_backend
+    ):
+        raise ValueError(
+            f"Index was built with {manifest.get('model')} "
+            f"({manifest.get('embedding_backend', 'torch')}); append with the same model "
+            "and backend, or rebuild without --append."
+        )
+
+    paths = {
+        "index": index_path,
+        "metadata": metadata_path,
+        "bm25": bm25_path,
+        "strategy_classifier": strategy_classifier_path,
+    }
+    tmp = {name: f"{path}.ingest" for name, path in paths.items()}
+    for path in tmp.values():
+        _remove(path)
+    metadata = bm25 = pool = None
+    try:
+        bm25 = BM25Writer(tmp["bm25"])
+        if append:
+            existing = MetadataStore(metadata_path)
+            seen = _IdSet(existing.ids)
+            for start, texts in existing.iter_column("prompt_text"):
+                bm25.add(existing.ids[start : start + len(texts)], texts)
+            shutil.copytree(metadata_path, tmp["metadata"])
+            metadata = MetadataWriter(tmp["metadata"], append=True)
+            sink = _IndexSink(faiss.read_index(index_path), None, 0, train_size)
+            sink.factory_string = manifest.get("index_factory")
+            del existing
+            classifier_file = os.path.join(
+                os.path.dirname(manifest_path), manifest.get("strategy_classifier") or ""
+            )
+            if manifest.get("strategy_classifier") and os.path.isfile(classifier_file):
+                trainer = StrategyClassifierTrainer(StrategyClassifier.load(classifier_file))
+            else:
+                logger.warning(
+                    "The index has no strategy classifier; the new one only learns from "
+                    "the appended records."
+                )
+                trainer = StrategyClassifierTrainer()
+        else:
+            seen = _IdSet()
+            metadata = MetadataWriter(tmp["metadata"])
+            expected = count_records(input_path, fmt)
+            sink = _IndexSink(None, index_spec, expected, train_size)
+            trainer = StrategyClassifierTrainer()
+
+        if workers is None:
+            workers = min(os.cpu_count() or 1, 4)
+        threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+        if workers:
+            pool = multiprocessing.get_context("spawn").Pool(
+                workers, _init_worker, (model_name, embedding_backend, threads)
+            )
+        else:
+            _init_worker(model_name, embedding_backend, None)
+
+        stats = {"ingested": 0, "invalid": 0, "duplicates": 0}
+
+        def reject(kind: str, location: str, message: str) -> None:
+            if on_error == "fail":
+                raise ValueError(f"{input_path}, {location}: {message}")
+            stats[kind] += 1
+            if stats["invalid"] + stats["duplicates"] <= MAX_LOGGED_ERRORS:
+                logger.warning(f"Skipping {input_path}, {location}: {message}")
+
+        def chunks():
+            entries, locations = [], []
+            for location, record in read_records(input_path, fmt, chunk_size):
+                try:
+                    entries.append(validate_record(record))
+                    locations.append(location)
+                except ValueError as e:
+                    reject("invalid", location, str(e))
+                if len(entries) == chunk_size:
+                    yield entries, locations
+                    entries, locations = [], []
+            if entries:
+                yield entries, locations
+
+        def deduplicate(entries: list, locations: list):
+            ids = np.fromiter(
+                (prompt_faiss_id(e["prompt_id"]) for e in entries), "int64", len(entries)
+            )
+            _, first = np.unique(ids, return_index=True)
+            keep = np.zeros(len(ids), dtype=bool)
+            keep[first] = True
+            keep &= ~seen.contains(ids)
+            for position in np.flatnonzero(~keep):
+                reject(
+                    "duplicates",
+                    locations[position],
+                    f"duplicate prompt_id '{entries[position]['prompt_id']}'",
+                )
+            seen.add(ids[keep])
+            return ids[keep], [e for e, k in zip(entries, keep) if k]
+
+        def write(ids: np.ndarray, entries: list, vectors: np.ndarray) -> None:
+            sink.add(ids, vectors)
+            metadata.add(ids, entries)
+            bm25.add(ids, [e["prompt_text"] for e in entries])
+            trainer.add([e["strategy"] for e in entries], vectors)
+            stats["ingested"] += len(entries)
+            rate = stats["ingested"] / (time.perf_counter() - started)
+            print(f"Ingested {stats['ingested']} records ({rate:.0f}/s)...")
+
+        # Chunks are written in input order; the deque bounds the encoded
+        # vectors and entries waiting in memory.
+        pending = collections.deque()
+        for entries, locations in chunks():
+            ids, entries = deduplicate(entries, locations)
+            if not entries:
+                continue
+            texts = [e["prompt_text"] for e in entries]
+            if pool is None:
+                write(ids, entries, _encode(texts, encode_batch_size))
+                continue
+            pending.append((ids, entries, pool.apply_async(_encode, (texts, encode_batch_size))))
+            while len(pending) >= 2 * workers:
+                ids, entries, result = pending.popleft()
+                write(ids, entries, result.get())
+        while pending:
+            ids, entries, result = pending.popleft()
+            write(ids, entries, result.get())
+
+        if sink.index is None:
+            raise ValueError(f"{input_path} contains no valid records.")
+        index = sink.finish()
+        faiss.write_index(index, tmp["index"])
+        metadata.close()
+        bm25.close()
+        trainer.finish().save(tmp["strategy_classifier"])
+    except BaseException:
+        if bm25 is not None:
+            bm25.abort()
+        for path in tmp.values():
+            _remove(path)
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    for name, path in paths.items():
+        _replace_path(tmp[name], path)
+    source = {
+        "path": os.path.abspath(input_path),
+        "format": fmt,
+        "records": stats["ingested"],
+        "ingested_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    manifest = {
+        "model": model_name,
+        "embedding_backend": embedding_backend,
+        "dimension": int(index.d),
+        "count": int(index.ntotal),
+        # The hash describes the built-in KNOWLEDGE_BASE; ingested entries are
+        # described by their sources instead.
+        "hash": None,
+        "sources": (manifest.get("sources", []) if append else []) + [source],
+        "index_file": os.path.basename(index_path),
+        "index_spec": manifest.get("index_spec", "Flat") if append else index_spec,
+        "index_factory": sink.factory_string,
+        "metadata": os.path.basename(metadata_path),
+        "bm25": os.path.basename(bm25_path),
+        "strategy_classifier": os.path.basename(strategy_classifier_path),
+        "id_scheme": "blake2b-64(prompt_id)",
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+    def write_manifest(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+    _atomic_write(manifest_path, write_manifest)
+
+    seconds = time.perf_counter() - started
+    stats.update(
+        count=int(index.ntotal),
+        seconds=seconds,
+        records_per_second=stats["ingested"] / seconds if seconds else 0.0,
+    )
+    logger.info(f"Ingestion finished: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build or extend the RAG index from a JSONL or Parquet file."
+    )
+    parser.add_argument("--input", required=True, help="A .jsonl or .parquet file.")
+    parser.add_argument("--format", choices=INPUT_FORMATS, help="Default: from the extension.")
+    parser.add_argument(
+        "--append", action="store_true", help="Add to the existing index instead of replacing it."
+    )
+    parser.add_argument(
+        "--index-spec",
+        default="Flat",
+        help='Index type: "Flat", "IVF-Flat", "IVF-PQ", "HNSW" or a FAISS factory string.',
+    )
+    parser.add_argument(
+        "--embedding-backend", choices=("torch", "onnx", "onnx-int8"), default="torch"
+    )
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Records per chunk.")
+    parser.add_argument(
+        "--workers", type=int, help="Encoding processes; 0 encodes in-process. Default: CPUs, max 4."
+    )
+    parser.add_argument("--train-size", type=int, default=100_000)
+    parser.add_argument("--on-error", choices=ERROR_POLICIES, default="fail")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    stats = ingest(
+        args.input,
+        embedding_backend=args.embedding_backend,
+        index_spec=args.index_spec,
+        append=args.append,
+        input_format=args.format,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        train_size=args.train_size,
+        on_error=args.on_error,
+    )
+    print(
+        f"Index holds {stats['count']} entries: {stats['ingested']} ingested, "
+        f"{stats['invalid']} invalid and {stats['duplicates']} duplicate records skipped "
+        f"({stats['records_per_second']:.0f} records/s)."
+    )
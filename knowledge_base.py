@@ -1,6 +1,9 @@
-import faiss
-import numpy as np
-from sentence_transformers import SentenceTransformer
+from typing import TYPE_CHECKING
+
+# faiss and sentence_transformers are imported where they are used so that
+# importing KNOWLEDGE_BASE stays cheap for the engine.
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 KNOWLEDGE_BASE = [
     # I. Finance
@@ -179,47 +182,81 @@ KNOWLEDGE_BASE = [
 ]
 
 
-def create_vector_store(knowledge_base: list[dict], model: SentenceTransformer) -> None:
+def create_vector_store(
+    knowledge_base: list[dict],
+    model: "SentenceTransformer",
+    model_name: str = "all-MiniLM-L6-v2",
+    index_spec: str = "Flat",
+    embedding_backend: str = "torch",
+) -> None:
     """
-    Generates embeddings for the knowledge base and creates a FAISS index.
+    Generates embeddings for the knowledge base and creates or updates the FAISS index.
+
+    Embeddings are cached per prompt_id in a sidecar store, so only added or edited
+    entries are re-encoded. A manifest describing the index is written next to it.
 
     Args:
         knowledge_base_data (list): A list of dictionaries, where each dict represents a prompt.
         model: A pre-loaded SentenceTransformer model.
+        model_name (str): The name the model was loaded with, recorded in the manifest.
+        index_spec (str): "Flat", "IVF-Flat", "IVF-PQ", "HNSW" or a FAISS factory string.
+        embedding_backend (str): "torch", "onnx" or "onnx-int8": how `model` computes
+            embeddings, recorded in the manifest.
     """
-    print("Extracting prompt texts from knowledge base...")
-    prompt_texts = [
-        item["prompt_text"] for item in knowledge_base
-    ]  # Only prompt text needs to be vectorized
+    from vector_store import build_index
 
-    print("Generating embeddings...")
-    embeddings = model.encode(
-        prompt_texts, convert_to_tensor=False, normalize_embeddings=True
+    print(f"Syncing index with {len(knowledge_base)} knowledge base entries...")
+    stats = build_index(
+        knowledge_base,
+        model,
+        model_name,
+        index_spec=index_spec,
+        embedding_backend=embedding_backend,
+    )
+    print(
+        f"Index up to date: {stats['added']} added, {stats['updated']} updated, "
+        f"{stats['removed']} removed, {stats['unchanged']} unchanged."
     )
 
-    # The dimension of our embeddings
-    d = embeddings.shape[1]
-
-    print(f"Embeddings generated with dimension: {d}")
-
-    print("Creating FAISS index...")
-    index = faiss.IndexFlatIP(d)
 
-    # Add the vectorized prompts to the index
-    index.add(embeddings)
+if __name__ == "__main__":
+    import argparse
 
-    print(f"Index created successfully with {index.ntotal} entries.")
+    parser = argparse.ArgumentParser(description="Build or update the RAG index.")
+    parser.add_argument(
+        "--index-spec",
+        default="Flat",
+        help='Index type: "Flat", "IVF-Flat", "IVF-PQ", "HNSW" or a FAISS factory string.',
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        choices=("torch", "onnx", "onnx-int8"),
+        default="torch",
+        help="Encode with PyTorch or with the ONNX export from `python onnx_embedder.py`.",
+    )
+    args = parser.parse_args()
 
-    # Save the index to disk
-    faiss.write_index(index, "knowledge_base_index.bin")
+    if args.embedding_backend == "torch":
+        from sentence_transformers import SentenceTransformer
 
-    print("Index saved to disk.")
+        print("Loading pre-trained sentence transformer model...")
+        # Load the pre-trained model
+        model = SentenceTransformer("all-MiniLM-L6-v2")
+    else:
+        import os
 
+        from onnx_embedder import OnnxEmbedder, default_model_dir
 
-if __name__ == "__main__":
-    print("Loading pre-trained sentence transformer model...")
-    # Load the pre-trained model
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+        print("Loading ONNX export of the sentence transformer model...")
+        model = OnnxEmbedder(
+            os.getenv("PROMPTFORGE_ONNX_DIR") or default_model_dir("all-MiniLM-L6-v2"),
+            quantized=args.embedding_backend == "onnx-int8",
+        )
 
     # Create the vector store
-    create_vector_store(KNOWLEDGE_BASE, model)
+    create_vector_store(
+        KNOWLEDGE_BASE,
+        model,
+        index_spec=args.index_spec,
+        embedding_backend=args.embedding_backend,
+    )
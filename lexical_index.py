@@ -0,0 +1,370 @@
+"""
+BM25 inverted index over the knowledge base prompt texts.
+
+Dense embeddings blur exact terms such as "DCF", "HIPAA" or "Kubernetes"; a
+lexical index ranks them precisely. The index is stored like the metadata store:
+flat binary arrays opened with `np.memmap`, so every process shares one copy. A
+query gathers the postings of its terms and scores them with array operations, so
+no Python loop runs over documents.
+
+Layout of an index directory:
+
+    meta.json             row count, vocabulary size, average document length
+    ids.bin               int64 FAISS id per row
+    doc_lengths.bin       uint32 token count per row
+    terms.offsets.bin     int64 start offset of each term, terms sorted
+    terms.data.bin        concatenated UTF-8 terms
+    term_offsets.bin      int64 start of each term's postings (one extra at the end)
+    postings_rows.bin     int32 row of each posting, grouped by term
+    postings_tf.bin       uint16 term frequency of each posting
+
+`reciprocal_rank_fusion` merges the lexical and dense rankings.
+"""
+
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Standard BM25 parameters: term frequency saturation and length normalization.
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+# The usual RRF constant; it damps the weight of the very first ranks.
+DEFAULT_RRF_K = 60
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens; acronyms and product names stay single terms."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _memmap(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+def _replace_directory(tmp_path: str, path: str) -> None:
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+# Postings collected by `BM25Writer.add` before they are laid out by term.
+_RUN_DTYPE = np.dtype([("term", "<i4"), ("row", "<i4"), ("tf", "<u2")])
+# Run records laid out per step of `BM25Writer.close`.
+_LAYOUT_BLOCK = 1 << 20
+
+
+class BM25Writer:
+    """
+    Builds a BM25 index from texts added in any number of batches.
+
+    Memory stays bounded by the vocabulary and one batch: `add` appends each
+    batch's (term, row, tf) postings to a scratch file in arrival order, and
+    `close` lays them out grouped by term in a second pass over that file,
+    writing straight into the memory-mapped postings arrays. Nothing is visible
+    at `path` until `close` atomically replaces it.
+
+    Args:
+        path (str): The index directory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+        os.makedirs(self._tmp_path)
+        self.count = 0
+        self._total_length = 0
+        self._vocabulary = {}
+        self._df = np.zeros(0, dtype="int64")
+        self._ids = open(self._file("ids.bin"), "wb")
+        self._doc_lengths = open(self._file("doc_lengths.bin"), "wb")
+        self._runs = open(self._file("runs.bin"), "wb")
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self._tmp_path, name)
+
+    def add(self, ids, texts: list) -> None:
+        """
+        Indexes a batch of texts.
+
+        Args:
+            ids: The FAISS id of each text.
+            texts (list): The indexed texts, one per id.
+        """
+        term_ids, rows = [], []
+        doc_lengths = np.empty(len(texts), dtype="uint32")
+        for offset, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[offset] = len(tokens)
+            term_ids.extend(self._vocabulary.setdefault(t, len(self._vocabulary)) for t in tokens)
+            rows.extend([self.count + offset] * len(tokens))
+
+        pairs, tf = np.unique(
+            np.asarray(term_ids, dtype="int64") << 32 | np.asarray(rows, dtype="int64"),
+            return_counts=True,
+        )
+        run = np.empty(len(pairs), dtype=_RUN_DTYPE)
+        run["term"] = pairs >> 32
+        run["row"] = pairs & 0xFFFF_FFFF
+        run["tf"] = np.minimum(tf, np.iinfo("uint16").max)
+        run.tofile(self._runs)
+        if len(self._df) < len(self._vocabulary):
+            self._df = np.concatenate(
+                (self._df, np.zeros(len(self._vocabulary) - len(self._df), dtype="int64"))
+            )
+        self._df += np.bincount(run["term"], minlength=len(self._df))
+
+        np.asarray(ids, dtype="int64").tofile(self._ids)
+        doc_lengths.tofile(self._doc_lengths)
+        self.count += len(texts)
+        self._total_length += int(doc_lengths.sum())
+
+    def close(self) -> dict:
+        """
+        Lays out the postings, writes meta.json and replaces the index at `path`.
+
+        Returns:
+            dict: The index's meta.json.
+        """
+        for f in (self._ids, self._doc_lengths, self._runs):
+            f.close()
+
+        # Number the terms alphabetically so a query term is found by binary search.
+        terms = sorted(self._vocabulary)
+        alphabetical = np.empty(len(terms), dtype="int64")
+        alphabetical[[self._vocabulary[term] for term in terms]] = np.arange(len(terms))
+        df = np.zeros(len(terms), dtype="int64")
+        df[alphabetical] = self._df
+        term_offsets = np.concatenate(([0], np.cumsum(df))).astype("int64")
+        total = int(term_offsets[-1])
+
+        # Runs arrive in row order, so a stable sort by term keeps every term's
+        # rows ascending while they are scattered to their place.
+        postings_rows = self._create("postings_rows.bin", "int32", total)
+        postings_tf = self._create("postings_tf.bin", "uint16", total)
+        cursor = term_offsets[:-1].copy()
+        for start in range(0, total, _LAYOUT_BLOCK):
+            block = np.fromfile(
+                self._file("runs.bin"),
+                dtype=_RUN_DTYPE,
+                count=min(_LAYOUT_BLOCK, total - start),
+                offset=start * _RUN_DTYPE.itemsize,
+            )
+            block_terms = alphabetical[block["term"]]
+            order = np.argsort(block_terms, kind="stable")
+            block_terms = block_terms[order]
+            unique, first, counts = np.unique(
+                block_terms, return_index=True, return_counts=True
+            )
+            positions = cursor[block_terms] + np.arange(len(order)) - np.repeat(first, counts)
+            postings_rows[positions] = block["row"][order]
+            postings_tf[positions] = block["tf"][order]
+            cursor[unique] += counts
+        for array in (postings_rows, postings_tf):
+            if isinstance(array, np.memmap):
+                array.flush()
+        del postings_rows, postings_tf
+        os.remove(self._file("runs.bin"))
+
+        encoded = [term.encode("utf-8") for term in terms]
+        lengths = np.fromiter((len(b) for b in encoded), dtype="int64", count=len(encoded))
+        np.concatenate(([0], np.cumsum(lengths)[:-1])).astype("int64").tofile(
+            self._file("terms.offsets.bin")
+        )
+        with open(self._file("terms.data.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        term_offsets.tofile(self._file("term_offsets.bin"))
+
+        meta = {
+            "count": self.count,
+            "terms": len(terms),
+            "postings": total,
+            "terms_end_offset": int(lengths.sum()),
+            "average_length": self._total_length / self.count if self.count else 0.0,
+            "tokenizer": _TOKEN_PATTERN.pattern,
+        }
+        with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        _replace_directory(self._tmp_path, self.path)
+        return meta
+
+    def abort(self) -> None:
+        """Discards the partial index, leaving `path` untouched."""
+        for f in (self._ids, self._doc_lengths, self._runs):
+            f.close()
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+    def _create(self, name: str, dtype, size: int):
+        if size == 0:
+            open(self._file(name), "wb").close()
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="w+", shape=(size,))
+
+
+def write_bm25_index(path: str, ids, texts: list) -> dict:
+    """
+    Atomically replaces the BM25 index at `path`.
+
+    Args:
+        path (str): The index directory.
+        ids: The FAISS id of each text.
+        texts (list): The indexed texts, one per id.
+
+    Returns:
+        dict: The index's meta.json.
+    """
+    writer = BM25Writer(path)
+    writer.add(ids, texts)
+    return writer.close()
+
+
+class BM25Index:
+    """
+    Read-only, memory-mapped view of a BM25 index.
+
+    Args:
+        path (str): The index directory written by `write_bm25_index`.
+        k1 (float): Term frequency saturation.
+        b (float): Document length normalization, from 0 (none) to 1 (full).
+    """
+
+    def __init__(self, path: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.vocabulary_size = meta["terms"]
+        self.average_length = meta["average_length"] or 1.0
+        self._terms_end = meta["terms_end_offset"]
+        self.ids = _memmap(os.path.join(path, "ids.bin"), "int64")
+        self._doc_lengths = _memmap(os.path.join(path, "doc_lengths.bin"), "uint32")
+        self._term_starts = _memmap(os.path.join(path, "terms.offsets.bin"), "int64")
+        self._terms = _memmap(os.path.join(path, "terms.data.bin"), "uint8")
+        self._term_offsets = _memmap(os.path.join(path, "term_offsets.bin"), "int64")
+        self._rows = _memmap(os.path.join(path, "postings_rows.bin"), "int32")
+        self._tf = _memmap(os.path.join(path, "postings_tf.bin"), "uint16")
+
+    def __len__(self):
+        return self.count
+
+    def _term(self, position: int) -> str:
+        start = int(self._term_starts[position])
+        end = (
+            int(self._term_starts[position + 1])
+            if position + 1 < self.vocabulary_size
+            else self._terms_end
+        )
+        return bytes(self._terms[start:end]).decode("utf-8")
+
+    def term_position(self, term: str):
+        """Returns the vocabulary position of `term`, or None if it is not indexed."""
+        lo, hi = 0, self.vocabulary_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.vocabulary_size and self._term(lo) == term:
+            return lo
+        return None
+
+    def scores(self, query: str):
+        """
+        Scores every row containing a query term.
+
+        Returns:
+            tuple: The matching rows (np.ndarray, ascending) and their BM25 scores.
+        """
+        positions = [
+            p for p in (self.term_position(t) for t in set(tokenize(query))) if p is not None
+        ]
+        if not positions:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        starts = np.asarray([self._term_offsets[p] for p in positions])
+        ends = np.asarray([self._term_offsets[p + 1] for p in positions])
+        df = ends - starts
+        idf = np.log1p((self.count - df + 0.5) / (df + 0.5))
+        rows = np.concatenate([self._rows[s:e] for s, e in zip(starts, ends)])
+        tf = np.concatenate([self._tf[s:e] for s, e in zip(starts, ends)]).astype("float32")
+        lengths = self._doc_lengths[rows].astype("float32")
+        weights = np.repeat(idf, df).astype("float32") * (
+            tf * (self.k1 + 1)
+            / (tf + self.k1 * (1 - self.b + self.b * lengths / self.average_length))
+        )
+
+        # Sum the per-term contributions of each row.
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        unique_rows, starts = np.unique(rows, return_index=True)
+        return unique_rows.astype("int64"), np.add.reduceat(weights[order], starts)
+
+    def search(self, query: str, k: int, allowed_ids: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the ids of the k best matching rows, best first.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of results.
+            allowed_ids (np.ndarray, optional): Sorted ids results are restricted to.
+
+        Returns:
+            np.ndarray: Up to k FAISS ids; fewer if fewer rows contain a query term.
+        """
+        rows, scores = self.scores(query)
+        ids = self.ids[rows] if len(rows) else np.empty(0, dtype="int64")
+        if allowed_ids is not None and len(ids):
+            keep = np.isin(ids, allowed_ids, assume_unique=True)
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        return np.asarray(ids[np.argsort(-scores, kind="stable")], dtype="int64")
+
+
+def reciprocal_rank_fusion(
+    rankings: list, weights: list = None, k: int = DEFAULT_RRF_K, limit: int = None
+) -> np.ndarray:
+    """
+    Merges ranked id lists with weighted reciprocal rank fusion.
+
+    Each id scores `sum(weight / (k + rank))` over the rankings it appears in,
+    with ranks starting at 1. Negative ids (FAISS padding) are ignored.
+
+    Args:
+        rankings (list): Arrays of ids, best first.
+        weights (list, optional): One weight per ranking; 1.0 each by default.
+        k (int): The RRF constant.
+        limit (int, optional): The number of fused ids returned.
+
+    Returns:
+        np.ndarray: The fused ids, best first. Ties keep the order of first appearance.
+    """
+    weights = [1.0] * len(rankings) if weights is None else weights
+    ids, contributions = [], []
+    for ranking, weight in zip(rankings, weights):
+        ranking = np.asarray(ranking, dtype="int64")
+        valid = ranking >= 0
+        ids.append(ranking[valid])
+        contributions.append(weight / (k + 1 + np.flatnonzero(valid)))
+    if not ids:
+        return np.empty(0, dtype="int64")
+    ids = np.concatenate(ids)
+    unique, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate(contributions))
+    order = np.lexsort((first, -fused))
+    return unique[order[:limit]]
@@ -0,0 +1,318 @@
+"""
+Content-addressed cache for LLM generations.
+
+Entries are keyed by a hash of model name + system instruction + contents + config and
+live in two tiers: a bounded in-memory LRU and an on-disk SQLite store that survives
+restarts. Both tiers honour a TTL and a maximum size in bytes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _canonical(obj):
+    """Converts a config value into something `json.dumps` can serialise deterministically."""
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    if isinstance(obj, type):
+        # Response schemas are pydantic classes; their JSON schema identifies them.
+        schema = getattr(obj, "model_json_schema", None)
+        return schema() if schema else f"{obj.__module__}.{obj.__qualname__}"
+    if hasattr(obj, "model_dump"):
+        return _canonical(obj.model_dump(exclude_none=True))
+    return repr(obj)
+
+
+def cache_key(model: str, contents, config=None) -> str:
+    """
+    Hashes everything that determines an LLM response.
+
+    Args:
+        model (str): The model name.
+        contents: The request contents.
+        config (dict, optional): The generation config, including any system instruction.
+
+    Returns:
+        str: A hex SHA-256 digest.
+    """
+    config = _canonical(config or {})
+    payload = {
+        "model": model,
+        "system_instruction": config.pop("system_instruction", None),
+        "contents": _canonical(contents),
+        "config": config,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MemoryLRU:
+    """
+    Thread-safe in-memory LRU tier bounded by the total size of its values.
+
+    Args:
+        max_bytes (int): Least recently used entries are evicted beyond this size.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                self.bytes_used -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at: float = None):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes_used -= old[2]
+            self._entries[key] = (value, expires_at, size)
+            self.bytes_used += size
+            while self.bytes_used > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes_used -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+
+class SQLiteCache:
+    """
+    On-disk tier backed by a single SQLite file.
+
+    Eviction removes the least recently accessed entries once the stored values
+    exceed `max_bytes`.
+
+    Args:
+        path (str): The database file.
+        max_bytes (int): The maximum total size of stored values.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str):
+        """Returns `(value, expires_at)` for `key`, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return value, expires_at
+
+    def set(self, key: str, value: str, expires_at: float = None):
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at < ?",
+            (time.time(),),
+        )
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY last_access"
+        ):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    @property
+    def bytes_used(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+class LLMCache:
+    """
+    Two-tier LLM response cache: memory first, then disk.
+
+    Args:
+        memory_max_bytes (int): Size bound of the in-memory LRU tier.
+        disk_path (str, optional): SQLite file for the persistent tier. `None` keeps
+            the cache in memory only.
+        disk_max_bytes (int): Size bound of the SQLite tier.
+        ttl (float, optional): Seconds an entry stays valid. `None` means forever.
+        enabled (bool): When False, every lookup misses and nothing is stored.
+    """
+
+    def __init__(
+        self,
+        memory_max_bytes: int = 64 * 1024 * 1024,
+        disk_path: str = None,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+        ttl: float = None,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.memory = MemoryLRU(memory_max_bytes)
+        self.disk = SQLiteCache(disk_path, disk_max_bytes) if disk_path else None
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """Returns the cached text for `key`, or None."""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            self.memory_hits += 1
+            return value
+        if self.disk is not None:
+            entry = self.disk.get_entry(key)
+            if entry is not None:
+                value, expires_at = entry
+                self.hits += 1
+                self.disk_hits += 1
+                # The entry keeps its original expiry; promotion does not renew it.
+                self.memory.set(key, value, expires_at)
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        """Stores `value` under `key` in both tiers."""
+        if not self.enabled:
+            return
+        expires_at = self._expires_at()
+        self.memory.set(key, value, expires_at)
+        if self.disk is not None:
+            self.disk.set(key, value, expires_at)
+
+    def _expires_at(self):
+        return time.time() + self.ttl if self.ttl else None
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and the size of each tier."""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self.memory.bytes_used,
+            "memory_evictions": self.memory.evictions,
+            "disk_bytes": self.disk.bytes_used if self.disk else 0,
+            "disk_evictions": self.disk.evictions if self.disk else 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "LLMCache":
+        """
+        Builds a cache from environment variables:
+
+        - PROMPTFORGE_CACHE: "0" disables caching (default "1").
+        - PROMPTFORGE_CACHE_PATH: SQLite file, empty for memory only (default "llm_cache.sqlite3").
+        - PROMPTFORGE_CACHE_TTL: Seconds entries stay valid, 0 for no expiry (default 7 days).
+        - PROMPTFORGE_CACHE_MEMORY_MB / PROMPTFORGE_CACHE_DISK_MB: Tier sizes (default 64 / 512).
+        """
+        ttl = float(os.getenv("PROMPTFORGE_CACHE_TTL", 7 * 24 * 3600))
+        cache = cls(
+            memory_max_bytes=int(float(os.getenv("PROMPTFORGE_CACHE_MEMORY_MB", 64)) * 2**20),
+            disk_path=os.getenv("PROMPTFORGE_CACHE_PATH", "llm_cache.sqlite3") or None,
+            disk_max_bytes=int(float(os.getenv("PROMPTFORGE_CACHE_DISK_MB", 512)) * 2**20),
+            ttl=ttl or None,
+            enabled=os.getenv("PROMPTFORGE_CACHE", "1") != "0",
+        )
+        logger.info(f"LLM cache initialized: {cache.stats()}")
+        return cache
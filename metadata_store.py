@@ -0,0 +1,325 @@
+"""
+Compact, memory-mappable column store for knowledge base metadata.
+
+Each string column is kept as one UTF-8 blob plus an int64 offsets array, and the
+FAISS ids as an int64 array, all in flat binary files opened with `np.memmap`.
+Processes that open the same store share its pages through the OS page cache
+instead of each holding a Python list of dicts. Ids are resolved to rows with a
+binary search over a sorted copy of the id column.
+
+Layout of a store directory:
+
+    meta.json             columns, row count and end offset of each column
+    ids.bin               int64 FAISS id per row
+    <column>.offsets.bin  int64 start offset per row
+    <column>.data.bin     concatenated UTF-8 values
+    lookup_ids.bin        ids sorted ascending
+    lookup_rows.bin       row of each sorted id
+    <column>.partition_ids.bin
+                          ids grouped by value of a partition column (domain,
+                          strategy), sorted within each group; the group bounds
+                          are in meta.json
+    prompt_id_order.bin   rows sorted by prompt_id, for prefix filters
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from vector_store import KNOWLEDGE_BASE_FIELDS
+
+# Columns with few distinct values that retrieval can be filtered on.
+PARTITION_COLUMNS = ("domain", "strategy")
+
+
+def _memmap(path: str, dtype) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class MetadataWriter:
+    """
+    Appends rows to a metadata store directory.
+
+    Rows can be added in any number of batches; `close` writes the id lookup
+    and the row count, after which the store can be opened for reading.
+
+    Args:
+        path (str): The store directory. Created if missing.
+        columns (tuple): The string columns to store.
+        append (bool): Keep existing rows instead of starting an empty store.
+    """
+
+    def __init__(
+        self, path: str, columns: tuple = KNOWLEDGE_BASE_FIELDS, append: bool = False
+    ):
+        self.path = path
+        self.columns = tuple(columns)
+        os.makedirs(path, exist_ok=True)
+        mode = "ab" if append else "wb"
+        self.count = 0
+        self._offsets = {}
+        if append and os.path.exists(os.path.join(path, "meta.json")):
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if tuple(meta["columns"]) != self.columns:
+                raise ValueError(f"Store at {path} has columns {meta['columns']}")
+            self.count = meta["count"]
+            for column in self.columns:
+                self._offsets[column] = os.path.getsize(self._file(f"{column}.data.bin"))
+        else:
+            mode = "wb"
+            self._offsets = {column: 0 for column in self.columns}
+
+        self._ids = open(self._file("ids.bin"), mode)
+        self._data = {c: open(self._file(f"{c}.data.bin"), mode) for c in self.columns}
+        self._offset_files = {
+            c: open(self._file(f"{c}.offsets.bin"), mode) for c in self.columns
+        }
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def add(self, ids, rows: list) -> None:
+        """
+        Appends rows.
+
+        Args:
+            ids: The FAISS id of each row.
+            rows (list): Dicts holding every column.
+        """
+        self._ids.write(np.asarray(ids, dtype="int64").tobytes())
+        for column in self.columns:
+            encoded = [str(row[column]).encode("utf-8") for row in rows]
+            lengths = np.fromiter((len(b) for b in encoded), dtype="int64", count=len(rows))
+            starts = self._offsets[column] + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            self._offset_files[column].write(starts.astype("int64").tobytes())
+            self._data[column].write(b"".join(encoded))
+            self._offsets[column] += int(lengths.sum())
+        self.count += len(rows)
+
+    def close(self) -> None:
+        """Finishes the store: writes end offsets, the id lookup and meta.json."""
+        self._ids.close()
+        for column in self.columns:
+            self._data[column].close()
+            self._offset_files[column].close()
+
+        ids = np.fromfile(self._file("ids.bin"), dtype="int64")
+        order = np.argsort(ids, kind="stable")
+        ids[order].tofile(self._file("lookup_ids.bin"))
+        order.astype("int64").tofile(self._file("lookup_rows.bin"))
+
+        partitions = {}
+        for column in PARTITION_COLUMNS:
+            if column not in self.columns:
+                continue
+            codes, inverse = {}, np.empty(self.count, dtype="int64")
+            for start, values in self._iter_column(column):
+                inverse[start : start + len(values)] = [
+                    codes.setdefault(value, len(codes)) for value in values
+                ]
+            labels = sorted(codes)
+            rank = np.empty(len(labels), dtype="int64")
+            rank[[codes[label] for label in labels]] = np.arange(len(labels))
+            inverse = rank[inverse]
+            grouped = np.lexsort((ids, inverse))
+            ids[grouped].tofile(self._file(f"{column}.partition_ids.bin"))
+            bounds = np.searchsorted(inverse[grouped], np.arange(len(labels) + 1))
+            partitions[column] = {
+                str(label): [int(bounds[i]), int(bounds[i + 1])]
+                for i, label in enumerate(labels)
+            }
+        if "prompt_id" in self.columns:
+            # UTF-8 bytes sort in code point order, like the strings themselves.
+            offsets = np.append(
+                np.fromfile(self._file("prompt_id.offsets.bin"), dtype="int64"),
+                self._offsets["prompt_id"],
+            )
+            keys = np.empty(self.count, dtype=f"S{max(int(np.diff(offsets).max(initial=0)), 1)}")
+            for start, values in self._iter_column("prompt_id", decode=False):
+                keys[start : start + len(values)] = values
+            np.argsort(keys, kind="stable").astype("int64").tofile(
+                self._file("prompt_id_order.bin")
+            )
+
+        # The end offsets live in meta.json so the offsets files stay appendable.
+        meta = {
+            "columns": list(self.columns),
+            "count": self.count,
+            "end_offsets": {c: self._offsets[c] for c in self.columns},
+            "partitions": partitions,
+        }
+        with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+    def _iter_column(self, column: str, rows: int = 100_000, decode: bool = True):
+        return _column_chunks(
+            _memmap(self._file(f"{column}.offsets.bin"), "int64"),
+            _memmap(self._file(f"{column}.data.bin"), "uint8"),
+            self._offsets[column],
+            rows,
+            decode,
+        )
+
+
+def _column_chunks(offsets, data, end_offset: int, rows: int, decode: bool = True):
+    """Yields `(first_row, values)` for consecutive chunks of a column."""
+    count = len(offsets)
+    for start in range(0, count, rows):
+        end = min(start + rows, count)
+        bounds = np.append(offsets[start:end], offsets[end] if end < count else end_offset)
+        chunk = bytes(data[bounds[0] : bounds[-1]])
+        bounds = bounds - bounds[0]
+        values = [chunk[bounds[i] : bounds[i + 1]] for i in range(end - start)]
+        yield start, [v.decode("utf-8") for v in values] if decode else values
+
+
+def write_metadata_store(path: str, ids, rows: list) -> None:
+    """
+    Atomically replaces the store at `path` with the given rows.
+
+    Args:
+        path (str): The store directory.
+        ids: The FAISS id of each row.
+        rows (list): Dicts holding every column of `KNOWLEDGE_BASE_FIELDS`.
+    """
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    writer = MetadataWriter(tmp_path)
+    writer.add(ids, rows)
+    writer.close()
+
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+class MetadataStore:
+    """
+    Read-only, memory-mapped view of a metadata store.
+
+    Args:
+        path (str): The store directory written by `MetadataWriter`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.columns = tuple(meta["columns"])
+        self.count = meta["count"]
+        self._end_offsets = meta["end_offsets"]
+        self.ids = _memmap(os.path.join(path, "ids.bin"), "int64")
+        self._lookup_ids = _memmap(os.path.join(path, "lookup_ids.bin"), "int64")
+        self._lookup_rows = _memmap(os.path.join(path, "lookup_rows.bin"), "int64")
+        self._offsets = {
+            c: _memmap(os.path.join(path, f"{c}.offsets.bin"), "int64")
+            for c in self.columns
+        }
+        self._data = {
+            c: _memmap(os.path.join(path, f"{c}.data.bin"), "uint8") for c in self.columns
+        }
+        self.partitions = meta.get("partitions", {})
+        self._partition_ids = {
+            c: _memmap(os.path.join(path, f"{c}.partition_ids.bin"), "int64")
+            for c in self.partitions
+        }
+        order_path = os.path.join(path, "prompt_id_order.bin")
+        self._prompt_id_order = (
+            _memmap(order_path, "int64") if os.path.exists(order_path) else None
+        )
+
+    def __len__(self):
+        return self.count
+
+    def preload(self) -> None:
+        """Reads every page once so later lookups do not fault them in."""
+        for array in (self.ids, self._lookup_ids, self._lookup_rows):
+            int(np.asarray(array).sum())
+        for column in self.columns:
+            int(np.asarray(self._offsets[column]).sum())
+            int(np.asarray(self._data[column]).sum())
+
+    def value(self, column: str, row: int) -> str:
+        """Decodes one cell."""
+        offsets = self._offsets[column]
+        start = int(offsets[row])
+        end = int(offsets[row + 1]) if row + 1 < self.count else self._end_offsets[column]
+        return bytes(self._data[column][start:end]).decode("utf-8")
+
+    def iter_column(self, column: str, rows: int = 100_000):
+        """Yields `(first_row, values)` for consecutive chunks of `rows` cells of a column."""
+        return _column_chunks(
+            self._offsets[column], self._data[column], self._end_offsets[column], rows
+        )
+
+    def row(self, row: int) -> dict:
+        """Returns one row as a dict of every column."""
+        return {column: self.value(column, row) for column in self.columns}
+
+    def row_of(self, faiss_id: int):
+        """Returns the row stored under a FAISS id, or None."""
+        position = int(np.searchsorted(self._lookup_ids, faiss_id))
+        if position < self.count and self._lookup_ids[position] == faiss_id:
+            return int(self._lookup_rows[position])
+        return None
+
+    def get(self, faiss_id: int):
+        """Returns the entry stored under a FAISS id as a dict, or None."""
+        row = self.row_of(faiss_id)
+        return None if row is None else self.row(row)
+
+    def partition_ids(self, column: str, value: str) -> np.ndarray:
+        """
+        Returns the sorted ids of every row whose `column` equals `value`.
+
+        Raises:
+            KeyError: If `column` is not a partition column.
+        """
+        bounds = self.partitions[column].get(value)
+        if bounds is None:
+            return np.empty(0, dtype="int64")
+        return self._partition_ids[column][bounds[0] : bounds[1]]
+
+    def prefix_ids(self, prefix: str) -> np.ndarray:
+        """Returns the sorted ids of every row whose prompt_id starts with `prefix`."""
+        order = self._prompt_id_order
+
+        def first_not_below(target: str) -> int:
+            lo, hi = 0, self.count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.value("prompt_id", int(order[mid])) < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        start = first_not_below(prefix)
+        end = first_not_below(prefix + "\U0010ffff")
+        return np.sort(self.ids[np.asarray(order[start:end])])
+
+    def filter_ids(self, strategy: str = None, domain: str = None, prompt_id_prefix: str = None):
+        """
+        Intersects the precomputed partitions matching the given filters.
+
+        Returns:
+            np.ndarray: The sorted matching ids, or None if no filter was given.
+        """
+        selected = None
+        for column, value in (("strategy", strategy), ("domain", domain)):
+            if value is None:
+                continue
+            ids = self.partition_ids(column, value)
+            selected = ids if selected is None else np.intersect1d(selected, ids, True)
+        if prompt_id_prefix:
+            ids = self.prefix_ids(prompt_id_prefix)
+            selected = ids if selected is None else np.intersect1d(selected, ids, True)
+        return selected
@@ -0,0 +1,320 @@
+"""
+Lightweight in-process metrics for the forge pipeline.
+
+Counters and rolling latency windows are kept per metric name and label set.
+Windows are fixed-size ring buffers, so p50/p95/p99 reflect the most recent
+samples. Metrics are exported in the Prometheus text format (optionally over
+HTTP) and as structured JSON log lines that carry a per-forge correlation ID.
+
+When metrics are disabled, `timer` returns a shared no-op context manager and
+`inc`/`observe` return immediately, so instrumented code pays one attribute check.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+event_logger = logging.getLogger("promptforge.events")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# USD per million tokens for LLM_MODEL; override with PROMPTFORGE_PRICE_INPUT/OUTPUT.
+DEFAULT_INPUT_PRICE = 0.10
+DEFAULT_OUTPUT_PRICE = 0.40
+
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def new_correlation_id() -> str:
+    """Starts a new correlation ID for the current context and returns it."""
+    correlation_id = uuid.uuid4().hex[:16]
+    _correlation_id.set(correlation_id)
+    return correlation_id
+
+
+def get_correlation_id():
+    """Returns the correlation ID of the current context, or None."""
+    return _correlation_id.get()
+
+
+class _Window:
+    """Fixed-size ring buffer of the most recent samples of one series."""
+
+    def __init__(self, size: int):
+        self.values = np.zeros(size, dtype="float64")
+        self.position = 0
+        self.filled = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.values[self.position] = value
+        self.position = (self.position + 1) % len(self.values)
+        self.filled = min(self.filled + 1, len(self.values))
+        self.count += 1
+        self.total += value
+
+    def quantiles(self) -> list:
+        if not self.filled:
+            return [0.0] * len(QUANTILES)
+        return np.quantile(self.values[: self.filled], QUANTILES).tolist()
+
+
+def _series_key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra: dict = None) -> str:
+    pairs = list(labels) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class _Timer:
+    def __init__(self, metrics, name: str, labels: dict):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._started
+        self._metrics.observe(self._name, self.seconds, **self._labels)
+        if exc_type is not None:
+            self._metrics.inc("promptforge_errors_total", **self._labels)
+        return False
+
+
+class Metrics:
+    """
+    Registry of counters and rolling latency windows.
+
+    Args:
+        enabled (bool): Record anything at all.
+        window (int): Samples kept per latency series for the quantiles.
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 1024):
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._windows = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Adds `value` to a counter."""
+        if not self.enabled:
+            return
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Records one sample, e.g. a duration in seconds."""
+        if not self.enabled:
+            return
+        key = _series_key(name, labels)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = _Window(self.window)
+            window.add(value)
+
+    def timer(self, name: str = "promptforge_stage_seconds", **labels):
+        """
+        Times a block and records its duration; an exception also counts an error.
+
+        Returns:
+            A context manager. Its `seconds` attribute holds the duration on exit.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def event(self, event: str, **fields) -> None:
+        """Writes one structured JSON log line tagged with the correlation ID."""
+        if not self.enabled:
+            return
+        record = {
+            "ts": round(time.time(), 3),
+            "event": event,
+            "correlation_id": get_correlation_id(),
+            **fields,
+        }
+        event_logger.info(json.dumps(record, default=str))
+
+    def record_llm_call(
+        self, stage: str, input_tokens: int, output_tokens: int, cached: bool
+    ) -> None:
+        """Counts one LLM call with its tokens and estimated cost."""
+        if not self.enabled:
+            return
+        self.inc("promptforge_llm_calls_total", stage=stage, cached=str(cached).lower())
+        if cached:
+            self.inc("promptforge_cache_hits_total", stage=stage)
+            return
+        self.inc("promptforge_cache_misses_total", stage=stage)
+        self.inc("promptforge_input_tokens_total", input_tokens, stage=stage)
+        self.inc("promptforge_output_tokens_total", output_tokens, stage=stage)
+        cost = (
+            input_tokens * float(os.getenv("PROMPTFORGE_PRICE_INPUT", DEFAULT_INPUT_PRICE))
+            + output_tokens
+            * float(os.getenv("PROMPTFORGE_PRICE_OUTPUT", DEFAULT_OUTPUT_PRICE))
+        ) / 1_000_000
+        self.inc("promptforge_cost_usd_total", cost, stage=stage)
+
+    def reset(self) -> None:
+        """Drops every recorded series."""
+        with self._lock:
+            self._counters.clear()
+            self._windows.clear()
+
+    def snapshot(self) -> dict:
+        """Returns counters and latency quantiles as plain dicts."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            latencies = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": window.count,
+                    "sum": window.total,
+                    **{f"p{int(q * 100)}": v for q, v in zip(QUANTILES, window.quantiles())},
+                }
+                for (name, labels), window in sorted(self._windows.items())
+            ]
+        return {"counters": counters, "latencies": latencies}
+
+    def to_prometheus(self) -> str:
+        """Renders every series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), window in sorted(self._windows.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} summary")
+                    typed.add(name)
+                for q, v in zip(QUANTILES, window.quantiles()):
+                    lines.append(f"{name}{_format_labels(labels, {'quantile': q})} {v:.6f}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {window.total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {window.count}")
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a registry from PROMPTFORGE_METRICS ("1" by default, "0" disables
+        it) and PROMPTFORGE_METRICS_WINDOW (default 1024 samples). If
+        PROMPTFORGE_METRICS_LOG is set, JSON event lines are written to that file
+        instead of the regular log.
+        """
+        metrics = cls(
+            enabled=os.getenv("PROMPTFORGE_METRICS", "1") == "1",
+            window=int(os.getenv("PROMPTFORGE_METRICS_WINDOW", 1024)),
+        )
+        path = os.getenv("PROMPTFORGE_METRICS_LOG")
+        if metrics.enabled and path and not event_logger.handlers:
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            event_logger.addHandler(handler)
+            event_logger.setLevel(logging.INFO)
+            event_logger.propagate = False
+        return metrics
+
+
+_METRICS_LOCK = threading.Lock()
+_metrics = None
+_server = None
+
+
+def get_metrics() -> Metrics:
+    """Returns the shared registry, configured from the environment on first use."""
+    global _metrics
+    if _metrics is None:
+        with _METRICS_LOCK:
+            if _metrics is None:
+                _metrics = Metrics.from_env()
+    return _metrics
+
+
+def set_metrics(metrics: Metrics) -> None:
+    """Replaces the shared registry, e.g. with `Metrics(enabled=False)`."""
+    global _metrics
+    with _METRICS_LOCK:
+        _metrics = metrics
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics":
+            body = get_metrics().to_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split("?")[0] == "/metrics.json":
+            body = json.dumps(get_metrics().snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = None, host: str = None):
+    """
+    Serves /metrics (Prometheus text) and /metrics.json from a daemon thread.
+
+    Args:
+        port (int, optional): Defaults to PROMPTFORGE_METRICS_PORT. Nothing is
+            started without a port, or if the server is already running.
+        host (str, optional): The address to bind, from PROMPTFORGE_METRICS_HOST
+            by default: 127.0.0.1, so that only local scrapers can read the
+            metrics. Set it to 0.0.0.0 to expose them on every interface.
+
+    Returns:
+        ThreadingHTTPServer: The server, or None.
+    """
+    global _server
+    port = port or int(os.getenv("PROMPTFORGE_METRICS_PORT", 0))
+    if not port:
+        return None
+    host = host or os.getenv("PROMPTFORGE_METRICS_HOST", "127.0.0.1")
+    with _METRICS_LOCK:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(
+                target=_server.serve_forever, name="metrics-server", daemon=True
+            ).start()
+            logger.info(f"Serving metrics on {host}:{port}/metrics")
+    return _server
@@ -0,0 +1,315 @@
+"""
+ONNX Runtime backend for the sentence embedding model.
+
+`export_model` converts the SentenceTransformer's transformer to ONNX once,
+optionally with int8 dynamic quantization, and records how closely the exported
+embeddings agree with PyTorch's. `OnnxEmbedder` loads an export and provides the
+parts of the SentenceTransformer interface the engine and the index builder use
+(`encode` and `get_sentence_embedding_dimension`), without importing torch.
+
+Export with:
+    python onnx_embedder.py --model all-MiniLM-L6-v2 --quantize
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = "onnx_models"
+CONFIG_FILE = "embedder.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Agreement with the PyTorch embeddings is measured on this many knowledge base prompts.
+AGREEMENT_SAMPLE_SIZE = 64
+
+
+def default_model_dir(model_name: str) -> str:
+    return os.path.join(EXPORT_DIR, model_name.replace("/", "__"))
+
+
+def read_export_config(model_dir: str):
+    """Returns the export's embedder.json as a dict, or None if there is none."""
+    path = os.path.join(model_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def backend_from_env() -> str:
+    """
+    Returns the configured embedding backend: "torch" (the default), "onnx" or
+    "onnx-int8", from PROMPTFORGE_EMBEDDING_BACKEND and PROMPTFORGE_ONNX_QUANTIZE.
+    """
+    backend = os.getenv("PROMPTFORGE_EMBEDDING_BACKEND", "torch")
+    if backend == "onnx" and os.getenv("PROMPTFORGE_ONNX_QUANTIZE", "0") == "1":
+        return "onnx-int8"
+    return backend
+
+
+def embedding_agreement(model_name: str, backend_a: str, backend_b: str):
+    """
+    Returns the minimum cosine similarity recorded at export time between the
+    embeddings of two backends, 1.0 if they are the same backend, or None if
+    unknown. Agreement is measured against PyTorch, so for two ONNX variants the
+    lower of their two agreements is returned.
+    """
+    if backend_a == backend_b:
+        return 1.0
+    config = read_export_config(
+        os.getenv("PROMPTFORGE_ONNX_DIR") or default_model_dir(model_name)
+    )
+    if config is None:
+        return None
+    agreement = config.get("agreement", {})
+    values = [agreement.get(b) for b in (backend_a, backend_b) if b != "torch"]
+    if any(v is None for v in values):
+        return None
+    return min(values)
+
+
+class OnnxEmbedder:
+    """
+    Sentence embeddings from an ONNX export, computed with ONNX Runtime on the CPU.
+
+    Tokenization, mean pooling and normalization follow the SentenceTransformer
+    pipeline the model was exported from, so with the full-precision model the
+    vectors match PyTorch's to float rounding.
+
+    Args:
+        model_dir (str): The directory written by `export_model`.
+        quantized (bool): Load the int8 model instead of the float32 one.
+        threads (int, optional): Intra-op threads; ONNX Runtime picks one per
+            physical core when None.
+
+    Raises:
+        FileNotFoundError: If the directory holds no export (or no int8 model when
+            `quantized` is set).
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.config = read_export_config(model_dir)
+        if self.config is None:
+            raise FileNotFoundError(
+                f"No ONNX export in {model_dir}; run `python onnx_embedder.py` first."
+            )
+        path = os.path.join(model_dir, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"{path} not found; export with `python onnx_embedder.py"
+                f"{' --quantize' if quantized else ''}`."
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(
+            pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"]
+        )
+
+        self.model_name = self.config["model"]
+        self.backend = "onnx-int8" if quantized else "onnx"
+        self.agreement = self.config.get("agreement", {}).get(self.backend)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def _encode_batch(self, sentences: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(sentences)
+        input_ids = np.array([e.ids for e in encodings], dtype="int64")
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype="int64")
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean over the real tokens, as the SentenceTransformer Pooling module does.
+        mask = attention_mask[..., None].astype("float32")
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(
+        self,
+        sentences,
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        Encodes sentences like `SentenceTransformer.encode`.
+
+        Args:
+            sentences (str | list): One sentence or a list of them.
+            batch_size (int): Sentences per ONNX Runtime call.
+            normalize_embeddings (bool): Scale every vector to unit length. Models
+                exported with a Normalize module are always normalized.
+            **kwargs: Accepted for compatibility (e.g. `convert_to_tensor`) and ignored.
+
+        Returns:
+            np.ndarray: float32 embeddings, one row per sentence (a single row for a str).
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(sentences), self.config["dimension"]), dtype="float32")
+        # Batching sentences of similar length keeps padding small.
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            positions = order[start : start + batch_size]
+            embeddings[positions] = self._encode_batch([sentences[i] for i in positions])
+        if normalize_embeddings or self.config.get("normalize"):
+            embeddings /= np.clip(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+            )
+        return embeddings[0] if single else embeddings
+
+    @classmethod
+    def from_env(cls, model_name: str, quantized: bool = None):
+        """
+        Loads the export of `model_name` from PROMPTFORGE_ONNX_DIR (default
+        onnx_models/<model_name>), the int8 model if `quantized` is set or, when it
+        is None, if PROMPTFORGE_ONNX_QUANTIZE is "1", with PROMPTFORGE_ONNX_THREADS
+        intra-op threads (default: ONNX Runtime's choice).
+
+        Raises:
+            ValueError: If the export was made from a different model.
+        """
+        embedder = cls(
+            os.getenv("PROMPTFORGE_ONNX_DIR") or default_model_dir(model_name),
+            quantized=(
+                os.getenv("PROMPTFORGE_ONNX_QUANTIZE", "0") == "1"
+                if quantized is None
+                else quantized
+            ),
+            threads=int(os.getenv("PROMPTFORGE_ONNX_THREADS", 0)) or None,
+        )
+        if embedder.model_name != model_name:
+            raise ValueError(
+                f"ONNX export is of {embedder.model_name}, but {model_name} is configured."
+            )
+        return embedder
+
+
+def export_model(
+    model_name: str, output_dir: str = None, quantize: bool = False, opset: int = 14
+) -> dict:
+    """
+    Exports a SentenceTransformer's transformer to ONNX and measures its agreement.
+
+    Requires torch and sentence-transformers; loading the export does not.
+
+    Args:
+        model_name (str): The SentenceTransformer model, e.g. "all-MiniLM-L6-v2".
+        output_dir (str, optional): Defaults to onnx_models/<model_name>.
+        quantize (bool): Also write an int8 dynamically quantized model.
+        opset (int): The ONNX opset version.
+
+    Returns:
+        dict: The written embedder.json, including the minimum cosine similarity
+            to the PyTorch embeddings per exported backend under "agreement".
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    from knowledge_base import KNOWLEDGE_BASE
+
+    output_dir = output_dir or default_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+
+    sample = tokenizer(["An example sentence."], return_tensors="pt")
+    input_names = [
+        name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample
+    ]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs)))[0]
+
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(),
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: dynamic for name in input_names + ["last_hidden_state"]},
+            opset_version=opset,
+        )
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(
+            model_path,
+            os.path.join(output_dir, QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+
+    config = {
+        "model": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "normalize": any(type(m).__name__ == "Normalize" for m in model),
+        "quantized": quantize,
+        "opset": opset,
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    sentences = [entry["prompt_text"] for entry in KNOWLEDGE_BASE[:AGREEMENT_SAMPLE_SIZE]]
+    reference = model.encode(sentences, normalize_embeddings=True)
+    config["agreement"] = {}
+    for quantized in (False, True) if quantize else (False,):
+        embedder = OnnxEmbedder(output_dir, quantized=quantized)
+        embeddings = embedder.encode(sentences, normalize_embeddings=True)
+        config["agreement"][embedder.backend] = float(
+            np.min(np.sum(embeddings * reference, axis=1))
+        )
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX.")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--output", help="Defaults to onnx_models/<model>.")
+    parser.add_argument(
+        "--quantize", action="store_true", help="Also write an int8 quantized model."
+    )
+    args = parser.parse_args()
+
+    config = export_model(args.model, args.output, quantize=args.quantize)
+    for backend, agreement in config["agreement"].items():
+        print(f"{backend}: minimum cosine similarity to PyTorch {agreement:.5f}")
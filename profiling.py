@@ -0,0 +1,380 @@
+"""
+Opt-in CPU profiling of forges, tournaments and batch runs.
+
+With PROMPTFORGE_PROFILE set (or `profile=True` passed by a caller, e.g. the
+`profile` flag of the API requests), each forge runs under a profiler and its
+profile is written to PROMPTFORGE_PROFILE_DIR, named after the forge's
+correlation ID:
+
+* `sample` (the default) samples the stacks of every thread every
+  PROMPTFORGE_PROFILE_INTERVAL_MS milliseconds. It sees the embedding and FAISS
+  work that runs in worker threads, and writes a collapsed-stack file (one
+  `thread;outer;...;inner count` line per stack, the input of flamegraph.pl and
+  speedscope) and a pstats file estimated from the samples.
+* `cprofile` traces every call of the calling thread with `cProfile` and writes
+  an exact pstats file. Work handed to other threads shows up only as waiting.
+
+Threads blocked in a wait (an idle event loop, an idle thread pool worker) are
+not sampled unless PROMPTFORGE_PROFILE_IDLE=1. Only one profile runs at a time:
+a forge that starts while another profile is running (e.g. inside a profiled
+batch) is not profiled on its own, its work is part of the running profile.
+
+When profiling is off, `profile` returns a shared no-op context manager after
+one environment lookup.
+
+`python profiling.py profiles/` aggregates the pstats files of a run into the
+hottest functions, and can merge their collapsed stacks into one flame graph.
+"""
+
+import collections
+import contextlib
+import cProfile
+import glob
+import json
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ("sample", "cprofile")
+
+# Leaf frames (file name, function) of threads that are waiting, not running.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# Built-ins in which cProfile sees the event loop wait for I/O.
+IDLE_BUILTINS = {
+    "<method 'poll' of 'select.epoll' objects>",
+    "<method 'control' of 'select.kqueue' objects>",
+    "<built-in method select.select>",
+}
+
+_NULL_PROFILE = contextlib.nullcontext()
+_ACTIVE = threading.Lock()
+
+
+def _settings() -> tuple:
+    """
+    Returns the (profiler, directory, sampling interval in seconds, keep idle
+    samples) configured by PROMPTFORGE_PROFILE, PROMPTFORGE_PROFILE_DIR,
+    PROMPTFORGE_PROFILE_INTERVAL_MS and PROMPTFORGE_PROFILE_IDLE.
+
+    Raises:
+        ValueError: If PROMPTFORGE_PROFILE names an unknown profiler.
+    """
+    profiler = os.getenv("PROMPTFORGE_PROFILE", "")
+    if profiler in ("", "0"):
+        profiler = None
+    elif profiler == "1":
+        profiler = "sample"
+    elif profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{profiler}'; expected one of {PROFILERS}.")
+    return (
+        profiler,
+        os.getenv("PROMPTFORGE_PROFILE_DIR", "profiles"),
+        max(float(os.getenv("PROMPTFORGE_PROFILE_INTERVAL_MS", 5)), 0.1) / 1000,
+        os.getenv("PROMPTFORGE_PROFILE_IDLE", "0") == "1",
+    )
+
+
+def profile(tag: str, enabled: bool = None):
+    """
+    Profiles the block it wraps, if profiling is on.
+
+    Args:
+        tag (str): Names the profile files, e.g. "forge-<correlation ID>".
+        enabled (bool, optional): True profiles with the configured profiler (or
+            `sample`) even if PROMPTFORGE_PROFILE is unset, False never profiles;
+            by default PROMPTFORGE_PROFILE decides.
+
+    Returns:
+        A context manager. When profiling, it enters as a `Profile` whose `paths`
+        list the written files once the block exits; otherwise as None.
+    """
+    if enabled is False:
+        return _NULL_PROFILE
+    if enabled is None and os.getenv("PROMPTFORGE_PROFILE", "") in ("", "0"):
+        return _NULL_PROFILE
+    profiler, directory, interval, keep_idle = _settings()
+    return Profile(tag, profiler or "sample", directory, interval, keep_idle)
+
+
+class _Sampler(threading.Thread):
+    """Counts the stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, interval: float, keep_idle: bool):
+        super().__init__(name="promptforge-profiler", daemon=True)
+        self.interval = interval
+        self.keep_idle = keep_idle
+        self.counts = collections.Counter()
+        self.ticks = 0
+        self.seconds = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._done.wait(self.interval):
+            now = time.perf_counter()
+            self.seconds += now - last
+            self.ticks += 1
+            last = now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                leaf = (os.path.basename(stack[0][0]), stack[0][2])
+                if not self.keep_idle and leaf in IDLE_FRAMES:
+                    continue
+                stack.reverse()
+                self.counts[(names.get(ident, str(ident)), tuple(stack))] += 1
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+def _label(function: tuple) -> str:
+    filename, line, name = function
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _sample_stats(counts: collections.Counter, seconds_per_sample: float) -> dict:
+    """
+    Estimates pstats entries from sampled stacks.
+
+    A function's own time is its samples as the innermost frame, its cumulative
+    time its samples anywhere on the stack; call counts are sample counts.
+    """
+    entries = {}
+    for (_, stack), count in counts.items():
+        elapsed = count * seconds_per_sample
+        seen = set()
+        for depth, function in enumerate(stack):
+            leaf = depth == len(stack) - 1
+            entry = entries.setdefault(function, [0, 0, 0.0, 0.0, {}])
+            if function not in seen:
+                seen.add(function)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += elapsed
+            if leaf:
+                entry[2] += elapsed
+            if depth:
+                edge = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                edge[0] += count
+                edge[1] += count
+                edge[2] += elapsed if leaf else 0.0
+                edge[3] += elapsed
+    return {
+        function: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+        for function, (cc, nc, tt, ct, callers) in entries.items()
+    }
+
+
+class Profile:
+    """
+    Profiles a block with `cProfile` or the stack sampler; see the module docstring.
+
+    Args:
+        tag (str): Names the profile files.
+        profiler (str): One of `PROFILERS`.
+        directory (str): Where the files are written.
+        interval (float): Seconds between stack samples.
+        keep_idle (bool): Also count the stacks of waiting threads.
+    """
+
+    def __init__(
+        self, tag: str, profiler: str, directory: str, interval: float, keep_idle: bool
+    ):
+        self.tag = tag
+        self.profiler = profiler
+        self.directory = directory
+        self.interval = interval
+        self.keep_idle = keep_idle
+        self.paths = []
+        self._running = None
+        self._started = None
+
+    def __enter__(self):
+        if not _ACTIVE.acquire(blocking=False):
+            logger.debug(f"A profile is already running; not profiling {self.tag}.")
+            return self
+        if self.profiler == "cprofile":
+            self._running = cProfile.Profile()
+            self._running.enable()
+        else:
+            self._running = _Sampler(self.interval, self.keep_idle)
+            self._running.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._running is None:
+            return False
+        try:
+            elapsed = time.perf_counter() - self._started
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, self.tag)
+            if self.profiler == "cprofile":
+                self._running.disable()
+                self._running.dump_stats(f"{base}.pstats")
+                self.paths = [f"{base}.pstats"]
+            else:
+                self._running.stop()
+                self._write_samples(base)
+        except OSError as e:
+            logger.error(f"Could not write the profile of {self.tag}: {e}")
+        else:
+            metrics = get_metrics()
+            metrics.inc("promptforge_profiles_total", profiler=self.profiler)
+            metrics.event(
+                "profile",
+                tag=self.tag,
+                profiler=self.profiler,
+                seconds=round(elapsed, 4),
+                paths=self.paths,
+            )
+            logger.info(f"Profile of {self.tag} ({elapsed:.3f}s) written to {self.paths}")
+        finally:
+            self._running = None
+            _ACTIVE.release()
+        return False
+
+    def _write_samples(self, base: str) -> None:
+        sampler = self._running
+        seconds_per_sample = sampler.seconds / sampler.ticks if sampler.ticks else 0.0
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+            for (thread, stack), count in sorted(sampler.counts.items()):
+                frames = ";".join([thread] + [_label(function) for function in stack])
+                f.write(f"{frames} {count}\n")
+        with open(f"{base}.pstats", "wb") as f:
+            marshal.dump(_sample_stats(sampler.counts, seconds_per_sample), f)
+        self.paths = [f"{base}.collapsed", f"{base}.pstats"]
+
+
+def _profile_files(paths: list, suffix: str) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, f"*{suffix}"))))
+        elif path.endswith(suffix):
+            files.append(path)
+    return files
+
+
+def hot_functions(paths: list, top: int = 25, sort: str = "tottime") -> list:
+    """
+    Aggregates pstats files into the functions that took the most time.
+
+    Time `cProfile` saw the event loop spend waiting for I/O is left out.
+
+    Args:
+        paths (list): pstats files, or directories of them.
+        top (int): The number of functions returned.
+        sort (str): "tottime" (time in the function itself) or "cumtime" (also
+            in the functions it called).
+
+    Returns:
+        list: Dicts with function, calls, tottime, cumtime and share (of the
+            summed own time of all functions), hottest first.
+    """
+    stats = None
+    for path in _profile_files(paths, ".pstats"):
+        with open(path, "rb") as f:
+            if not marshal.load(f):
+                # Every sample of the profile was an idle wait.
+                continue
+        if stats is None:
+            stats = pstats.Stats(path)
+        else:
+            stats.add(path)
+    if stats is None:
+        return []
+    stats = {
+        function: entry
+        for function, entry in stats.stats.items()
+        if function[2] not in IDLE_BUILTINS
+    }
+    total = sum(entry[2] for entry in stats.values()) or 1.0
+    key = 2 if sort == "tottime" else 3
+    hottest = sorted(stats.items(), key=lambda item: item[1][key], reverse=True)[:top]
+    return [
+        {
+            "function": _label(function),
+            "file": function[0],
+            "calls": nc,
+            "tottime": tt,
+            "cumtime": ct,
+            "share": tt / total,
+        }
+        for function, (cc, nc, tt, ct, callers) in hottest
+    ]
+
+
+def merge_collapsed(paths: list, output: str) -> int:
+    """Sums the collapsed stacks of many profiles into one file; returns the stack count."""
+    counts = collections.Counter()
+    for path in _profile_files(paths, ".collapsed"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                counts[stack] += int(count)
+    with open(output, "w", encoding="utf-8") as f:
+        for stack, count in sorted(counts.items()):
+            f.write(f"{stack} {count}\n")
+    return len(counts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Aggregate forge profiles into the hottest functions."
+    )
+    parser.add_argument(
+        "paths", nargs="*", default=["profiles"], help="Profile files or directories."
+    )
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--sort", choices=("tottime", "cumtime"), default="tottime")
+    parser.add_argument(
+        "--collapsed", help="Also merge the collapsed stacks into this file, for a flame graph."
+    )
+    parser.add_argument("--json", help="Also write the table to this JSON file.")
+    args = parser.parse_args()
+
+    profiles = len(_profile_files(args.paths, ".pstats"))
+    rows = hot_functions(args.paths, args.top, args.sort)
+    if not rows:
+        raise SystemExit(f"No .pstats files found in {args.paths}.")
+
+    print(f"{profiles} profiles, top {len(rows)} functions by {args.sort}")
+    print(f"{'share':>6} {'tottime':>9} {'cumtime':>9} {'calls':>9}  function")
+    for row in rows:
+        print(
+            f"{row['share']:>6.1%} {row['tottime']:>9.3f} {row['cumtime']:>9.3f} "
+            f"{row['calls']:>9}  {row['function']}"
+        )
+    if args.collapsed:
+        stacks = merge_collapsed(args.paths, args.collapsed)
+        print(f"Merged {stacks} distinct stacks into {args.collapsed}.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,471 @@
+"""
+Fault-tolerant wrapper around the Gemini client.
+
+`ResilientClient` exposes the same `models` / `aio.models` surface the engine
+uses (`generate_content` and `generate_content_stream`) and adds, per call:
+
+* a timeout per attempt (for streams, the time to the first chunk). Sync
+  attempts run on a bounded pool of worker threads, which a timed-out call keeps
+  busy until the backend answers; once every worker is taken, calls fail fast
+  with `WorkersExhaustedError` instead of queueing;
+* retries of transient errors with exponential backoff and full jitter;
+* optional hedging: if an attempt is slower than the recent p95 latency, a
+  duplicate request is sent and whichever finishes first wins;
+* a circuit breaker that fails fast while the backend keeps failing, then lets a
+  single trial call through after a cool-down.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying: timeouts, rate limits and server errors.
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Errors raised when the backend could not be reached or did not answer in time.
+# google-genai sends requests with httpx, whose connection failures and timeouts
+# derive from `httpx.TransportError` rather than the builtin exceptions.
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError)
+try:
+    import httpx
+
+    TRANSIENT_ERRORS += (httpx.TransportError,)
+except ImportError:
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the backend while the circuit breaker is open."""
+
+
+class WorkersExhaustedError(TimeoutError):
+    """
+    Raised instead of starting a sync attempt while every worker thread is still
+    waiting on an earlier call, which happens when the backend hangs.
+    """
+
+
+def _status_code(error: BaseException):
+    return getattr(error, "code", None) or getattr(error, "status_code", None)
+
+
+def _is_genai_server_error(error: BaseException) -> bool:
+    # Matched by name so that google-genai is not imported just to classify errors.
+    return any(
+        cls.__name__ == "ServerError" and cls.__module__ == "google.genai.errors"
+        for cls in type(error).__mro__
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Returns True for timeouts, connection errors (builtin or httpx), google-genai
+    server errors and retryable API status codes.
+    """
+    if isinstance(error, TRANSIENT_ERRORS) or _is_genai_server_error(error):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. After that one trial call is let through: success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with a trial
+                call already in flight.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("LLM backend circuit is open")
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                raise CircuitOpenError("LLM backend circuit is half-open")
+            self._trial_in_flight = True
+
+    def release(self) -> None:
+        """Ends a trial call that neither succeeded nor failed, e.g. a cancelled one."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("LLM backend recovered, closing the circuit.")
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or (
+                self.state == "closed" and self._failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                get_metrics().inc("promptforge_circuit_opened_total")
+                logger.warning(
+                    f"LLM backend failed {self._failures} times, opening the circuit "
+                    f"for {self.reset_timeout:g}s."
+                )
+
+
+class _LatencyTracker:
+    """Recent successful call latencies, used to derive the hedging delay."""
+
+    def __init__(self, size: int = 256, min_samples: int = 20):
+        self._samples = deque(maxlen=size)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            return float(np.quantile(np.fromiter(self._samples, dtype="float64"), 0.95))
+
+
+class ResilientClient:
+    """
+    Wraps a Gemini client (or `fake_llm.FakeGeminiClient`) with timeouts, retries,
+    hedging and a circuit breaker.
+
+    Args:
+        client: The wrapped client.
+        timeout (float): Seconds per attempt; 0 disables the timeout.
+        max_attempts (int): Attempts per call, including the first.
+        backoff_base (float): Upper bound of the first retry delay in seconds;
+            doubles with every retry.
+        backoff_max (float): Cap on the retry delay.
+        hedge (bool): Send a duplicate request when an attempt exceeds the p95
+            latency of recent calls. Streams are never hedged.
+        min_hedge_delay (float): Lower bound of the hedging delay.
+        breaker (CircuitBreaker, optional): Defaults to a breaker with default settings.
+        max_workers (int): Threads running sync attempts, and so the most sync
+            attempts in flight, including timed-out ones the backend has not
+            answered yet.
+    """
+
+    def __init__(
+        self,
+        client,
+        timeout: float = 30.0,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge: bool = False,
+        min_hedge_delay: float = 0.05,
+        breaker: CircuitBreaker = None,
+        max_workers: int = 16,
+    ):
+        self.client = client
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = _LatencyTracker()
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm-call"
+        )
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self.models = _ResilientModels(self)
+        self.aio = _ResilientAio(self)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: spreads retries of many clients over the whole window.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _hedge_delay(self, hedge: bool):
+        if not (self.hedge and hedge):
+            return None
+        p95 = self.latencies.p95()
+        return None if p95 is None else max(p95, self.min_hedge_delay)
+
+    def _should_retry(self, error: BaseException, attempt: int, label: str) -> bool:
+        metrics = get_metrics()
+        if not is_retryable(error):
+            if _status_code(error) is not None:
+                # The backend answered, e.g. with a 400; it is not down.
+                self.breaker.record_success()
+            else:
+                # Nothing says whether the backend was reached; leave the breaker be.
+                self.breaker.release()
+            metrics.inc("promptforge_llm_failures_total", reason="fatal")
+            return False
+        self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            metrics.inc("promptforge_llm_failures_total", reason="retries_exhausted")
+            return False
+        metrics.inc("promptforge_llm_retries_total")
+        logger.warning(
+            f"{label} attempt {attempt + 1}/{self.max_attempts} failed "
+            f"({type(error).__name__}: {error}), retrying."
+        )
+        return True
+
+    # --- Sync ---
+
+    def _submit(self, fn, kwargs):
+        """
+        Starts `fn` on a worker thread.
+
+        Raises:
+            WorkersExhaustedError: If every worker is busy; a call queued behind
+                them would time out without reaching the backend.
+        """
+        with self._in_flight_lock:
+            if self._in_flight >= self.max_workers:
+                get_metrics().inc("promptforge_llm_failures_total", reason="workers_exhausted")
+                raise WorkersExhaustedError(
+                    f"All {self.max_workers} LLM worker threads are busy with "
+                    "unanswered calls."
+                )
+            self._in_flight += 1
+        started = time.perf_counter()
+        future = self._executor.submit(fn, **kwargs)
+        future.started = started
+        future.add_done_callback(self._release_worker)
+        return future
+
+    def _release_worker(self, _future) -> None:
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _attempt(self, fn, kwargs, hedge: bool):
+        delay = self._hedge_delay(hedge)
+        timeout = self.timeout or None
+        if delay is None and timeout is None:
+            started = time.perf_counter()
+            result = fn(**kwargs)
+            self.latencies.add(time.perf_counter() - started)
+            return result
+
+        futures = [self._submit(fn, kwargs)]
+        deadline = time.perf_counter() + timeout if timeout else None
+        if delay is not None:
+            done, _ = concurrent.futures.wait(futures, timeout=delay)
+            if not done:
+                try:
+                    futures.append(self._submit(fn, kwargs))
+                    get_metrics().inc("promptforge_llm_hedges_total")
+                except WorkersExhaustedError:
+                    pass  # No worker to hedge on; keep waiting for the first attempt.
+
+        error = None
+        pending = set(futures)
+        while pending:
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self.latencies.add(time.perf_counter() - future.started)
+                    return future.result()
+                error = future.exception()
+        if pending:
+            # The worker threads cannot be interrupted; their results are dropped,
+            # and they count against `max_workers` until the backend answers.
+            for future in pending:
+                future.cancel()
+            raise TimeoutError(f"LLM call timed out after {self.timeout}s")
+        raise error
+
+    def _call(self, fn, kwargs, hedge: bool = True, label: str = "LLM call"):
+        for attempt in range(self.max_attempts):
+            self.breaker.allow()
+            try:
+                result = self._attempt(fn, kwargs, hedge)
+            except Exception as e:
+                if not self._should_retry(e, attempt, label):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    # --- Async ---
+
+    async def _timed(self, fn, kwargs):
+        started = time.perf_counter()
+        if self.timeout:
+            try:
+                result = await asyncio.wait_for(fn(**kwargs), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"LLM call timed out after {self.timeout}s") from None
+        else:
+            result = await fn(**kwargs)
+        self.latencies.add(time.perf_counter() - started)
+        return result
+
+    async def _attempt_async(self, fn, kwargs, hedge: bool):
+        delay = self._hedge_delay(hedge)
+        if delay is None:
+            return await self._timed(fn, kwargs)
+
+        tasks = [asyncio.ensure_future(self._timed(fn, kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                get_metrics().inc("promptforge_llm_hedges_total")
+                tasks.append(asyncio.ensure_future(self._timed(fn, kwargs)))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call_async(self, fn, kwargs, hedge: bool = True, label: str = "LLM call"):
+        for attempt in range(self.max_attempts):
+            self.breaker.allow()
+            try:
+                result = await self._attempt_async(fn, kwargs, hedge)
+            except Exception as e:
+                if not self._should_retry(e, attempt, label):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    @classmethod
+    def from_env(cls, client):
+        """
+        Wraps `client` using PROMPTFORGE_LLM_TIMEOUT (default 30s),
+        PROMPTFORGE_LLM_ATTEMPTS (default 3), PROMPTFORGE_LLM_HEDGE ("0" by default),
+        PROMPTFORGE_BREAKER_THRESHOLD (default 5) and PROMPTFORGE_BREAKER_RESET
+        (default 30s).
+        """
+        return cls(
+            client,
+            timeout=float(os.getenv("PROMPTFORGE_LLM_TIMEOUT", 30)),
+            max_attempts=int(os.getenv("PROMPTFORGE_LLM_ATTEMPTS", 3)),
+            hedge=os.getenv("PROMPTFORGE_LLM_HEDGE", "0") == "1",
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("PROMPTFORGE_BREAKER_THRESHOLD", 5)),
+                reset_timeout=float(os.getenv("PROMPTFORGE_BREAKER_RESET", 30)),
+            ),
+        )
+
+
+class _ResilientModels:
+    def __init__(self, owner: ResilientClient):
+        self._owner = owner
+
+    def generate_content(self, **kwargs):
+        return self._owner._call(
+            self._owner.client.models.generate_content, kwargs, label="generate_content"
+        )
+
+    def generate_content_stream(self, **kwargs):
+        def start(**kwargs):
+            # Errors and slowness surface on the first chunk; retry up to there.
+            chunks = iter(self._owner.client.models.generate_content_stream(**kwargs))
+            return next(chunks, None), chunks
+
+        first, chunks = self._owner._call(
+            start, kwargs, hedge=False, label="generate_content_stream"
+        )
+        if first is not None:
+            yield first
+            yield from chunks
+
+
+class _ResilientAsyncModels:
+    def __init__(self, owner: ResilientClient):
+        self._owner = owner
+
+    async def generate_content(self, **kwargs):
+        return await self._owner._call_async(
+            self._owner.client.aio.models.generate_content,
+            kwargs,
+            label="generate_content",
+        )
+
+    async def generate_content_stream(self, **kwargs):
+        async def start(**kwargs):
+            # Errors and slowness surface on the first chunk; retry up to there.
+            stream = await self._owner.client.aio.models.generate_content_stream(**kwargs)
+            chunks = stream.__aiter__()
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, chunks
+
+        first, chunks = await self._owner._call_async(
+            start, kwargs, hedge=False, label="generate_content_stream"
+        )
+
+        async def stream():
+            if first is None:
+                return
+            yield first
+            async for chunk in chunks:
+                yield chunk
+
+        return stream()
+
+
+class _ResilientAio:
+    def __init__(self, owner: ResilientClient):
+        self.models = _ResilientAsyncModels(owner)
@@ -0,0 +1,162 @@
+"""
+Semantic cache for whole forge results.
+
+Past results are stored with the embedding of their user prompt in one FAISS
+inner-product index per strategy. A new prompt whose normalized embedding has a
+cosine similarity at or above the threshold with a stored prompt of the same
+strategy gets that stored result back, skipping all four LLM calls.
+"""
+
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper edges of the similarity histogram buckets reported by `stats()`.
+SIMILARITY_BUCKETS = (0.5, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 1.0)
+
+
+class SemanticCache:
+    """
+    Bounded, strategy-aware cache of forge results keyed by prompt embeddings.
+
+    Args:
+        threshold (float): Minimum cosine similarity for a hit.
+        capacity (int): Maximum number of stored results; the least recently used
+            result is evicted beyond it.
+    """
+
+    def __init__(self, threshold: float = 0.92, capacity: int = 10000):
+        self.threshold = threshold
+        self.capacity = capacity
+        self._indexes = {}  # strategy -> faiss.IndexIDMap
+        self._entries = OrderedDict()  # id -> (strategy, result), in LRU order
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self._hit_similarity_sum = 0.0
+        self._best_similarity_sum = 0.0
+        self._histogram = [0] * len(SIMILARITY_BUCKETS)
+
+    def _index_for(self, strategy: str, dimension: int):
+        import faiss
+
+        index = self._indexes.get(strategy)
+        if index is None:
+            index = faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+            self._indexes[strategy] = index
+        return index
+
+    def lookup(self, embedding, strategy: str):
+        """
+        Finds the most similar stored result for `strategy`.
+
+        Args:
+            embedding (np.ndarray): The normalized embedding of the new prompt.
+            strategy (str): The refinement strategy.
+
+        Returns:
+            tuple: `(result, similarity)` on a hit, otherwise `(None, best_similarity)`.
+        """
+        query = np.asarray(embedding, dtype="float32").reshape(1, -1)
+        with self._lock:
+            self.lookups += 1
+            index = self._indexes.get(strategy)
+            if index is None or index.ntotal == 0:
+                return None, 0.0
+
+            similarities, ids = index.search(query, 1)
+            similarity, entry_id = float(similarities[0][0]), int(ids[0][0])
+            self._best_similarity_sum += similarity
+            for bucket, upper in enumerate(SIMILARITY_BUCKETS):
+                if similarity <= upper:
+                    self._histogram[bucket] += 1
+                    break
+            else:
+                # Rounding can push an exact duplicate just above 1.0.
+                self._histogram[-1] += 1
+
+            if entry_id < 0 or similarity < self.threshold:
+                return None, similarity
+
+            self.hits += 1
+            self._hit_similarity_sum += similarity
+            self._entries.move_to_end(entry_id)
+            _, result = self._entries[entry_id]
+            return copy.deepcopy(result), similarity
+
+    def add(self, embedding, strategy: str, result: dict) -> None:
+        """
+        Stores a forge result under the embedding of its user prompt.
+
+        Args:
+            embedding (np.ndarray): The normalized embedding of the prompt.
+            strategy (str): The refinement strategy the result was forged with.
+            result (dict): The forge record.
+        """
+        vector = np.asarray(embedding, dtype="float32").reshape(1, -1)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index_for(strategy, vector.shape[1]).add_with_ids(
+                vector, np.array([entry_id], dtype="int64")
+            )
+            self._entries[entry_id] = (strategy, copy.deepcopy(result))
+
+            while len(self._entries) > self.capacity:
+                evicted_id, (evicted_strategy, _) = self._entries.popitem(last=False)
+                self._indexes[evicted_strategy].remove_ids(
+                    np.array([evicted_id], dtype="int64")
+                )
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Returns hit rate, similarity statistics and occupancy."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "evictions": self.evictions,
+                "mean_hit_similarity": (
+                    self._hit_similarity_sum / self.hits if self.hits else 0.0
+                ),
+                "mean_best_similarity": (
+                    self._best_similarity_sum / self.lookups if self.lookups else 0.0
+                ),
+                "similarity_histogram": dict(
+                    zip((f"<={upper}" for upper in SIMILARITY_BUCKETS), self._histogram)
+                ),
+            }
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a cache if PROMPTFORGE_SEMANTIC_CACHE is "1", otherwise returns None.
+
+        PROMPTFORGE_SEMANTIC_CACHE_THRESHOLD (default 0.92) and
+        PROMPTFORGE_SEMANTIC_CACHE_CAPACITY (default 10000) tune it.
+        """
+        if os.getenv("PROMPTFORGE_SEMANTIC_CACHE", "0") != "1":
+            return None
+        cache = cls(
+            threshold=float(os.getenv("PROMPTFORGE_SEMANTIC_CACHE_THRESHOLD", 0.92)),
+            capacity=int(os.getenv("PROMPTFORGE_SEMANTIC_CACHE_CAPACITY", 10000)),
+        )
+        logger.info(
+            f"Semantic cache enabled: threshold={cache.threshold}, capacity={cache.capacity}"
+        )
+        return cache
@@ -0,0 +1,237 @@
+"""
+HTTP API for the forge pipeline.
+
+Run with `uvicorn server:app`. Each worker process loads the embedding model and
+FAISS index once at startup and shares them across requests. Query embeddings of
+concurrent requests are encoded together in micro-batches, and identical requests
+in flight at the same time are answered by a single pipeline run.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+import engine
+from batching import Coalescer, MicroBatcher
+from metrics import get_metrics
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging for the server and the engine
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+class RetrieveRequest(BaseModel):
+    query: str = Field(min_length=1)
+    k: int = Field(default=3, ge=1, le=20)
+    strategy: Optional[str] = None
+    domain: Optional[str] = None
+    prompt_id_prefix: Optional[str] = None
+
+
+class RefineRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+    strategy: str
+    k: int = Field(default=3, ge=1, le=20)
+    domain: Optional[str] = None
+    # Skips retrieval, e.g. to reuse the result of /retrieve.
+    examples: Optional[list[str]] = None
+
+
+class GenerateRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+
+
+class EvaluateRequest(BaseModel):
+    user_prompt: str = Field(min_length=1)
+    original_output: str
+    refined_output: str
+
+
+class StrategiesRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+
+
+class ForgeRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+    # A key of engine.SYSTEM_PROMPTS, or engine.AUTO_STRATEGY to pick one.
+    strategy: str
+    k: int = Field(default=3, ge=1, le=20)
+    domain: Optional[str] = None
+    # Profiles the forge; the record lists the written profile files.
+    profile: bool = False
+
+
+class TournamentRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+    # Keys of engine.SYSTEM_PROMPTS; all of them when omitted.
+    strategies: Optional[list[str]] = None
+    k: int = Field(default=3, ge=1, le=20)
+    domain: Optional[str] = None
+    profile: bool = False
+
+
+def _system_prompt(strategy: str) -> str:
+    system_prompt = engine.SYSTEM_PROMPTS.get(strategy)
+    if not system_prompt:
+        raise HTTPException(status_code=400, detail=f"Invalid strategy: {strategy}")
+    return system_prompt
+
+
+async def _embed(request: Request, query: str):
+    """Returns the query's embedding, encoded together with concurrent queries."""
+    return await request.app.state.embedder.submit(query)
+
+
+async def _retrieve(request: Request, query: str, k: int, **filters) -> list:
+    embedding = await _embed(request, query)
+    query_embeddings = None if embedding is None else np.asarray(embedding).reshape(1, -1)
+    # FAISS search is CPU bound; keep it off the event loop.
+    examples = await asyncio.to_thread(
+        engine.retrieve_relevant_examples_batch,
+        [query],
+        k,
+        query_embeddings=query_embeddings,
+        **filters,
+    )
+    return examples[0]
+
+
+def create_app(warm_up: bool = True) -> FastAPI:
+    """
+    Builds the API application.
+
+    Args:
+        warm_up (bool): Load the embedding model and FAISS index before serving the
+            first request.
+
+    Returns:
+        FastAPI: The application.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if warm_up:
+            await asyncio.to_thread(engine.start_warmup().join)
+        # Look embed_queries up at call time so it can be replaced, e.g. by benchmarks.
+        app.state.embedder = MicroBatcher(
+            lambda queries: engine.embed_queries(queries),
+            max_batch_size=int(os.getenv("PROMPTFORGE_EMBED_BATCH_SIZE", 64)),
+            max_wait=float(os.getenv("PROMPTFORGE_EMBED_BATCH_WAIT_MS", 2)) / 1000,
+            name="embed",
+        )
+        app.state.forges = Coalescer("forge")
+        yield
+
+    app = FastAPI(title="PromptForge", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        return get_metrics().to_prometheus()
+
+    @app.post("/retrieve")
+    async def retrieve(body: RetrieveRequest, request: Request):
+        examples = await _retrieve(
+            request,
+            body.query,
+            body.k,
+            strategy=body.strategy,
+            domain=body.domain,
+            prompt_id_prefix=body.prompt_id_prefix,
+        )
+        return {"examples": examples}
+
+    @app.post("/refine")
+    async def refine(body: RefineRequest, request: Request):
+        system_prompt = _system_prompt(body.strategy)
+        examples = body.examples
+        if examples is None:
+            examples = await _retrieve(
+                request, body.prompt, body.k, strategy=body.strategy, domain=body.domain
+            )
+        refined_prompt = await engine.refine_prompt_async(
+            body.prompt,
+            system_prompt,
+            engine.assemble_refiner_examples(body.prompt, system_prompt, examples),
+        )
+        return {"refined_prompt": refined_prompt, "retrieved_examples": examples}
+
+    @app.post("/generate")
+    async def generate(body: GenerateRequest):
+        return {"output": await engine.get_llm_response_async(body.prompt)}
+
+    @app.post("/evaluate")
+    async def evaluate(body: EvaluateRequest):
+        return await engine.evaluate_outputs_async(
+            body.original_output, body.refined_output, body.user_prompt
+        )
+
+    @app.post("/strategies")
+    async def strategies(body: StrategiesRequest, request: Request):
+        embedding = await _embed(request, body.prompt)
+        ranking = [] if embedding is None else engine.rank_strategies(embedding)
+        if not ranking:
+            raise HTTPException(status_code=503, detail="Strategy selection is unavailable.")
+        return {"strategies": ranking}
+
+    @app.post("/forge")
+    async def forge(body: ForgeRequest, request: Request):
+        if body.strategy != engine.AUTO_STRATEGY:
+            _system_prompt(body.strategy)
+        elif not engine.auto_strategy_available():
+            raise HTTPException(
+                status_code=400,
+                detail="Strategy auto-selection is unavailable: no strategy classifier "
+                "knows the refinement strategies. Pick a strategy explicitly.",
+            )
+
+        async def run():
+            embedding = await _embed(request, body.prompt)
+            return await engine.forge_async(
+                body.prompt,
+                body.strategy,
+                body.k,
+                query_embedding=embedding,
+                domain=body.domain,
+                profile=body.profile or None,
+            )
+
+        key = json.dumps(body.model_dump(), sort_keys=True)
+        return await request.app.state.forges.run(key, run)
+
+    @app.post("/tournament")
+    async def tournament(body: TournamentRequest, request: Request):
+        for strategy in body.strategies or ():
+            _system_prompt(strategy)
+        embedding = await _embed(request, body.prompt)
+        return await engine.tournament_async(
+            body.prompt,
+            body.strategies,
+            body.k,
+            query_embedding=embedding,
+            domain=body.domain,
+            profile=body.profile or None,
+        )
+
+    return app
+
+
+app = create_app()
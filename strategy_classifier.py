@@ -0,0 +1,194 @@
+"""
+Local strategy classification from query embeddings.
+
+Each strategy is represented by the centroid of the embeddings of its knowledge
+base entries: their mean, scaled to unit length. A query is scored by its cosine
+similarity to every centroid. A softmax turns the similarities into confidences;
+its temperature is fitted on a sample of the training vectors. Ranking is one
+(strategies x dimension) matrix product over the embedding already computed for
+retrieval, so selecting a strategy costs microseconds and no LLM call.
+
+The classifier is trained when the index is built and saved next to it as an
+.npz file. The file holds the per-strategy embedding sums and counts, so entries
+appended later move the centroids without re-reading the old vectors.
+"""
+
+import numpy as np
+
+# Softmax temperatures tried when calibrating the confidences.
+TEMPERATURES = np.geomspace(0.005, 1.0, 48)
+
+# Training vectors kept (by reservoir sampling) to fit the temperature.
+CALIBRATION_SAMPLE_SIZE = 10_000
+
+
+class StrategyClassifier:
+    """
+    Nearest-centroid strategy classifier with softmax confidences.
+
+    Args:
+        labels (list): The strategy names.
+        sums (np.ndarray): Per strategy, the sum of its entries' embeddings.
+        counts (np.ndarray): Per strategy, the number of entries.
+        temperature (float): Softmax temperature applied to cosine similarities.
+    """
+
+    def __init__(self, labels: list, sums: np.ndarray, counts: np.ndarray, temperature: float):
+        self.labels = [str(label) for label in labels]
+        self.sums = np.asarray(sums, dtype="float64")
+        self.counts = np.asarray(counts, dtype="int64")
+        self.temperature = float(temperature)
+        centroids = self.sums / np.maximum(self.counts, 1)[:, None]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroids = (centroids / np.clip(norms, 1e-12, None)).astype("float32")
+
+    def probabilities(self, query_embeddings: np.ndarray, labels: list = None) -> np.ndarray:
+        """
+        Returns the confidence of each strategy for each query.
+
+        Args:
+            query_embeddings (np.ndarray): Normalized embeddings, shape (n, dimension).
+            labels (list, optional): Only score these strategies; the confidences
+                are normalized over them. Unknown names are ignored.
+
+        Returns:
+            np.ndarray: Shape (n, len(labels)); rows sum to one.
+        """
+        centroids = self.centroids
+        if labels is not None:
+            centroids = centroids[[self.labels.index(label) for label in labels]]
+        logits = np.asarray(query_embeddings, dtype="float32") @ centroids.T / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        weights = np.exp(logits)
+        return weights / weights.sum(axis=1, keepdims=True)
+
+    def rank(self, query_embeddings: np.ndarray, labels: list = None) -> list:
+        """
+        Ranks the strategies for each query.
+
+        Args:
+            query_embeddings (np.ndarray): Normalized embeddings, shape (n, dimension).
+            labels (list, optional): Only rank these strategies, see `probabilities`.
+
+        Returns:
+            list: Per query, `(strategy, confidence)` tuples, most likely first.
+        """
+        if labels is not None:
+            labels = [label for label in labels if label in self.labels]
+        names = self.labels if labels is None else labels
+        if not names:
+            return [[] for _ in range(len(query_embeddings))]
+        probabilities = self.probabilities(query_embeddings, labels)
+        order = np.argsort(-probabilities, axis=1, kind="stable")
+        return [
+            [(names[i], float(row[i])) for i in ranking]
+            for row, ranking in zip(probabilities, order)
+        ]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                labels=np.array(self.labels),
+                sums=self.sums,
+                counts=self.counts,
+                temperature=self.temperature,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "StrategyClassifier":
+        with np.load(path) as data:
+            return cls(
+                data["labels"].tolist(),
+                data["sums"],
+                data["counts"],
+                float(data["temperature"]),
+            )
+
+
+class StrategyClassifierTrainer:
+    """
+    Accumulates labelled embeddings in batches and fits a `StrategyClassifier`.
+
+    Memory is one sum per strategy plus a fixed-size sample for calibration.
+
+    Args:
+        base (StrategyClassifier, optional): A classifier whose sums and counts
+            are extended, e.g. when entries are appended to an index.
+        sample_size (int): Vectors kept to fit the softmax temperature.
+        seed (int): Seeds the reservoir sample.
+    """
+
+    def __init__(
+        self, base: StrategyClassifier = None, sample_size: int = CALIBRATION_SAMPLE_SIZE, seed=0
+    ):
+        self._sums = {}
+        self._counts = {}
+        if base is not None:
+            for label, total, count in zip(base.labels, base.sums, base.counts):
+                self._sums[label] = total.copy()
+                self._counts[label] = int(count)
+        self._base_temperature = base.temperature if base is not None else None
+        self._sample_size = sample_size
+        self._sample_vectors = None
+        self._sample_labels = []
+        self._seen = 0
+        self._random = np.random.default_rng(seed)
+
+    def add(self, labels: list, vectors: np.ndarray) -> None:
+        """Adds embeddings with their strategy labels."""
+        vectors = np.asarray(vectors, dtype="float32")
+        labels = np.asarray(labels)
+        for label in np.unique(labels):
+            mask = labels == label
+            total = vectors[mask].sum(axis=0, dtype="float64")
+            key = str(label)
+            self._sums[key] = self._sums.get(key, 0) + total
+            self._counts[key] = self._counts.get(key, 0) + int(mask.sum())
+        self._sample(labels, vectors)
+
+    def _sample(self, labels: np.ndarray, vectors: np.ndarray) -> None:
+        if self._sample_vectors is None:
+            self._sample_vectors = np.empty((self._sample_size, vectors.shape[1]), "float32")
+        seen = self._seen + np.arange(len(vectors))
+        slots = np.where(
+            seen < self._sample_size, seen, self._random.integers(0, seen + 1)
+        )
+        for row in np.flatnonzero(slots < self._sample_size):
+            slot = int(slots[row])
+            self._sample_vectors[slot] = vectors[row]
+            if slot < len(self._sample_labels):
+                self._sample_labels[slot] = str(labels[row])
+            else:
+                self._sample_labels.append(str(labels[row]))
+        self._seen += len(vectors)
+
+    def finish(self) -> StrategyClassifier:
+        """
+        Builds the classifier, fitting the temperature that minimizes the
+        log loss of the sampled vectors.
+
+        Returns:
+            StrategyClassifier: The classifier, or None if nothing was added.
+        """
+        labels = sorted(self._sums)
+        if not labels:
+            return None
+        classifier = StrategyClassifier(
+            labels,
+            np.stack([self._sums[label] for label in labels]),
+            np.array([self._counts[label] for label in labels]),
+            self._base_temperature or 0.05,
+        )
+        if self._sample_labels:
+            vectors = self._sample_vectors[: len(self._sample_labels)]
+            truth = np.array([labels.index(label) for label in self._sample_labels])
+            similarities = vectors @ classifier.centroids.T
+            losses = []
+            for temperature in TEMPERATURES:
+                logits = similarities / temperature
+                logits -= logits.max(axis=1, keepdims=True)
+                log_norm = np.log(np.exp(logits).sum(axis=1))
+                losses.append(float((log_norm - logits[np.arange(len(truth)), truth]).mean()))
+            classifier.temperature = float(TEMPERATURES[int(np.argmin(losses))])
+        return classifier
@@ -0,0 +1,639 @@
+"""
+Incremental construction of the knowledge base vector index.
+
+Every entry gets a stable 64-bit FAISS id derived from its `prompt_id`, and its
+embedding is stored in a SQLite sidecar together with a hash of the encoded text.
+Rebuilding therefore only re-encodes added or edited entries, and the index is
+patched in place by id instead of being rewritten from scratch.
+
+Next to the index a JSON manifest records the embedding model, dimension, entry
+count and a hash of the knowledge base, which the engine checks at load time.
+
+The index type is chosen with an index spec: "Flat" (exact), "IVF-Flat", "IVF-PQ",
+"HNSW", or any FAISS factory string such as "IVF1024,PQ48" or "HNSW64".
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = "knowledge_base_index.bin"
+MANIFEST_PATH = "knowledge_base_index.json"
+EMBEDDINGS_PATH = "knowledge_base_embeddings.sqlite3"
+METADATA_PATH = "knowledge_base_meta"
+BM25_PATH = "knowledge_base_bm25"
+STRATEGY_CLASSIFIER_PATH = "knowledge_base_strategies.npz"
+
+KNOWLEDGE_BASE_FIELDS = ("domain", "strategy", "prompt_id", "prompt_text", "explanation")
+
+INDEX_SPEC_ALIASES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+
+# FAISS k-means wants at least this many training points per centroid.
+MIN_POINTS_PER_CENTROID = 39
+
+
+def prompt_faiss_id(prompt_id: str) -> int:
+    """
+    Maps a prompt_id to the non-negative int64 id it is stored under in FAISS.
+
+    Args:
+        prompt_id (str): The knowledge base entry id.
+
+    Returns:
+        int: A stable id in [0, 2**63).
+    """
+    digest = hashlib.blake2b(prompt_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") & 0x7FFF_FFFF_FFFF_FFFF
+
+
+def text_hash(text: str) -> str:
+    """Hashes the text that is embedded for an entry."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def entry_hash(entry: dict) -> str:
+    """Hashes every field of an entry, so metadata edits are detected too."""
+    payload = json.dumps(
+        [entry.get(field) for field in KNOWLEDGE_BASE_FIELDS], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def knowledge_base_hash(knowledge_base: list) -> str:
+    """
+    Hashes a whole knowledge base independently of entry order.
+
+    Args:
+        knowledge_base (list): Knowledge base entries.
+
+    Returns:
+        str: A hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    for prompt_id, h in sorted((e["prompt_id"], entry_hash(e)) for e in knowledge_base):
+        digest.update(f"{prompt_id}\0{h}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_manifest(path: str = MANIFEST_PATH):
+    """
+    Reads an index manifest.
+
+    Returns:
+        dict: The manifest, or None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _atomic_write(path: str, write) -> None:
+    """Writes through a temporary file so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingStore:
+    """
+    SQLite sidecar holding one embedding per prompt_id.
+
+    Args:
+        path (str): The database file.
+    """
+
+    def __init__(self, path: str = EMBEDDINGS_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS store_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS embeddings (
+                prompt_id TEXT PRIMARY KEY,
+                faiss_id INTEGER NOT NULL UNIQUE,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL
+            );
+            """
+        )
+
+    def get_meta(self, key: str):
+        row = self._conn.execute(
+            "SELECT value FROM store_meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO store_meta VALUES (?, ?)", (key, str(value))
+        )
+
+    def hashes(self) -> dict:
+        """Returns `{prompt_id: text_hash}` for every stored embedding."""
+        return dict(self._conn.execute("SELECT prompt_id, text_hash FROM embeddings"))
+
+    def upsert(self, prompt_ids: list, hashes: list, vectors: np.ndarray) -> None:
+        rows = [
+            (pid, prompt_faiss_id(pid), h, np.asarray(v, dtype="float32").tobytes())
+            for pid, h, v in zip(prompt_ids, hashes, vectors)
+        ]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows
+        )
+
+    def delete(self, prompt_ids: list) -> None:
+        self._conn.executemany(
+            "DELETE FROM embeddings WHERE prompt_id = ?", [(pid,) for pid in prompt_ids]
+        )
+
+    def clear(self) -> None:
+        self._conn.execute("DELETE FROM embeddings")
+
+    def iter_vectors(self, dimension: int, batch_size: int = 10000):
+        """
+        Yields stored embeddings in batches.
+
+        Yields:
+            tuple: `(faiss_ids, vectors)` as int64 and float32 arrays.
+        """
+        cursor = self._conn.execute("SELECT faiss_id, vector FROM embeddings")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            ids = np.fromiter((r[0] for r in rows), dtype="int64", count=len(rows))
+            vectors = np.frombuffer(b"".join(r[1] for r in rows), dtype="float32")
+            yield ids, vectors.reshape(len(rows), dimension)
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def sample_vectors(self, size: int, dimension: int) -> np.ndarray:
+        """Returns up to `size` stored embeddings chosen at random."""
+        rows = self._conn.execute(
+            "SELECT vector FROM embeddings ORDER BY RANDOM() LIMIT ?", (size,)
+        ).fetchall()
+        vectors = np.frombuffer(b"".join(r[0] for r in rows), dtype="float32")
+        return vectors.reshape(len(rows), dimension)
+
+    def vectors_for(self, prompt_ids: list, dimension: int):
+        """
+        Looks up the stored embeddings of specific entries.
+
+        Returns:
+            tuple: `(faiss_ids, vectors)` as int64 and float32 arrays.
+        """
+        rows = []
+        for start in range(0, len(prompt_ids), 500):
+            chunk = prompt_ids[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(
+                self._conn.execute(
+                    f"SELECT faiss_id, vector FROM embeddings WHERE prompt_id IN ({placeholders})",
+                    chunk,
+                )
+            )
+        ids = np.fromiter((r[0] for r in rows), dtype="int64", count=len(rows))
+        vectors = np.frombuffer(b"".join(r[1] for r in rows), dtype="float32")
+        return ids, vectors.reshape(len(rows), dimension)
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def resolve_index_spec(spec: str, count: int, dimension: int) -> str:
+    """
+    Turns an index spec into a FAISS factory string sized for the corpus.
+
+    The aliases pick parameters from the corpus size: IVF uses about 4*sqrt(n) lists,
+    PQ uses one 8-bit sub-quantizer per 8 dimensions (fewer bits for small corpora),
+    HNSW uses 32 links per node. Corpora too small to train IVF fall back to Flat.
+    Indexes without native id support are wrapped in IDMap2.
+
+    Args:
+        spec (str): An alias from `INDEX_SPEC_ALIASES` or a FAISS factory string.
+        count (int): The number of vectors the index will hold.
+        dimension (int): The embedding dimension.
+
+    Returns:
+        str: A FAISS factory string.
+    """
+    alias = spec.strip().lower()
+    if alias in ("ivf-flat", "ivf-pq"):
+        nlist = min(int(4 * math.sqrt(max(count, 1))), count // MIN_POINTS_PER_CENTROID)
+        if nlist < 2:
+            logger.warning(f"{count} entries are too few to train {spec}; using Flat.")
+            alias = "flat"
+        elif alias == "ivf-flat":
+            spec = f"IVF{nlist},Flat"
+        else:
+            m = max(1, dimension // 8)
+            while dimension % m:
+                m -= 1
+            nbits = max(4, min(8, int(math.log2(count / MIN_POINTS_PER_CENTROID))))
+            spec = f"IVF{nlist},PQ{m}x{nbits}"
+    if alias == "flat":
+        spec = "Flat"
+    elif alias == "hnsw":
+        spec = "HNSW32"
+
+    if "IVF" not in spec and not spec.startswith("IDMap"):
+        spec = f"IDMap2,{spec}"
+    return spec
+
+
+def create_index(factory_string: str, dimension: int):
+    """Creates an empty inner-product index from a FAISS factory string."""
+    import faiss
+
+    return faiss.index_factory(dimension, factory_string, faiss.METRIC_INNER_PRODUCT)
+
+
+def apply_search_params(index, nprobe: int = None, ef_search: int = None) -> dict:
+    """
+    Sets query-time accuracy/speed knobs on an index.
+
+    Parameters the index type does not have (e.g. nprobe on HNSW) are skipped.
+
+    Args:
+        index: A FAISS index, possibly wrapped in an IDMap.
+        nprobe (int, optional): Inverted lists visited per query (IVF indexes).
+        ef_search (int, optional): Candidate list size during search (HNSW indexes).
+
+    Returns:
+        dict: The parameters that were applied.
+    """
+    import faiss
+
+    space = faiss.ParameterSpace()
+    applied = {}
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            space.set_index_parameter(index, name, value)
+            applied[name] = value
+        except RuntimeError:
+            logger.debug(f"Index does not support {name}; ignoring it.")
+    return applied
+
+
+def filtered_search_params(index, ids: np.ndarray, k: int):
+    """
+    Builds search parameters that restrict a search to the given ids.
+
+    Approximate indexes only see a fraction of the allowed ids per probed list or
+    graph hop, so nprobe (IVF) and efSearch (HNSW) are scaled up by the inverse of
+    the allowed fraction, keeping the expected number of matching candidates the
+    same as for an unfiltered search. Small partitions end up searched exhaustively.
+
+    Args:
+        index: A FAISS index, possibly wrapped in an IDMap.
+        ids (np.ndarray): The allowed ids.
+        k (int): The number of results that will be requested.
+
+    Returns:
+        faiss.SearchParameters: Parameters for `index.search(..., params=...)`.
+    """
+    import faiss
+
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype="int64"))
+    fraction = max(len(ids), 1) / max(index.ntotal, 1)
+    inner = index
+    if isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(inner.index)
+    if isinstance(inner, faiss.IndexIVF):
+        nprobe = min(inner.nlist, math.ceil(inner.nprobe / fraction))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        ef_search = max(inner.hnsw.efSearch, k)
+        ef_search = min(max(index.ntotal, k), math.ceil(ef_search / fraction))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # The SWIG wrapper does not own the selector; tie their lifetimes together.
+    params.selector_ref = selector
+    return params
+
+
+def enable_reconstruction(index) -> bool:
+    """
+    Lets `reconstruct_vectors` look up stored vectors by id.
+
+    Flat and HNSW indexes support this already; IVF indexes get a hash table from
+    id to inverted list position. Modifies the index, so call it before the index
+    is shared between threads.
+
+    Returns:
+        bool: Whether the index can reconstruct vectors. A plain IDMap over an
+            index without per-id storage cannot.
+    """
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return True
+    if index.ntotal == 0:
+        return True
+    try:
+        index.reconstruct_batch(_any_id(index))
+        return True
+    except RuntimeError:
+        return False
+
+
+def _any_id(index) -> np.ndarray:
+    import faiss
+
+    id_map = getattr(index, "id_map", None)
+    if id_map is not None and id_map.size():
+        return faiss.vector_to_array(id_map)[:1]
+    return np.zeros(1, dtype="int64")
+
+
+def reconstruct_vectors(index, ids: np.ndarray) -> np.ndarray:
+    """
+    Returns the stored vectors of the given ids.
+
+    Args:
+        index: A FAISS index prepared with `enable_reconstruction`.
+        ids (np.ndarray): Ids of any shape; negative ids (search padding) give zeros.
+
+    Returns:
+        np.ndarray: float32 vectors of shape `ids.shape + (index.d,)`. PQ indexes
+            return their quantized approximation.
+
+    Raises:
+        RuntimeError: If the index cannot reconstruct vectors by id.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    flat = ids.reshape(-1)
+    valid = flat >= 0
+    vectors = np.zeros((len(flat), index.d), dtype="float32")
+    if valid.any():
+        vectors[valid] = index.reconstruct_batch(flat[valid])
+    return vectors.reshape(ids.shape + (index.d,))
+
+
+def maximal_marginal_relevance(
+    query_embeddings: np.ndarray,
+    candidate_vectors: np.ndarray,
+    valid: np.ndarray,
+    k: int,
+    lambda_: float = 0.7,
+    relevance: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Picks k diverse candidates per query with maximal marginal relevance.
+
+    Each step selects the candidate maximizing `lambda_ * sim(query, c) -
+    (1 - lambda_) * max(sim(c, selected))`. All queries are processed at once; the
+    only loop runs over the k picks.
+
+    Args:
+        query_embeddings (np.ndarray): Normalized queries, shape (q, d).
+        candidate_vectors (np.ndarray): Normalized candidates, shape (q, n, d).
+        valid (np.ndarray): Boolean mask of real candidates, shape (q, n).
+        k (int): The number of candidates to pick per query.
+        lambda_ (float): 1 ranks by relevance only, 0 by diversity only.
+        relevance (np.ndarray, optional): Relevance of each candidate, shape (q, n),
+            used instead of the query-candidate cosine similarity.
+
+    Returns:
+        np.ndarray: Positions into each query's candidates, shape (q, min(k, n)), in
+            pick order; -1 where a query has fewer valid candidates.
+    """
+    queries, n = valid.shape
+    k = min(k, n)
+    if relevance is None:
+        relevance = np.einsum("qnd,qd->qn", candidate_vectors, query_embeddings)
+    similarity = np.matmul(candidate_vectors, candidate_vectors.transpose(0, 2, 1))
+
+    rows = np.arange(queries)
+    available = valid.copy()
+    redundancy = np.zeros((queries, n), dtype="float32")
+    picks = np.full((queries, k), -1, dtype="int64")
+    for step in range(k):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = np.argmax(scores, axis=1)
+        found = available[rows, best]
+        picks[found, step] = best[found]
+        available[rows[found], best[found]] = False
+        picked = similarity[rows[found], :, best[found]]
+        # Before the first pick there is nothing to be redundant with, and a later
+        # maximum must not be clipped at zero by that starting value.
+        redundancy[found] = picked if step == 0 else np.maximum(redundancy[found], picked)
+    return picks
+
+
+def _rebuild_from_store(
+    store: EmbeddingStore, dimension: int, factory_string: str, train_size: int
+):
+    """Builds a fresh index from the sidecar without re-encoding anything."""
+    index = create_index(factory_string, dimension)
+    if not index.is_trained:
+        sample = store.sample_vectors(train_size, dimension)
+        print(f"Training {factory_string} on {len(sample)} sampled vectors...")
+        index.train(sample)
+    for ids, vectors in store.iter_vectors(dimension):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def build_index(
+    knowledge_base: list,
+    model,
+    model_name: str,
+    index_path: str = INDEX_PATH,
+    manifest_path: str = MANIFEST_PATH,
+    embeddings_path: str = EMBEDDINGS_PATH,
+    batch_size: int = 256,
+    index_spec: str = "Flat",
+    train_size: int = 100_000,
+    metadata_path: str = METADATA_PATH,
+    embedding_backend: str = "torch",
+    bm25_path: str = BM25_PATH,
+    strategy_classifier_path: str = STRATEGY_CLASSIFIER_PATH,
+) -> dict:
+    """
+    Brings the FAISS index and manifest in line with `knowledge_base`.
+
+    Only entries whose prompt text is new or changed are encoded. Removed and
+    changed entries are deleted from the existing index by id and re-added; the
+    index is rebuilt from stored embeddings only when it cannot be patched.
+
+    Args:
+        knowledge_base (list): Entries with domain, strategy, prompt_id, prompt_text
+            and explanation.
+        model: A loaded SentenceTransformer or `OnnxEmbedder`.
+        model_name (str): The model's name, recorded in the manifest.
+        index_path (str): Where the FAISS index is written.
+        manifest_path (str): Where the manifest is written.
+        embeddings_path (str): The SQLite embedding sidecar.
+        batch_size (int): Entries encoded per `model.encode` call.
+        index_spec (str): The index type, see `resolve_index_spec`. Changing it
+            forces a rebuild from stored embeddings.
+        train_size (int): The maximum number of vectors sampled to train IVF/PQ indexes.
+        metadata_path (str): Directory of the memory-mappable metadata store.
+        embedding_backend (str): "torch", "onnx" or "onnx-int8", recorded in the
+            manifest. Changing it re-encodes every entry.
+        bm25_path (str): Directory of the BM25 index over the prompt texts.
+        strategy_classifier_path (str): Where the strategy classifier trained on
+            the stored embeddings is written.
+
+    Returns:
+        dict: Counts of added, updated, removed and unchanged entries.
+
+    Raises:
+        ValueError: If two entries share a prompt_id (or, vanishingly rarely, a FAISS id).
+    """
+    import faiss
+
+    wanted = {}
+    for entry in knowledge_base:
+        prompt_id = entry["prompt_id"]
+        if prompt_id in wanted:
+            raise ValueError(f"Duplicate prompt_id in knowledge base: {prompt_id}")
+        wanted[prompt_id] = (entry["prompt_text"], text_hash(entry["prompt_text"]))
+    if len({prompt_faiss_id(pid) for pid in wanted}) != len(wanted):
+        raise ValueError("Two prompt_ids hash to the same FAISS id; rename one of them.")
+
+    dimension = model.get_sentence_embedding_dimension()
+    store = EmbeddingStore(embeddings_path)
+    try:
+        if (
+            store.get_meta("model") != model_name
+            or store.get_meta("dimension") != str(dimension)
+            or (store.get_meta("embedding_backend") or "torch") != embedding_backend
+        ):
+            # Embeddings from another model (or backend) live in a different space.
+            store.clear()
+            store.set_meta("model", model_name)
+            store.set_meta("dimension", dimension)
+            store.set_meta("embedding_backend", embedding_backend)
+
+        stored = store.hashes()
+        added = [pid for pid in wanted if pid not in stored]
+        updated = [pid for pid in wanted if pid in stored and stored[pid] != wanted[pid][1]]
+        removed = [pid for pid in stored if pid not in wanted]
+
+        to_encode = added + updated
+        for start in range(0, len(to_encode), batch_size):
+            batch = to_encode[start : start + batch_size]
+            print(f"Encoding entries {start + 1}-{start + len(batch)} of {len(to_encode)}...")
+            vectors = model.encode(
+                [wanted[pid][0] for pid in batch],
+                convert_to_tensor=False,
+                normalize_embeddings=True,
+            )
+            store.upsert(batch, [wanted[pid][1] for pid in batch], vectors)
+        store.delete(removed)
+        store.commit()
+
+        manifest = read_manifest(manifest_path)
+        index = None
+        if (
+            manifest is not None
+            and manifest.get("model") == model_name
+            and manifest.get("embedding_backend", "torch") == embedding_backend
+            and manifest.get("dimension") == dimension
+            and manifest.get("index_spec", "Flat") == index_spec
+            and os.path.exists(index_path)
+        ):
+            index = faiss.read_index(index_path)
+            stale = np.array(
+                [prompt_faiss_id(pid) for pid in updated + removed], dtype="int64"
+            )
+            try:
+                if len(stale):
+                    index.remove_ids(stale)
+                if to_encode:
+                    ids, vectors = store.vectors_for(to_encode, dimension)
+                    index.add_with_ids(vectors, ids)
+            except RuntimeError as e:
+                logger.warning(f"Index cannot be patched in place ({e}), rebuilding.")
+                index = None
+        if index is not None and index.ntotal != len(wanted):
+            index = None
+
+        factory_string = resolve_index_spec(index_spec, len(wanted), dimension)
+        if index is None:
+            print(f"Rebuilding {factory_string} index from stored embeddings...")
+            index = _rebuild_from_store(store, dimension, factory_string, train_size)
+        else:
+            # A patched index keeps the layout it was trained with.
+            factory_string = manifest.get("index_factory", factory_string)
+
+        _atomic_write(index_path, lambda p: faiss.write_index(index, p))
+
+        from lexical_index import write_bm25_index
+        from metadata_store import write_metadata_store
+
+        faiss_ids = [prompt_faiss_id(entry["prompt_id"]) for entry in knowledge_base]
+        write_metadata_store(metadata_path, faiss_ids, knowledge_base)
+        write_bm25_index(
+            bm25_path, faiss_ids, [entry["prompt_text"] for entry in knowledge_base]
+        )
+        from strategy_classifier import StrategyClassifierTrainer
+
+        strategies = {
+            prompt_faiss_id(entry["prompt_id"]): entry["strategy"] for entry in knowledge_base
+        }
+        trainer = StrategyClassifierTrainer()
+        for ids, vectors in store.iter_vectors(dimension):
+            trainer.add([strategies[int(i)] for i in ids], vectors)
+        classifier = trainer.finish()
+        if classifier is not None:
+            _atomic_write(strategy_classifier_path, classifier.save)
+        manifest = {
+            "model": model_name,
+            "embedding_backend": embedding_backend,
+            "dimension": dimension,
+            "count": int(index.ntotal),
+            "hash": knowledge_base_hash(knowledge_base),
+            "index_file": os.path.basename(index_path),
+            "index_spec": index_spec,
+            "index_factory": factory_string,
+            "metadata": os.path.basename(metadata_path),
+            "bm25": os.path.basename(bm25_path),
+            "strategy_classifier": (
+                os.path.basename(strategy_classifier_path) if classifier is not None else None
+            ),
+            "id_scheme": "blake2b-64(prompt_id)",
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+
+        def write_manifest(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+        _atomic_write(manifest_path, write_manifest)
+    finally:
+        store.close()
+
+    stats = {
+        "added": len(added),
+        "updated": len(updated),
+        "removed": len(removed),
+        "unchanged": len(wanted) - len(added) - len(updated),
+    }
+    logger.info(f"Index build finished: {stats}")
+    return stats